@@ -0,0 +1,259 @@
+'''
+Benchmarks for the processing functions in gprpy.toolbox.gprpyTools.
+
+Creates synthetic profiles of several sizes, runs each processing
+function on them, and records the run time and the peak memory
+allocated during the run. The results are written to a JSON file
+such that runs for different commits can be compared:
+
+python benchmarks/benchmarkTools.py --out bench_new.json
+python benchmarks/benchmarkTools.py --out bench_new.json --compare bench_old.json
+
+Sizes are given as samples x traces, for example
+--sizes 512x10000 2048x200000. Stacked amplitudes are calculated
+for the first --cwtraces traces of each synthetic profile, as for a
+CMP or WARR data set. GPRPy needs to be installed (or the GPRPy
+directory be in the PYTHONPATH) to run the benchmarks.
+'''
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+import gprpy.toolbox.gprpyTools as tools
+
+
+def makeProfile(nsamp,ntraces,dtype='float64',seed=0):
+    '''
+    Creates a synthetic profile with a direct arrival, a few dipping
+    reflectors, a diffraction hyperbola, and noise.
+
+    INPUT:
+    nsamp       number of samples per trace
+    ntraces     number of traces
+    dtype       floating point type of the data [default: 'float64']
+    seed        seed for the random noise [default: 0]
+
+    OUTPUT:
+    data        data matrix whose columns contain the traces
+    profilePos  along-profile coordinates of the traces, in m
+    twtt        two-way travel times of the samples, in ns
+    '''
+    rng = np.random.default_rng(seed)
+    twtt = np.linspace(0,100,nsamp)
+    profilePos = np.linspace(0,0.05*ntraces,ntraces)
+    data = (0.1*rng.standard_normal((nsamp,ntraces))).astype(dtype)
+    # Add a few wavelets, one trace block at a time to limit memory
+    arrivals = [lambda x: 5.0+0*x,
+                lambda x: 20.0+0.01*x,
+                lambda x: 45.0-0.005*x,
+                lambda x: np.sqrt(60.0**2+(2*(x-profilePos[-1]/2)/0.1)**2)]
+    blocklen = 4096
+    t = twtt.reshape((-1,1))
+    for start in range(0,ntraces,blocklen):
+        x = profilePos[start:start+blocklen].reshape((1,-1))
+        for arrival in arrivals:
+            shift = t - arrival(x)
+            data[:,start:start+blocklen] += np.exp(-(shift/0.8)**2)*np.cos(2*np.pi*shift/2.5)
+    return data, profilePos, twtt
+
+
+def benchmarkCases(data,profilePos,twtt,cwtraces,nvel):
+    '''
+    Lists the function calls to benchmark for one synthetic profile.
+
+    INPUT:
+    data        data matrix whose columns contain the traces
+    profilePos  along-profile coordinates of the traces
+    twtt        two-way travel times of the samples
+    cwtraces    number of traces used for the stacked amplitudes
+    nvel        number of velocities for the stacked amplitudes
+
+    OUTPUT:
+    cases       list of (name, function without arguments)
+    '''
+    topoPos = np.linspace(profilePos[0],profilePos[-1],50)
+    # prepTopo returns the elevations as a column
+    topoVal = 0.5*np.sin(topoPos/max(profilePos[-1],1e-3)*2*np.pi).reshape((-1,1))
+    cwdata = data[:,0:cwtraces]
+    cwpos = profilePos[0:cwtraces]
+    vVals = np.linspace(0.02,0.3,nvel)
+    cases = [
+        ('dewow', lambda: tools.dewow(data,50)),
+        ('smooth', lambda: tools.smooth(data,20)),
+        ('remMeanTrace', lambda: tools.remMeanTrace(data,500)),
+        ('profileSmooth', lambda: tools.profileSmooth(data,profilePos,8,4)),
+        ('tpowGain', lambda: tools.tpowGain(data,twtt,1.5)),
+        ('agcGain', lambda: tools.agcGain(data,50)),
+        ('alignTraces', lambda: tools.alignTraces(data)),
+        ('correctTopo', lambda: tools.correctTopo(data,0.1,profilePos,topoPos,topoVal,twtt)),
+        ('linStackedAmplitude', lambda: tools.linStackedAmplitude(cwdata,cwpos,twtt,vVals,twtt,1)),
+        ('hypStackedAmplitude', lambda: tools.hypStackedAmplitude(cwdata,cwpos,twtt,vVals,twtt,2)),
+    ]
+    return cases
+
+
+def measure(func,repeat=1):
+    '''
+    Runs func repeat times and measures the time and the peak memory
+    allocated while running. Printed output and progress bars of the
+    toolbox functions are suppressed.
+
+    INPUT:
+    func        function without arguments
+    repeat      how many times to run it [default: 1]
+
+    OUTPUT:
+    seconds     shortest run time, in seconds
+    peakmb      largest peak of memory allocated during a run, in MB
+    '''
+    seconds = np.inf
+    peak = 0
+    for i in range(0,repeat):
+        sink = io.StringIO()
+        with contextlib.redirect_stdout(sink), contextlib.redirect_stderr(sink):
+            tracemalloc.start()
+            start = time.perf_counter()
+            result = func()
+            seconds = min(seconds,time.perf_counter()-start)
+            peak = max(peak,tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        del result
+    return seconds, peak/2**20
+
+
+def parseSize(size):
+    '''
+    Turns a size string like "512x10000" into (512, 10000)
+    '''
+    nsamp, ntraces = size.lower().split('x')
+    return int(nsamp), int(ntraces)
+
+
+def gitCommit():
+    '''
+    Returns the current git commit hash of the GPRPy source,
+    or None if it can't be determined.
+    '''
+    try:
+        out = subprocess.run(['git','rev-parse','HEAD'],capture_output=True,text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def runBenchmarks(sizes,dtype='float64',repeat=1,cwtraces=200,nvel=35,only=None):
+    '''
+    Runs all benchmarks for all profile sizes.
+
+    INPUT:
+    sizes       list of (nsamp, ntraces)
+    dtype       floating point type of the synthetic data
+                [default: 'float64']
+    repeat      how many times to run each function [default: 1]
+    cwtraces    number of traces used for the stacked amplitudes
+                [default: 200]
+    nvel        number of velocities for the stacked amplitudes
+                [default: 35]
+    only        list of function names to run [default: None,
+                meaning all]
+
+    OUTPUT:
+    results     dict with information about the run and a list
+                of results
+    '''
+    results = {'date': datetime.datetime.now().isoformat(timespec='seconds'),
+               'commit': gitCommit(),
+               'python': platform.python_version(),
+               'numpy': np.__version__,
+               'platform': platform.platform(),
+               'dtype': dtype,
+               'results': []}
+    for nsamp, ntraces in sizes:
+        data, profilePos, twtt = makeProfile(nsamp,ntraces,dtype)
+        for name, func in benchmarkCases(data,profilePos,twtt,min(cwtraces,ntraces),nvel):
+            if only is not None and name not in only:
+                continue
+            seconds, peakmb = measure(func,repeat)
+            results['results'].append({'function': name,
+                                       'nsamp': nsamp,
+                                       'ntraces': ntraces,
+                                       'seconds': seconds,
+                                       'peak_mb': peakmb})
+            print("%-20s %5d x %-7d %10.3f s %10.1f MB" %(name,nsamp,ntraces,seconds,peakmb))
+        del data
+    return results
+
+
+def compareResults(new,old,tolerance=0.2):
+    '''
+    Compares two benchmark results and lists the cases that got
+    slower or need more memory by more than the given tolerance.
+
+    INPUT:
+    new         results of the current run
+    old         results of an earlier run
+    tolerance   allowed relative increase [default: 0.2, meaning 20%]
+
+    OUTPUT:
+    regressions list of strings describing the regressions
+    '''
+    oldres = {(r['function'],r['nsamp'],r['ntraces']): r for r in old['results']}
+    regressions = []
+    for r in new['results']:
+        key = (r['function'],r['nsamp'],r['ntraces'])
+        if key not in oldres:
+            continue
+        o = oldres[key]
+        for field, unit in [('seconds','s'),('peak_mb','MB')]:
+            if o[field] > 0 and r[field] > (1+tolerance)*o[field]:
+                regressions.append("%s %dx%d: %s %.3g %s -> %.3g %s (%+.0f%%)"
+                                   %(key[0],key[1],key[2],field,o[field],unit,r[field],unit,
+                                     100*(r[field]/o[field]-1)))
+    return regressions
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Benchmark the GPRPy processing functions")
+    parser.add_argument('--sizes',nargs='+',default=['512x10000','1024x50000','2048x200000'],
+                        help='profile sizes as samples x traces [default: 512x10000 1024x50000 2048x200000]')
+    parser.add_argument('--dtype',default='float64',help='data type, float64 or float32 [default: float64]')
+    parser.add_argument('--repeat',type=int,default=1,help='runs per function, the fastest counts [default: 1]')
+    parser.add_argument('--cwtraces',type=int,default=200,help='traces used for stacked amplitudes [default: 200]')
+    parser.add_argument('--nvel',type=int,default=35,help='velocities for stacked amplitudes [default: 35]')
+    parser.add_argument('--only',nargs='+',default=None,help='only run these functions')
+    parser.add_argument('--out',default='bench_output.json',help='JSON output file [default: bench_output.json]')
+    parser.add_argument('--compare',default=None,help='JSON file of an earlier run to compare against')
+    parser.add_argument('--tolerance',type=float,default=0.2,
+                        help='allowed relative slowdown or memory increase [default: 0.2]')
+    args = parser.parse_args(args)
+
+    results = runBenchmarks([parseSize(s) for s in args.sizes],args.dtype,args.repeat,
+                            args.cwtraces,args.nvel,args.only)
+    with open(args.out,'w') as f:
+        json.dump(results,f,indent=1)
+    print("Wrote " + args.out)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            old = json.load(f)
+        regressions = compareResults(results,old,args.tolerance)
+        if regressions:
+            print("Regressions compared to %s:" %(args.compare))
+            for reg in regressions:
+                print("  " + reg)
+            return 1
+        print("No regressions compared to %s" %(args.compare))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+'''
+Checks that streamProfile.streamProcess gives the same result as
+processing the whole profile at once, for block sizes that leave
+a short last block:
+
+python benchmarks/checkStreaming.py
+python benchmarks/checkStreaming.py --file mydata.DZT --blocks 1000 1039
+
+Without --file, the GSSI example profile is used. GPRPy needs to be
+installed (or the GPRPy directory be in the PYTHONPATH).
+'''
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import numpy as np
+import gprpy.gprpy as gp
+import gprpy.streamProfile as stream
+
+exampleFile = os.path.join(os.path.dirname(os.path.abspath(gp.__file__)),
+                           "exampledata","GSSI","FILE____032.DZT")
+
+
+def checkStreaming(filename,steps,blocks,tolerance=1e-9):
+    '''
+    Processes a data file with streamProcess for several block sizes
+    and compares the results to processing the whole profile.
+
+    INPUT:
+    filename    name of any data file gprpyProfile.importdata can read
+    steps       list of processing steps, as for streamProcess
+    blocks      list of block sizes to check
+    tolerance   largest allowed absolute difference [default: 1e-9]
+
+    OUTPUT:
+    failures    list of strings describing the block sizes whose
+                results differ
+    '''
+    with contextlib.redirect_stdout(io.StringIO()):
+        gpr = gp.gprpyProfile()
+        gpr.importdata(filename)
+        for step in steps:
+            getattr(gpr,step[0])(*step[1:])
+    whole = np.asarray(gpr.data)
+    failures = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        outfile = os.path.join(tmpdir,"streamed.npy")
+        for block in blocks:
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                stream.streamProcess(filename,outfile,steps,block=block)
+            diff = np.max(np.abs(np.load(outfile)-whole))
+            print("block %6d: largest difference %g" %(block,diff))
+            if not diff <= tolerance:
+                failures.append("block %d: largest difference %g" %(block,diff))
+    return failures
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Compare streamed processing to whole-profile processing")
+    parser.add_argument('--file',default=exampleFile,help='data file [default: GSSI example profile]')
+    parser.add_argument('--blocks',nargs='+',type=int,default=None,
+                        help='block sizes [default: sizes that leave a last block of 1, 40, and 150 traces]')
+    args = parser.parse_args(args)
+    steps = [("dewow",10), ("remMeanTrace",100), ("agcGain",20)]
+    blocks = args.blocks
+    if blocks is None:
+        ntraces = stream.openProfile(args.file).data.shape[-1]
+        blocks = [ntraces-1, ntraces-40, ntraces-150, 250]
+    failures = checkStreaming(args.file,steps,blocks)
+    if failures:
+        print("Streamed processing differs from whole-profile processing:")
+        for failure in failures:
+            print("  " + failure)
+        return 1
+    print("Streamed processing matches whole-profile processing")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,264 @@
+import gprpy.gprpy as gp
+import gprpy.toolbox.gprIO_GPR as gprIO_GPR
+import gprpy.toolbox.archiveFiles as archiveFiles
+import argparse
+import concurrent.futures as futures
+import contextlib
+import io
+import numpy as np
+import os
+import sys
+import time
+from tqdm import tqdm
+
+# Data file extensions and the header files that belong to them
+dataExtensions = {".DZT": [],
+                  ".DT1": [".HD"],
+                  ".dt1": [".hd"],
+                  ".rd3": [".rad"],
+                  ".rd7": [".rad"],
+                  ".dat": [".GPRhdr"],
+                  ".sgy": [],
+                  ".segy": [],
+                  ".SGY": [],
+                  ".SEGY": []}
+
+
+def findDataFiles(paths):
+    '''
+    Helper function. Lists all raw data files in the given files,
+    zip archives and directories (including subdirectories).
+
+    INPUT:
+    paths      list of data file names, zip archives and directories
+
+    OUTPUT:
+    list of (data file name, directory it was found in)
+    '''
+    return [(filename,basedir) for filename, basedir in archiveFiles.walkFiles(paths)
+            if isDataFile(filename)]
+
+
+def isDataFile(filename):
+    '''
+    Helper function. Checks if filename is a raw data file whose
+    header files exist.
+    '''
+    file_name, file_ext = os.path.splitext(filename)
+    if file_ext not in dataExtensions:
+        return False
+    return all(archiveFiles.exists(file_name + ext) for ext in dataExtensions[file_ext])
+
+
+def sourceFiles(filename):
+    '''
+    Helper function. Returns the data file and its header files.
+    '''
+    file_name, file_ext = os.path.splitext(filename)
+    return [filename] + [file_name + ext for ext in dataExtensions[file_ext]]
+
+
+def outputName(filename,basedir,outdir=None):
+    '''
+    Helper function. Name of the .gpr file for a data file. Files
+    from a zip archive go into a directory named like the archive.
+    '''
+    archive, member = archiveFiles.splitArchive(filename)
+    if member is None:
+        file_name = os.path.splitext(filename)[0]
+    else:
+        file_name = os.path.join(os.path.splitext(archive)[0],os.path.splitext(member)[0])
+    if outdir is None:
+        return file_name + ".gpr"
+    relname = os.path.relpath(file_name,basedir)
+    return os.path.join(outdir,relname + ".gpr")
+
+
+def sourceStamps(filename):
+    '''
+    Helper function. Returns the name, modification time, and size
+    of the data file and its header files.
+    '''
+    return [[os.path.basename(src),archiveFiles.fileTime(src),archiveFiles.fileSize(src)]
+            for src in sourceFiles(filename)]
+
+
+def convertOptions(dtype='float64',compress=None,quantize=None):
+    '''
+    Helper function. The options a data file is converted with,
+    as stored in the header of the .gpr file.
+    '''
+    return {"dtype": str(np.dtype(dtype)), "compress": compress, "quantize": quantize}
+
+
+def upToDate(filename,outfile,dtype='float64',compress=None,quantize=None):
+    '''
+    Checks if outfile was converted from the current version of the
+    data file and its header files, with the same options: the
+    modification times and sizes of the files, and the options,
+    have to be the ones stored in the header of outfile.
+
+    INPUT:
+    filename   raw data file name
+    outfile    .gpr file name
+    dtype      floating point precision of the data [default: 'float64']
+    compress   compression of the .gpr file [default: None]
+    quantize   integer type the data is stored as [default: None]
+
+    OUTPUT:
+    True if outfile does not need to be converted again
+    '''
+    if not os.path.exists(outfile) or not gprIO_GPR.isContainer(outfile):
+        return False
+    try:
+        meta = gprIO_GPR.readGPRHeader(outfile)["meta"]
+    except ValueError:
+        # Broken header
+        return False
+    return (meta.get("sources") == sourceStamps(filename) and
+            meta.get("options") == convertOptions(dtype,compress,quantize))
+
+
+def convertFile(filename,outfile,dtype='float64',compress=None,quantize=None):
+    '''
+    Converts a single raw data file to .gpr. The .gpr file is first
+    written under a temporary name, such that an interrupted
+    conversion never leaves a partial file behind.
+
+    INPUT:
+    filename   raw data file name
+    outfile    .gpr file name
+    dtype      floating point precision of the data [default: 'float64']
+    compress   compression of the .gpr file, "zlib", "bz2", or "lzma"
+               [default: None, meaning no compression]
+    quantize   store the data as "int16" or "int8" [default: None,
+               meaning floating point]
+
+    OUTPUT:
+    nbytes     size of the data and header files that were read
+    '''
+    file_name, file_ext = os.path.splitext(outfile)
+    tmpfile = file_name + ".partial.gpr"
+    # Taken before reading, such that changes while converting
+    # are noticed next time
+    stamps = sourceStamps(filename)
+    # The importing and saving messages would garble the progress bar
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            gpr = gp.gprpyProfile(dtype=dtype)
+            gpr.importdata(filename)
+            gpr.save(tmpfile,compress=compress,quantize=quantize,sources=stamps,
+                     options=convertOptions(dtype,compress,quantize))
+        os.replace(tmpfile,outfile)
+    finally:
+        if os.path.exists(tmpfile):
+            os.remove(tmpfile)
+    return sum(size for name, mtime, size in stamps)
+
+
+def convertProfiles(paths,outdir=None,workers=1,dtype='float64',force=False,compress=None,
+                    quantize=None):
+    '''
+    Converts many raw data files (DZT, DT1, MALA, BSQ, SEG-Y) to .gpr files,
+    using several processes at once. Files whose .gpr file is already
+    up to date, and was converted with the same dtype, compress, and 
+    quantize options, are skipped.
+
+    INPUT:
+    paths      list of data file names, zip archives and directories.
+               Directories and archives are searched for data files,
+               including subdirectories. Files in archives can also
+               be given as "archive.zip::path/FILE.DZT".
+    outdir     directory for the .gpr files. The subdirectory structure
+               of given directories is kept. [default: None, meaning
+               next to each data file, and for files from an archive
+               in a directory named like the archive]. If data files
+               of different formats have the same name, like LINE.rd3
+               and LINE.sgy, the format is added: LINE_rd3.gpr.
+    workers    number of processes converting files at the same time
+               [default: 1]
+    dtype      floating point precision of the data [default: 'float64']
+    force      convert all files, even if their .gpr files are
+               up to date [default: False]
+    compress   compression of the .gpr files, "zlib", "bz2", or "lzma"
+               [default: None, meaning no compression]
+    quantize   store the data as "int16" or "int8" [default: None,
+               meaning floating point]
+
+    OUTPUT:
+    summary    dict with the lists of "converted", "skipped", and
+               "failed" data files, the total "bytes" read, the
+               "seconds" it took, and the throughput in "MBps"
+    '''
+    if isinstance(paths,str):
+        paths = [paths]
+    jobs = []
+    skipped = []
+    found = [(filename,outputName(filename,basedir,outdir)) for filename, basedir in findDataFiles(paths)]
+    outfiles = [outfile for filename, outfile in found]
+    for filename, outfile in found:
+        if outfiles.count(outfile) > 1:
+            # Data files of different formats with the same name
+            # get the format in the .gpr file name
+            file_ext = os.path.splitext(filename)[1]
+            outfile = os.path.splitext(outfile)[0] + "_" + file_ext[1:] + ".gpr"
+        if os.path.dirname(outfile):
+            os.makedirs(os.path.dirname(outfile),exist_ok=True)
+        if not force and upToDate(filename,outfile,dtype,compress,quantize):
+            skipped.append(filename)
+        else:
+            jobs.append((filename,outfile))
+
+    converted = []
+    failed = []
+    nbytes = 0
+    start = time.perf_counter()
+    if workers > 1 and len(jobs) > 1:
+        with futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            tasks = {executor.submit(convertFile,filename,outfile,dtype,compress,quantize): filename
+                     for filename, outfile in jobs}
+            for task in tqdm(futures.as_completed(tasks),total=len(tasks)):
+                try:
+                    nbytes += task.result()
+                    converted.append(tasks[task])
+                except Exception as e:
+                    failed.append(tasks[task])
+                    print("Could not convert %s: %s" %(tasks[task],e))
+    else:
+        for filename, outfile in tqdm(jobs):
+            try:
+                nbytes += convertFile(filename,outfile,dtype,compress,quantize)
+                converted.append(filename)
+            except Exception as e:
+                failed.append(filename)
+                print("Could not convert %s: %s" %(filename,e))
+    seconds = time.perf_counter()-start
+
+    MBps = nbytes/2**20/seconds if seconds > 0 else 0.0
+    print("Converted %d files (%.1f MB) in %.1f s, %.1f MB/s. Skipped %d up-to-date files, %d failed."
+          %(len(converted),nbytes/2**20,seconds,MBps,len(skipped),len(failed)))
+    return {"converted": converted, "skipped": skipped, "failed": failed,
+            "bytes": nbytes, "seconds": seconds, "MBps": MBps}
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Convert raw GPR data files (DZT, DT1, MALA, BSQ, SEG-Y) to .gpr files")
+    parser.add_argument('paths',nargs='+',help='data files, zip archives, and directories to convert')
+    parser.add_argument('-o','--outdir',default=None,
+                        help='directory for the .gpr files [default: next to the data files]')
+    parser.add_argument('-j','--workers',type=int,default=os.cpu_count(),
+                        help='number of files to convert at the same time [default: number of CPUs]')
+    parser.add_argument('--dtype',default='float64',help='float64 or float32 [default: float64]')
+    parser.add_argument('-f','--force',action='store_true',help='also convert up-to-date files')
+    parser.add_argument('--compress',default=None,choices=['zlib','bz2','lzma'],
+                        help='compress the .gpr files [default: no compression]')
+    parser.add_argument('--quantize',default=None,choices=['int16','int8'],
+                        help='store the data as 16 or 8 bit integers [default: floating point]')
+    args = parser.parse_args(args)
+    summary = convertProfiles(args.paths,args.outdir,args.workers,args.dtype,args.force,args.compress,
+                              args.quantize)
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
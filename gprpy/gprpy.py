@@ -6,7 +6,11 @@ import gprpy.toolbox.gprIO_DT1 as gprIO_DT1
 import gprpy.toolbox.gprIO_DZT as gprIO_DZT
 import gprpy.toolbox.gprIO_BSQ as gprIO_BSQ
 import gprpy.toolbox.gprIO_MALA as gprIO_MALA
+import gprpy.toolbox.gprIO_GPR as gprIO_GPR
+import gprpy.toolbox.gprIO_SEGY as gprIO_SEGY
+import gprpy.toolbox.archiveFiles as archiveFiles
 import gprpy.toolbox.gprpyTools as tools
+from gprpy.toolbox.mappedTraces import mappedTraces
 try:
     import gprpy.irlib.external.mig_fk as mig_fk
 except:
@@ -15,13 +19,29 @@ import copy
 import scipy.interpolate as interp
 from pyevtk.hl import gridToVTK
 
+def memoryBase(arr):
+    '''
+    Helper function. Returns the array that owns the memory of arr,
+    or None if arr is not an array in memory.
+    '''
+    if not isinstance(arr,np.ndarray):
+        return None
+    while isinstance(arr.base,np.ndarray):
+        arr = arr.base
+    if isinstance(arr,np.memmap):
+        return None
+    return arr
+
 class gprpyProfile:
     '''
     Ground penetrating radar data processing and visualization class 
     for common-offset profiles.
     '''
+    # Fields that processing steps change, and that undo restores
+    undoState = ["data","twtt","info","profilePos","velocity","depth",
+                 "maxTopo","minTopo","threeD","data_pretopo","twtt_pretopo"]
 
-    def __init__(self,filename=None):
+    def __init__(self,filename=None,dtype='float64'):
         '''
         Initialization for a gprpyProfile object. Initialization can be 
         empty or with a provided filename for the GPR data.
@@ -30,37 +50,87 @@ class gprpyProfile:
         filename     data file name. Currently supported formats:
                      .gpr (GPRPy), .DT1 (SnS), .DZT (GSSI), .rd3 (MALA),
                      and ENVI standard BSQ.
+        dtype        floating point precision in which the data is 
+                     kept and processed: 'float64' or 'float32'.
+                     'float32' needs half the memory.
+                     [default: 'float64']
         '''
         
-        self.history = ["mygpr = gp.gprpyProfile()"]
+        # Floating point precision of the data
+        self.precision = np.dtype(dtype)
+        if self.precision == np.float64:
+            self.history = ["mygpr = gp.gprpyProfile()"]
+        else:
+            self.history = ["mygpr = gp.gprpyProfile(dtype='%s')" %(self.precision.name)]
 
-        # Initialize previous for undo
-        self.previous = {}
+        # Initialize the undo stack, see setUndoMemory
+        self.undoStack = []
+        self.undoMemory = 2**30
+        self.checkpointInterval = 5
         
         if filename is not None:
             self.importdata(filename)                 
         
-    def importdata(self,filename):
+    def importdata(self,filename,mmap=False,traces=None,twtt=None,keepint=False,channel=None):
         '''
         Loads .gpr (native GPRPy), .DT1 (Sensors and Software),
-        .DZT (GSSI), .GPRhdr (ENVI standard BSQ), .rad (MALA)
-        data files and populates all the gprpyProfile fields.
+        .DZT (GSSI), .GPRhdr (ENVI standard BSQ), .rad (MALA),
+        and .sgy (SEG-Y) data files and populates all the 
+        gprpyProfile fields.
 
         INPUT: 
         filename  name of the .gpr, .DT1, dt1, .DZT, .GPRhdr, dat, 
-                  rd3, or .rad file you want to import.
+                  rd3, .rad, .sgy, or .segy file you want to import.
                   The header file name and the data file name 
-                  have to be the same!
+                  have to be the same! Files in zip archives are
+                  read directly, given as "archive.zip::path/FILE.DZT".
+        mmap      if True, keep the data memory-mapped: samples are 
+                  only read from the file and converted when a 
+                  processing step or plot uses them. Has no effect
+                  for .gpr files saved by older GPRPy versions.
+                  [default: False]
+        traces    only load these traces, given as (start, stop) or
+                  (start, stop, step) trace indices like in a Python
+                  slice [default: None, meaning all traces]
+        twtt      only load the samples with two-way travel times 
+                  between twtt[0] and twtt[1] (in ns)
+                  [default: None, meaning all samples]
+                  .gpr files saved by older GPRPy versions are read
+                  completely before selecting traces and samples.
+        keepint   if True, keep the samples in memory in their stored
+                  integer format and only convert them to the
+                  floating point precision when they are processed. 
+                  Has no effect for .gpr files. [default: False]
+        channel   only load this channel of multi-channel data, 
+                  counting from 0 [default: None, meaning all
+                  channels, such that data is a channels x samples
+                  x traces array]
         '''
         
         file_name, file_ext = os.path.splitext(filename)
+
+        # Partial reads go through the memory-mapped readers
+        lazy = mmap or traces is not None or twtt is not None or channel is not None
+
+        histstr = "mygpr.importdata('%s'" %(filename)
+        if mmap:
+            histstr += ",mmap=True"
+        if keepint:
+            histstr += ",keepint=True"
+        if traces is not None:
+            histstr += ",traces=%s" %(str(tuple(traces)))
+        if twtt is not None:
+            histstr += ",twtt=(%g,%g)" %(twtt[0],twtt[1])
+        if channel is not None:
+            histstr += ",channel=%d" %(channel)
+        histstr += ")"
         
         if file_ext==".DT1" or file_ext==".HD" or file_ext==".dt1" or file_ext==".hd":
             if file_ext==".DT1" or  file_ext==".HD":
-                self.data=gprIO_DT1.readdt1(file_name + ".DT1")
+                self.data=gprIO_DT1.readdt1(file_name + ".DT1",dtype=self.precision,mmap=lazy,keepint=keepint)
                 self.info=gprIO_DT1.readdt1Header(file_name + ".HD")  
             else:
-                self.data=gprIO_DT1.readdt1(file_name + ".dt1")
+                self.data=gprIO_DT1.readdt1(file_name + ".dt1",dtype=self.precision,mmap=lazy,keepint=keepint)
                 self.info=gprIO_DT1.readdt1Header(file_name + ".hd")
             
             self.profilePos = np.linspace(self.info["Start_pos"],
@@ -79,25 +149,19 @@ class gprpyProfile:
             self.threeD = None
             self.data_pretopo = None
             self.twtt_pretopo = None
-            # Initialize previous
-            self.initPrevious()
-            
-            # Put what you did in history
-            histstr = "mygpr.importdata('%s')" %(filename)
-            self.history.append(histstr)                                
             
         elif file_ext==".DZT":
 
-            self.data, self.info = gprIO_DZT.readdzt(filename)
+            self.data, self.info = gprIO_DZT.readdzt(filename,dtype=self.precision,mmap=lazy,keepint=keepint)
 
             if self.info["rhf_spm"] != 0:
                 self.profilePos = self.info["rhf_position"]+np.linspace(0.0,
-                                                                        self.data.shape[1]/self.info["rhf_spm"],
-                                                                        self.data.shape[1])
+                                                                        self.data.shape[-1]/self.info["rhf_spm"],
+                                                                        self.data.shape[-1])
             else:
                 self.profilePos = self.info["rhf_position"]+np.linspace(0.0,
-                                                                        self.data.shape[1]/self.info["rhf_sps"],
-                                                                        self.data.shape[1])
+                                                                        self.data.shape[-1]/self.info["rhf_sps"],
+                                                                        self.data.shape[-1])
                 
             self.twtt = np.linspace(0,self.info["rhf_range"],self.info["rh_nsamp"])
 
@@ -109,18 +173,12 @@ class gprpyProfile:
             self.threeD = None
             self.data_pretopo = None
             self.twtt_pretopo = None
-            # Initialize previous
-            self.initPrevious()
-            
-            # Put what you did in history
-            histstr = "mygpr.importdata('%s')" %(filename)
-            self.history.append(histstr)
     
         
 
         elif file_ext==".GPRhdr" or file_ext==".dat":
             # ENVI standard BSQ file
-            self.data, self.info = gprIO_BSQ.readBSQ(file_name)
+            self.data, self.info = gprIO_BSQ.readBSQ(file_name,dtype=self.precision,mmap=lazy,keepint=keepint)
 
             self.profilePos = float(self.info["dx"])*np.arange(0,int(self.info["columns"]))
             self.twtt = np.linspace(0,float(self.info["time_window"]),int(self.info["lines"]))
@@ -133,16 +191,10 @@ class gprpyProfile:
             self.threeD = None
             self.data_pretopo = None
             self.twtt_pretopo = None
-            # Initialize previous
-            self.initPrevious()
-            
-            # Put what you did in history
-            histstr = "mygpr.importdata('%s')" %(filename)
-            self.history.append(histstr)       
 
 
         elif file_ext==".rad" or file_ext==".rd3" or file_ext==".rd7":
-            self.data, self.info = gprIO_MALA.readMALA(file_name)
+            self.data, self.info = gprIO_MALA.readMALA(file_name,dtype=self.precision,mmap=lazy,keepint=keepint)
 
             self.twtt = np.linspace(0,float(self.info["TIMEWINDOW"]),int(self.info["SAMPLES"]))
             self.profilePos = float(self.info["DISTANCE INTERVAL"])*np.arange(0,self.data.shape[1])
@@ -155,23 +207,81 @@ class gprpyProfile:
             self.threeD = None
             self.data_pretopo = None
             self.twtt_pretopo = None
-            # Initialize previous
-            self.initPrevious()
-            
-            # Put what you did in history
-            histstr = "mygpr.importdata('%s')" %(filename)
-            self.history.append(histstr)
             
             
 
+        elif file_ext.lower()==".sgy" or file_ext.lower()==".segy":
+            self.data, self.info, head = gprIO_SEGY.readSEGY(filename,dtype=self.precision,traceheaders=True,
+                                                             mmap=lazy,keepint=keepint)
+            # Times are stored in ps (sample interval) and ns (delay)
+            delay = 0.0
+            if len(head) > 0:
+                delay = float(head['delrt'][0]*gprIO_SEGY.segyScale(head['scalet'][0]))
+            self.twtt = delay + self.info["dt"]*np.arange(0,self.info["hns"])
+            coordscale = gprIO_SEGY.segyScale(head['scalco'])
+            x = head['gx']*coordscale
+            y = head['gy']*coordscale
+            z = head['gelev']*gprIO_SEGY.segyScale(head['scalel'])
+            self.threeD = None
+            if np.any(y != 0) or np.any(z != 0):
+                # 3D coordinates: positions are the distance along the line
+                self.threeD = np.column_stack((x,y,z))
+                self.profilePos = np.append(0,np.cumsum(np.sqrt(np.diff(x)**2 + np.diff(y)**2)))
+            elif np.any(x != 0):
+                self.profilePos = np.asarray(x,dtype=np.float64)
+            else:
+                # No coordinates, use the trace numbers
+                self.profilePos = np.arange(0,self.data.shape[-1],dtype=np.float64)
+            # GPRPy stores the offset in mm, see gprIO_SEGY.offsetUnit
+            self.antsep = float(head['offset'][0]*self.info["offsetscale"]) if len(head) > 0 else 0
+            self.velocity = None
+            self.depth = None
+            self.maxTopo = None
+            self.minTopo = None
+            self.data_pretopo = None
+            self.twtt_pretopo = None
+
+        elif file_ext==".gpr" and gprIO_GPR.isContainer(filename):
+            header = gprIO_GPR.readGPRHeader(filename)
+            # The small arrays are read right away, the data only
+            # when needed
+            meta, arrays = gprIO_GPR.readGPR(filename,["profilePos","twtt","depth","threeD","twtt_pretopo"],
+                                             header=header)
+            meta, mapped = gprIO_GPR.readGPR(filename,["data","data_pretopo"],mmap=lazy,header=header)
+            for name in ["data","data_pretopo"]:
+                arr = mapped[name]
+                if isinstance(arr,gprIO_GPR.lazyTraces):
+                    # Compressed or quantized data is converted while reading
+                    arr.dtype = np.dtype(self.precision)
+                if arr is not None and arr.dtype != self.precision:
+                    if lazy:
+                        arr = mappedTraces(arr,0,self.precision)
+                    else:
+                        arr = np.asarray(arr,dtype=self.precision)
+                setattr(self,name,arr)
+            self.info = meta["info"]
+            self.profilePos = arrays["profilePos"]
+            self.twtt = arrays["twtt"]
+            self.history = meta["history"]
+            self.antsep = meta["antsep"]
+            self.velocity = meta["velocity"]
+            self.depth = arrays["depth"]
+            self.maxTopo = meta["maxTopo"]
+            self.minTopo = meta["minTopo"]
+            self.threeD = arrays["threeD"]
+            self.twtt_pretopo = arrays["twtt_pretopo"]
+
         elif file_ext==".gpr":
-            ## Getting back the objects:
-            with open(filename, 'rb') as f:
-                data, info, profilePos, twtt, history, antsep, velocity, depth, maxTopo, minTopo, threeD, data_pretopo, twtt_pretopo = pickle.load(f)
-            self.data = data
+            ## Getting back the objects from older, pickled .gpr files:
+            if lazy:
+                print("%s is an older .gpr file, which is read completely. Save it again for partial reads." %(filename))
+            with archiveFiles.openFile(filename,'rb') as f:
+                data, info, profilePos, gprtwtt, history, antsep, velocity, depth, maxTopo, minTopo, threeD, data_pretopo, twtt_pretopo = pickle.load(f)
+            # Older .gpr files contain np.matrix data in double precision
+            self.data = np.asarray(data,dtype=self.precision)
             self.info = info
             self.profilePos = profilePos
-            self.twtt = twtt
+            self.twtt = gprtwtt
             self.history = history
             self.antsep = antsep
             self.velocity = velocity
@@ -179,14 +289,81 @@ class gprpyProfile:
             self.maxTopo = maxTopo
             self.minTopo = minTopo
             self.threeD = threeD
+            if data_pretopo is not None:
+                data_pretopo = np.asarray(data_pretopo,dtype=self.precision)
             self.data_pretopo = data_pretopo
             self.twtt_pretopo = twtt_pretopo
             
-            # Initialize previous
-            self.initPrevious()
-            
         else:
-            print("Can only read dt1, DT1, hd, HD, DZT, dat, GPRhdr, rad, rd3, rd7, and gpr files")
+            print("Can only read dt1, DT1, hd, HD, DZT, dat, GPRhdr, rad, rd3, rd7, sgy, segy, and gpr files")
+            return
+
+        if traces is not None or twtt is not None:
+            # Only keep the requested traces and samples. The data
+            # is still memory-mapped here, so only the requested
+            # part of the file is read.
+            if traces is not None:
+                trsl = slice(*traces)
+            else:
+                trsl = slice(None)
+            if twtt is not None:
+                tsl = slice(np.searchsorted(self.twtt,twtt[0],side='left'),
+                            np.searchsorted(self.twtt,twtt[1],side='right'))
+            else:
+                tsl = slice(None)
+            if self.threeD is not None and len(self.threeD) == self.data.shape[-1]:
+                # Coordinates of each trace
+                self.threeD = self.threeD[trsl]
+            self.data = self.data[...,tsl,trsl]
+            self.twtt = self.twtt[tsl]
+            self.profilePos = self.profilePos[trsl]
+            if self.data_pretopo is not None:
+                self.data_pretopo = self.data_pretopo[:,trsl]
+
+        if channel is not None:
+            nchannels = self.data.shape[0] if self.data.ndim == 3 else 1
+            if not 0 <= channel < nchannels:
+                raise ValueError("Channel %d does not exist, the data has %d channels" %(channel,nchannels))
+            if self.data.ndim == 3:
+                if isinstance(self.data,mappedTraces):
+                    # Keep the selected channel memory-mapped
+                    self.data = self.data.view(self.data.raw[channel])
+                else:
+                    self.data = self.data[channel]
+
+        if not mmap:
+            # Read the selected part of memory-mapped data into memory
+            for name in ["data","data_pretopo"]:
+                arr = getattr(self,name)
+                if isinstance(arr,mappedTraces):
+                    if keepint:
+                        # Copy the selected raw samples into memory
+                        arr = arr.view(np.array(arr.raw))
+                    else:
+                        arr = np.asarray(arr)
+                elif isinstance(arr,np.memmap):
+                    arr = np.array(arr)
+                elif isinstance(arr,gprIO_GPR.lazyTraces):
+                    arr = np.asarray(arr)
+                setattr(self,name,arr)
+
+        # Initialize the undo stack
+        self.initPrevious()
+
+        if file_ext != ".gpr" or traces is not None or twtt is not None or channel is not None:
+            # Put what you did in history. The history of .gpr files
+            # already leads to their data, unless only a part of it
+            # was loaded.
+            self.history.append(histstr)
+
+    def singleChannel(self,method):
+        '''
+        Helper function. Raises an error if the data has several 
+        channels, for methods that only work on a single channel.
+        '''
+        if np.ndim(self.data) > 2:
+            raise ValueError("%s only works on single-channel data, but the data has %d channels. "
+                             "Load one channel with importdata(...,channel=0)" %(method,self.data.shape[0]))
 
     def showHistory(self):
         '''
@@ -211,49 +388,164 @@ class gprpyProfile:
                 
     def undo(self):
         '''
-        Undoes the last processing step and removes that step fromt he history.
-        '''
-        self.data = self.previous["data"]
-        self.twtt = self.previous["twtt"]
-        self.info = self.previous["info"]
-        self.profilePos = self.previous["profilePos"]
-        self.velocity = self.previous["velocity"]
-        self.depth = self.previous["depth"]
-        self.maxTopo = self.previous["maxTopo"]
-        self.minTopo = self.previous["minTopo"]
-        self.threeD = self.previous["threeD"]
-        self.data_pretopo = self.previous["data_pretopo"]
-        self.twtt_pretopo = self.previous["twtt_pretopo"]
-        # Make sure to not keep deleting history
-        # when applying undo several times. 
-        histsav = copy.copy(self.previous["history"])
-        del histsav[-1]
-        self.history = histsav
+        Undoes the last processing step and removes that step from the history.
+        Can be applied several times, up to the oldest step still kept
+        on the undo stack (see setUndoMemory).
+        '''
+        if not self.undoStack:
+            print("nothing to undo")
+            return
+        entry = self.undoStack.pop()
+        if entry["state"] is not None:
+            self.restoreState(entry["state"])
+        else:
+            # The arrays of this step were freed. Go back to the
+            # nearest step whose arrays were kept, and redo the
+            # processing steps from there.
+            stack = self.undoStack
+            start = max(i for i in range(len(stack)) if stack[i]["state"] is not None)
+            self.restoreState(stack[start]["state"])
+            # No undo steps are stored while redoing
+            self.undoStack = None
+            try:
+                for step in stack[start:]:
+                    method, args, kwargs = step["step"]
+                    getattr(self,method)(*args,**kwargs)
+            finally:
+                self.undoStack = stack
+        self.history = self.history[0:entry["history"]]
         print("undo")
 
-        
+
+    def setUndoMemory(self,maxMemory,checkpointInterval=None):
+        '''
+        Sets how much memory the undo stack can use. Each processing 
+        step is stored with its parameters and the arrays it replaced.
+        When the arrays of the stored steps need more memory than 
+        maxMemory, the arrays of the oldest steps are freed, keeping 
+        every checkpointInterval-th step as checkpoint for longer. 
+        Undoing a step whose arrays were freed redoes the processing 
+        from the nearest earlier step whose arrays were kept.
+        The arrays of the most recent step are always kept.
+
+        INPUT:
+        maxMemory           memory in bytes for arrays that are only 
+                            kept for undo [default: 2**30]
+        checkpointInterval  keep the arrays of every so many steps 
+                            as checkpoints [default: None, meaning 
+                            unchanged, initially 5]
+        '''
+        self.undoMemory = maxMemory
+        if checkpointInterval is not None:
+            self.checkpointInterval = max(int(checkpointInterval),1)
+        if self.undoStack is not None:
+            self.trimUndo()
+
+
     def initPrevious(self):
         '''
-        Initialization of data strucure that contains the step 
-        before the most recent action.
-        '''
-        self.previous["data"] = self.data
-        self.previous["twtt"] = self.twtt 
-        self.previous["info"] = self.info
-        self.previous["profilePos"] = self.profilePos
-        self.previous["velocity"] = self.velocity
-        self.previous["depth"] = self.depth
-        self.previous["maxTopo"] = self.maxTopo
-        self.previous["minTopo"] = self.minTopo
-        self.previous["threeD"] = self.threeD
-        self.previous["data_pretopo"] = self.data_pretopo
-        self.previous["twtt_pretopo"] = self.twtt_pretopo
-        histsav = copy.copy(self.history)
-        self.previous["history"] = histsav
+        Initialization of the undo stack after importing data.
+        '''
+        self.undoStack = []
+
+
+    def storePrevious(self,method,*args,**kwargs):
+        '''
+        Stores the current state of the profile and the processing 
+        step that is about to be applied on the undo stack.
+
+        INPUT:
+        method     name of the processing method
+        args       arguments of the processing method, to be able to
+        kwargs     redo the step if its arrays are freed
+        '''
+        if self.undoStack is None:
+            # Redoing steps during undo
+            return
+        self.undoStack.append({"step": (method,args,kwargs),
+                               "history": len(self.history),
+                               "state": self.undoSnapshot(),
+                               "checkpoint": len(self.undoStack) % self.checkpointInterval == 0})
+        # The step is about to replace the arrays it just stored
+        self.trimUndo(pending=True)
+
+
+    def undoSnapshot(self):
+        '''
+        Helper function. References to the fields that undo restores.
+        Lists are copied since they are changed in place.
+        '''
+        state = {}
+        for name in self.undoState:
+            value = getattr(self,name,None)
+            if isinstance(value,list):
+                value = copy.copy(value)
+            state[name] = value
+        return state
+
+
+    def restoreState(self,state):
+        '''
+        Helper function. Sets the fields stored by undoSnapshot.
+        '''
+        for name, value in state.items():
+            if isinstance(value,list):
+                value = copy.copy(value)
+            setattr(self,name,value)
+
+
+    def undoBytes(self,pending=False):
+        '''
+        Memory in bytes used by arrays that are only kept for undo.
+        Arrays that are memory-mapped, or still used by the profile,
+        are not counted.
+
+        INPUT:
+        pending    count the arrays of the most recent step even if 
+                   they are still used by the profile, since the 
+                   step that is about to be applied replaces them
+                   [default: False]
+        '''
+        current = set()
+        for name in self.undoState:
+            base = memoryBase(getattr(self,name,None))
+            if base is not None:
+                current.add(id(base))
+        held = {}
+        for i, entry in enumerate(self.undoStack):
+            if entry["state"] is None:
+                continue
+            replaced = pending and i == len(self.undoStack)-1
+            for value in entry["state"].values():
+                base = memoryBase(value)
+                if base is not None and (replaced or id(base) not in current):
+                    held[id(base)] = base.nbytes
+        return sum(held.values())
+
+
+    def trimUndo(self,pending=False):
+        '''
+        Helper function. Frees the arrays of the oldest undo steps 
+        until the undo stack fits into undoMemory. Checkpoints and the
+        most recent step are freed last. Steps before the oldest step
+        whose arrays are kept can't be redone anymore and are removed.
+
+        INPUT:
+        pending    the most recent step is about to be applied, see
+                   undoBytes [default: False]
+        '''
+        stack = self.undoStack
+        while len(stack) > 1 and self.undoBytes(pending) > self.undoMemory:
+            stored = [entry for entry in stack[0:-1] if entry["state"] is not None]
+            evict = [entry for entry in stored if not entry["checkpoint"]] or stored
+            if evict:
+                evict[0]["state"] = None
+            while stack[0]["state"] is None:
+                del stack[0]
 
         
 
-    def save(self,filename):
+    def save(self,filename,compress=None,quantize=None,sources=None,options=None):
         '''
         Saves the processed data together with the processing and visualization
         history. Warning: The history stored in this file will contain the full 
@@ -261,20 +553,56 @@ class gprpyProfile:
 
         INPUT:
         filename       name for .gpr file
+        compress       compress the data with "zlib", "bz2", or "lzma".
+                       The data is compressed in independent chunks of
+                       traces, such that loading only some traces only
+                       decompresses those. [default: None, meaning
+                       no compression]
+        quantize       store the data as "int16" or "int8", with a scale
+                       and offset for each trace. The data is turned back
+                       into floating point numbers when loading. The error
+                       of each sample is at most (max-min)/(4*32767) for
+                       int16 and (max-min)/(4*127) for int8, where max and
+                       min are the largest and smallest sample of the trace.
+                       [default: None, meaning store the data as it is]
+        sources        list of [file name, modification time, size] of
+                       the raw data files, stored in the header such that
+                       convertProfiles can tell if the .gpr file is up
+                       to date [default: None]
+        options        dict of the options the raw data files were
+                       converted with, stored in the header next to
+                       sources [default: None]
         '''
         # Saving the objects:
         # Want to force the file name .gpr
         file_name, file_ext = os.path.splitext(filename)
         if not(file_ext=='.gpr'):
             filename = filename + '.gpr'
-        with open(filename, 'wb') as f:  
-            pickle.dump([self.data, self.info, self.profilePos, self.twtt,
-                         self.history, self.antsep, self.velocity, self.depth,
-                         self.maxTopo, self.minTopo, self.threeD, self.data_pretopo,
-                         self.twtt_pretopo], f)            
+        # Small attributes go into the header, arrays are stored
+        # such that they can be memory-mapped when loading
+        meta = {"info": self.info, "history": self.history, "antsep": self.antsep,
+                "velocity": self.velocity, "maxTopo": self.maxTopo, "minTopo": self.minTopo}
+        if sources is not None:
+            meta["sources"] = sources
+        if options is not None:
+            meta["options"] = options
+        arrays = {"data": self.data, "data_pretopo": self.data_pretopo}
+        for name in ["profilePos","twtt","depth","threeD","twtt_pretopo"]:
+            arr = getattr(self,name)
+            if arr is not None:
+                arr = np.asarray(arr)
+            arrays[name] = arr
+        if quantize is not None:
+            quantize = {"data": quantize, "data_pretopo": quantize}
+        gprIO_GPR.writeGPR(filename,meta,arrays,compress=compress,quantize=quantize)
         print("Saved " + filename)
         # Add to history string
-        histstr = "mygpr.save('%s')" %(filename)
+        histstr = "mygpr.save('%s'" %(filename)
+        if compress is not None:
+            histstr += ",compress='%s'" %(compress)
+        if quantize is not None:
+            histstr += ",quantize='%s'" %(quantize["data"])
+        histstr += ")"
         self.history.append(histstr)
 
     
@@ -301,6 +629,7 @@ class gprpyProfile:
         asp          asp value used to prepare the figure
 
         '''
+        self.singleChannel("prepProfileFig")
         dx=self.profilePos[3]-self.profilePos[2]
         dt=self.twtt[3]-self.twtt[2]
         stdcont = np.nanmax(np.abs(self.data)[:])       
@@ -422,7 +751,7 @@ class gprpyProfile:
         maxpos      end position of the profile
         '''
         # Store previous state for undo
-        self.storePrevious()
+        self.storePrevious('adjProfile',minPos,maxPos)
         # set new profile positions
         self.profilePos = np.linspace(minPos,maxPos,len(self.profilePos))       
         # Put what you did in history
@@ -435,25 +764,34 @@ class gprpyProfile:
         Flips the profile left-to-right (start to end)
         '''
         # Flips the profile left to right (start to end)
-        self.storePrevious()
-        self.data=np.flip(self.data,1)
+        self.storePrevious('flipProfile')
+        self.data=np.flip(self.data,-1)
         if self.data_pretopo is not None:
             self.data_pretopo = np.flip(self.data_pretopo,1)
         histstr = "mygpr.flipProfile()"
         self.history.append(histstr)
         
 
-    def alignTraces(self):
+    def alignTraces(self,subsample=False):
         '''
         Aligns the traces in the profile such that their maximum 
         amplitudes align at the average two-way travel time of the 
         maximum amplitudes.
+
+        INPUT:
+        subsample   additionally shift each trace by a fraction of a 
+                    sample to best match the average trace 
+                    [default: False]
         '''
+        self.singleChannel("alignTraces")
         # Store previous state for undo
-        self.storePrevious()        
-        self.data = tools.alignTraces(self.data)      
+        self.storePrevious('alignTraces',subsample)        
+        self.data = tools.alignTraces(self.data,subsample)      
         # Put what you did in history
-        histstr = "mygpr.alignTraces()"
+        if subsample:
+            histstr = "mygpr.alignTraces(subsample=True)"
+        else:
+            histstr = "mygpr.alignTraces()"
         self.history.append(histstr)
 
 
@@ -468,10 +806,10 @@ class gprpyProfile:
         maxPos      end position of data to keep
         '''
         # Store previous state for undo
-        self.storePrevious()
+        self.storePrevious('cut',minPos,maxPos)
         zeroind = np.abs(self.profilePos - minPos).argmin()
         maxind = np.abs(self.profilePos - maxPos).argmin()
-        self.data = self.data[:,zeroind:(maxind+1)]
+        self.data = self.data[...,zeroind:(maxind+1)]
         self.profilePos=self.profilePos[zeroind:(maxind+1)]
         if self.data_pretopo is not None:
             self.data_pretopo = self.data_pretopo[:,zeroind:(maxind+1)]
@@ -489,14 +827,14 @@ class gprpyProfile:
         newZeroTime     The new zero-time
         '''
         # Store previous state for undo
-        self.storePrevious()
+        self.storePrevious('setZeroTime',newZeroTime)
         # Find index of value that is nearest to newZeroTime
         zeroind = np.abs(self.twtt - newZeroTime).argmin() 
         # Cut out everything before
         self.twtt = self.twtt[zeroind:] - newZeroTime
         # Set first value to 0
         self.twtt[0] = 0
-        self.data = self.data[zeroind:,:]
+        self.data = self.data[...,zeroind:,:]
         # Put what you did in history
         histstr = "mygpr.setZeroTime(%g)" %(newZeroTime)
         self.history.append(histstr)  
@@ -514,7 +852,7 @@ class gprpyProfile:
                    [in "number of samples"]
         '''
         # Store previous state for undo
-        self.storePrevious()
+        self.storePrevious('dewow',window)
         self.data = tools.dewow(self.data,window)
         # Put in history
         histstr = "mygpr.dewow(%d)" %(window)
@@ -533,7 +871,7 @@ class gprpyProfile:
                    [in "number of samples"]
         '''
         # Store previous state for undo
-        self.storePrevious()
+        self.storePrevious('smooth',window)
         self.data = tools.smooth(self.data,window)
         # Put in history
         histstr = "mygpr.smooth(%d)" %(window)
@@ -553,7 +891,7 @@ class gprpyProfile:
                     to take the moving average. 
         '''
         # Store previous state for undo
-        self.storePrevious()
+        self.storePrevious('remMeanTrace',ntraces)
         # apply
         self.data = tools.remMeanTrace(self.data,ntraces)        
         # Put in history
@@ -581,8 +919,9 @@ class gprpyProfile:
                         over how many traces to take the moving average. 
         noversample     how many copies of each trace
         '''
+        self.singleChannel("profileSmooth")
         # Store previous state for undo
-        self.storePrevious()
+        self.storePrevious('profileSmooth',ntraces,noversample)
         self.data,self.profilePos = tools.profileSmooth(self.data,self.profilePos,
                                                         ntraces,noversample)
         # Put in history
@@ -598,27 +937,33 @@ class gprpyProfile:
         power     exponent
         '''
         # Store previous state for undo
-        self.storePrevious()
+        self.storePrevious('tpowGain',power)
         # apply tpowGain
         self.data = tools.tpowGain(self.data,self.twtt,power)
         # Put in history
         histstr = "mygpr.tpowGain(%g)" %(power)
         self.history.append(histstr)
 
-    def agcGain(self,window=10):
+    def agcGain(self,window=10,norm='energy'):
         '''
         Apply automated gain controll (AGC) by normalizing the energy
         of the signal over a given window width in each trace
 
         INPUT:
         window     window width [in "number of samples"]
+        norm       how to measure the signal strength in the window:
+                   "energy", "rms", "meanabs", or "peak" 
+                   [default: "energy"]
         '''
         # Store previous state for undo
-        self.storePrevious()
+        self.storePrevious('agcGain',window,norm)
         # apply agcGain
-        self.data = tools.agcGain(self.data,window)
+        self.data = tools.agcGain(self.data,window,norm)
         # Put in history
-        histstr = "mygpr.agcGain(%d)" %(float(window))
+        if norm == 'energy':
+            histstr = "mygpr.agcGain(%d)" %(float(window))
+        else:
+            histstr = "mygpr.agcGain(%d,norm='%s')" %(float(window),norm)
         self.history.append(histstr)
         
 
@@ -630,7 +975,7 @@ class gprpyProfile:
         velocity      subsurface RMS velocity [in m/ns]
         '''
         # Store previous state for undo
-        self.storePrevious()
+        self.storePrevious('setVelocity',velocity)
 
         self.velocity = velocity
         self.depth = self.twtt * velocity/2.0
@@ -652,7 +997,7 @@ class gprpyProfile:
         '''
 
         # Store previous state for undo
-        self.storePrevious()
+        self.storePrevious('antennaSep')
 
         # Take into account that the airwave first break
         # is after the airwave has already traveled the
@@ -701,14 +1046,16 @@ class gprpyProfile:
         This is a wrapper function for the migration code
         imported from Nat Wilson's irlib software.
         '''
+        self.singleChannel("fkMigration")
         # Store previous state for undo
-        self.storePrevious()
+        self.storePrevious('fkMigration')
         # apply migration
         dt=self.twtt[3]-self.twtt[2]
         #dx=self.profilePos[1]-self.profilePos[0]
         dx=(self.profilePos[-1]-self.profilePos[0])/(len(self.profilePos)-1)
         # fkmig sets x profile to start at zero but resamples
-        self.data,self.twtt,migProfilePos=mig_fk.fkmig(self.data,dt,dx,self.velocity)
+        data,self.twtt,migProfilePos=mig_fk.fkmig(self.data,dt,dx,self.velocity)
+        self.data = np.asarray(data,dtype=self.precision)
         self.profilePos = migProfilePos + self.profilePos[0]
         
         # Put in history
@@ -724,22 +1071,23 @@ class gprpyProfile:
         maxY    maximum y-axis position for data to be kept
         '''
         # Store previous state for undo
-        self.storePrevious()
+        self.storePrevious('truncateY',maxY)
         if self.velocity is None:
             maxtwtt = maxY
             maxind = np.argmin( np.abs(self.twtt-maxY) )
-            self.twtt = self.twtt[0:maxind]
+            # Copy, since the old arrays are kept for undo
+            self.twtt = self.twtt[0:maxind].copy()
             # Set the last value to maxY
             self.twtt[-1] = maxY
-            self.data = self.data[0:maxind,:]
+            self.data = self.data[...,0:maxind,:]
         else:
             maxtwtt = maxY*2.0/self.velocity
             maxind = np.argmin( np.abs(self.twtt-maxtwtt) )
-            self.twtt = self.twtt[0:maxind]
+            self.twtt = self.twtt[0:maxind].copy()
             # Set the last value to maxtwtt
             self.twtt[-1] = maxtwtt
-            self.data = self.data[0:maxind,:]
-            self.depth = self.depth[0:maxind]
+            self.data = self.data[...,0:maxind,:]
+            self.depth = self.depth[0:maxind].copy()
             self.depth[-1] = maxY
         # Put in history
         histstr = "mygpr.truncateY(%g)" %(maxY)
@@ -767,11 +1115,12 @@ class gprpyProfile:
         delimiter     how the entries are delimited (by comma, or by tab)
                       [default: ',']. To set tab: delimiter='\t'
         '''
+        self.singleChannel("topoCorrect")
         if self.velocity is None:
             print("First need to set velocity!")
             return
         # Store previous state for undo
-        self.storePrevious()
+        self.storePrevious('topoCorrect',topofile,delimiter)
         self.data_pretopo = self.data
         self.twtt_pretopo = self.twtt
         topoPos, topoVal, self.threeD = tools.prepTopo(topofile,delimiter,self.profilePos[0])
@@ -821,6 +1170,7 @@ class gprpyProfile:
         porder        If smoothing, the polynomial order for
                       scipy.signal.savgol_filter [default: 3]
         '''
+        self.singleChannel("exportVTK")
         # If gpsmat is a filename, we first need to load the file:
         if type(gpsinfo) is str:
             gpsmat = np.loadtxt(gpsinfo,delimiter=delimiter)
@@ -915,23 +1265,40 @@ class gprpyProfile:
                     histstr = "mygpr.exportVTK('%s',gpsinfo=mygpr.threeD,thickness=%g,delimiter='\\t',aspect=%g,smooth=%r, win_length=%d, porder=%d)" %(outfile,thickness,aspect,smooth,win_length,porder)
                     
         self.history.append(histstr)       
-        
-    def storePrevious(self):
-        '''
-        Stores the current state of the profile and history in the 
-        "previous" variable to be able to apply undo.
-        '''
-        self.previous["data"] = self.data
-        self.previous["twtt"] = self.twtt
-        self.previous["info"] = self.info
-        self.previous["profilePos"] = self.profilePos
-        self.previous["history"] = self.history
-        self.previous["velocity"] = self.velocity
-        self.previous["depth"] = self.depth
-        self.previous["maxTopo"] = self.maxTopo
-        self.previous["threeD"] = self.threeD
-        self.previous["data_pretopo"] = self.data_pretopo
-        self.previous["twtt_pretopo"] = self.twtt_pretopo
+
+
+    def exportSEGY(self,filename,channel=None):
+        '''
+        Exports the processed data as SEG-Y rev 2 file with IEEE
+        floating point samples. Following the usual convention for
+        GPR data, the sample interval is stored in picoseconds and 
+        the delay in nanoseconds. If the profile has 3D coordinates 
+        (threeD, one row per trace), they are stored as trace 
+        coordinates, otherwise the profile positions are stored as 
+        x coordinate. The antenna separation is stored in whole 
+        meters.
+
+        INPUT:
+        filename       name for the SEG-Y file
+        channel        channel to export for multi-channel data 
+                       [default: None]
+        '''
+        data = self.data
+        if data.ndim == 3:
+            if channel is None:
+                raise ValueError("The data has %d channels. Choose the channel to export with channel=" %(data.shape[0]))
+            data = data[channel]
+        threeD = self.threeD
+        if threeD is not None and len(threeD) != data.shape[-1]:
+            threeD = None
+        antsep = self.antsep if self.antsep is not None else 0
+        gprIO_SEGY.writeSEGY(filename,data,self.twtt,self.profilePos,threeD,float(antsep))
+        print("Exported " + filename)
+        if channel is None:
+            histstr = "mygpr.exportSEGY('%s')" %(filename)
+        else:
+            histstr = "mygpr.exportSEGY('%s',channel=%d)" %(filename,channel)
+        self.history.append(histstr)
         
 
 
@@ -945,7 +1312,10 @@ class gprpyCW(gprpyProfile):
     Inherits all of the gprpyProfile class functions but not all
     of these functions may be useful here. 
     '''
-    def __init__(self,filename=None,dtype=None):
+    undoState = gprpyProfile.undoState + ["dtype","vVals","hypStAmp","linStAmp",
+                                          "semb","lins","hyps"]
+
+    def __init__(self,filename=None,dtype=None,precision='float64'):
         '''
         Initialization for a gprpyCW object. Initialization can be 
         empty or with a provided filename for the GPR data and 
@@ -956,16 +1326,21 @@ class gprpyCW(gprpyProfile):
                      .gpr (GPRPy), .DT1 (SnS), .DZT (GSSI), .rd3 (MALA),
                      and ENVI standard BSQ.
         dtype        data type. Either "CMP" or "WARR"
+        precision    floating point precision in which the data is 
+                     kept and processed: 'float64' or 'float32'
+                     [default: 'float64']
         '''
         # Inheriting the initializer from the gprpyProfile class
-        super().__init__(None)
-        self.history = ["mygpr = gp.gprpyCW()"]
-        # Initialize previous for undo
-        self.previous = {}
+        super().__init__(None,dtype=precision)
+        if self.precision == np.float64:
+            self.history = ["mygpr = gp.gprpyCW()"]
+        else:
+            self.history = ["mygpr = gp.gprpyCW(precision='%s')" %(self.precision.name)]
         self.dtype = dtype
         # Stacked amplitude plots
         self.linStAmp = None
         self.hypStAmp = None
+        self.semb = None
         # Picked lines and hyperbolae
         self.lins = list()
         self.hyps = list()
@@ -974,26 +1349,7 @@ class gprpyCW(gprpyProfile):
             self.importdata(filename,dtype)
 
 
-    def storePrevious(self):
-        '''
-        Stores the current state of the profile and history in the 
-        "previous" variable to be able to apply undo.
-        '''
-        self.previous["data"] = self.data
-        self.previous["twtt"] = self.twtt
-        self.previous["info"] = self.info
-        self.previous["profilePos"] = self.profilePos
-        self.previous["history"] = self.history
-        self.previous["dtype"] = self.dtype
-        self.previous["hypStAmp"] = self.hypStAmp
-        self.previous["linStAmp"] = self.linStAmp
-        self.previous["lins"] = self.lins
-        self.previous["hyps"] = self.hyps
-
-
-
-            
-    def importdata(self,filename,dtype):
+    def importdata(self,filename,dtype,mmap=False,traces=None,twtt=None,keepint=False,channel=None):
         '''
         Loads .gpr (native GPRPy), .DT1 (Sensors and Software),
         .DZT (GSSI), .GPRhdr (ENVI standard BSQ), .rad (MALA)
@@ -1005,17 +1361,27 @@ class gprpyCW(gprpyProfile):
                   The header file name and the data file name 
                   have to be the same!
         dtype     data type. Either "CMP" or "WARR
+        mmap      if True, keep the data memory-mapped 
+                  [default: False]
+        traces    only load these traces, given as (start, stop) or
+                  (start, stop, step) [default: None]
+        twtt      only load the samples with two-way travel times 
+                  between twtt[0] and twtt[1] [default: None]
+        keepint   if True, keep the samples in their stored integer
+                  format until processing [default: False]
+        channel   only load this channel of multi-channel data
+                  [default: None]
         
         '''
         print(filename)
-        super().importdata(filename)
+        super().importdata(filename,mmap=mmap,traces=traces,twtt=twtt,keepint=keepint,channel=channel)
         self.dtype = dtype
         self.vVals = None
-        # Remove the history string from the super-class importing
-        del self.history[-1]
-        # Put what you did in history
-        histstr = "mygpr.importdata('%s',dtype='%s')" %(filename,dtype)
-        self.history.append(histstr)  
+        # Add the data type to the history string of the
+        # super-class importing
+        histstr = self.history[-1].replace("mygpr.importdata('%s'" %(filename),
+                                           "mygpr.importdata('%s',dtype='%s'" %(filename,dtype),1)
+        self.history[-1] = histstr
 
 
     def setZeroTimeCW(self,newZeroTime):
@@ -1027,7 +1393,7 @@ class gprpyCW(gprpyProfile):
         newZeroTime     The new zero-time
         '''
         # Store previous state for undo
-        self.storePrevious()
+        self.storePrevious('setZeroTimeCW',newZeroTime)
         # Find index of value that is nearest to newZeroTime
         zeroind = np.abs(self.twtt - newZeroTime).argmin()
         # Cut out everything before
@@ -1043,8 +1409,9 @@ class gprpyCW(gprpyProfile):
         Divides each trace by its total energy to counteract the 
         loss of energy for wider antennae separations.
         '''
+        self.singleChannel("normalize")
         # Store previous state for undo
-        self.storePrevious()
+        self.storePrevious('normalize')
         # Calculate norm of each trace and divide each trace by it
         self.data = np.divide(self.data,np.maximum(np.linalg.norm(self.data,axis=0),1e-8))
         print("normalized data set")
@@ -1067,8 +1434,9 @@ class gprpyCW(gprpyProfile):
                    stacked amplitude, in m/ns [default = 0.35 m/ns]
         vint       velocity intervall, in m/ns [default = 0.01 m/ns]
         '''
+        self.singleChannel("linStackedAmplitude")
         # Store previous state for undo
-        self.storePrevious()
+        self.storePrevious('linStackedAmplitude',vmin,vmax,vint)
         self.vVals = np.arange(vmin,vmax+vint,vint)
         if self.dtype is "WARR":
             typefact = 1
@@ -1081,7 +1449,7 @@ class gprpyCW(gprpyProfile):
         self.history.append(histstr)
         
 
-    def hypStackedAmplitude(self,vmin=0.01,vmax=0.35,vint=0.01):
+    def hypStackedAmplitude(self,vmin=0.01,vmax=0.35,vint=0.01,workers=1):
         '''
         Calculates the hyperbolic stacked amplitudes for each two-way 
         travel time sample and the provided velocity range 
@@ -1094,21 +1462,63 @@ class gprpyCW(gprpyProfile):
         vmax       maximum velocity for which to calculate the 
                    stacked amplitude, in m/ns [default = 0.35 m/ns]
         vint       velocity intervall, in m/ns [default = 0.01 m/ns]
+        workers    number of processes to spread the velocities over
+                   [default = 1, None means one per CPU]
         '''
+        self.singleChannel("hypStackedAmplitude")
         # Store previous state for undo
-        self.storePrevious()
+        self.storePrevious('hypStackedAmplitude',vmin,vmax,vint,workers)
         self.vVals = np.arange(vmin,vmax+vint,vint)
         if self.dtype is "WARR":
             typefact = 1
         elif self.dtype is "CMP":
             typefact = 2
-        self.hypStAmp = tools.hypStackedAmplitude(self.data,self.profilePos,self.twtt,self.vVals,self.twtt,typefact)
+        self.hypStAmp = tools.hypStackedAmplitude(self.data,self.profilePos,self.twtt,self.vVals,self.twtt,typefact,
+                                                  workers=workers)
         print("calculated hyperbola stacked amplitude")
         # Put what you did in history
-        histstr = "mygpr.hypStackedAmplitude(vmin=%g,vmax=%g,vint=%g)" %(vmin,vmax,vint)
+        if workers == 1:
+            histstr = "mygpr.hypStackedAmplitude(vmin=%g,vmax=%g,vint=%g)" %(vmin,vmax,vint)
+        else:
+            histstr = "mygpr.hypStackedAmplitude(vmin=%g,vmax=%g,vint=%g,workers=%r)" %(vmin,vmax,vint,workers)
         self.history.append(histstr)                  
 
 
+    def semblance(self,vmin=0.01,vmax=0.35,vint=0.01,window=5,moveout="hyp"):
+        '''
+        Calculates the semblance (normalized coherence, between 0 and 1)
+        for each two-way travel time sample and the provided velocity 
+        range, over a time window and interpolating the data linearly
+        between samples along the hyperbolae (or lines) given by 
+        the two-way travel time apex (or zero offset) and the velocity.
+
+        INPUT:
+        vmin       minimal velocity for which to calculate the 
+                   semblance, in m/ns [default = 0.01 m/ns]
+        vmax       maximum velocity for which to calculate the 
+                   semblance, in m/ns [default = 0.35 m/ns]
+        vint       velocity intervall, in m/ns [default = 0.01 m/ns]
+        window     time window width [in "number of samples"]
+                   [default = 5]
+        moveout    "hyp" for hyperbolic or "lin" for linear moveout
+                   [default = "hyp"]
+        '''
+        self.singleChannel("semblance")
+        # Store previous state for undo
+        self.storePrevious('semblance',vmin,vmax,vint,window,moveout)
+        self.vVals = np.arange(vmin,vmax+vint,vint)
+        if self.dtype == "WARR":
+            typefact = 1
+        elif self.dtype == "CMP":
+            typefact = 2
+        self.semb = tools.semblance(self.data,self.profilePos,self.twtt,self.vVals,self.twtt,typefact,
+                                    window=window,moveout=moveout)
+        print("calculated semblance")
+        # Put what you did in history
+        histstr = "mygpr.semblance(vmin=%g,vmax=%g,vint=%g,window=%d,moveout='%s')" %(vmin,vmax,vint,window,moveout)
+        self.history.append(histstr)
+
+
     def addLin(self,zerotwtt,vel):
         '''
         Adds an observed line given by its zero-offset two-way travel
@@ -1120,7 +1530,7 @@ class gprpyCW(gprpyProfile):
         vel          the velocity (inverse slope) of the observed line
         '''
         # Store previous state for undo
-        self.storePrevious()
+        self.storePrevious('addLin',zerotwtt,vel)
         self.lins.append([zerotwtt,vel])
         # Put what you did in history
         histstr = "mygpr.addLin(zerotwtt=%g,vel=%g)" %(zerotwtt,vel)
@@ -1137,7 +1547,7 @@ class gprpyCW(gprpyProfile):
         vel          the velocity of the observed line
         '''
         # Store previous state for undo
-        self.storePrevious()
+        self.storePrevious('addHyp',zerotwtt,vel)
         self.hyps.append([zerotwtt,vel])
         # Put what you did in history
         histstr = "mygpr.addHyp(zerotwtt=%g,vel=%g)" %(zerotwtt,vel)
@@ -1149,7 +1559,7 @@ class gprpyCW(gprpyProfile):
         of observed lines
         '''
         # Store previous state for undo
-        self.storePrevious()
+        self.storePrevious('remLin')
         del self.lins[-1]
         # Put what you did in history
         histstr = "mygpr.remLin()" 
@@ -1161,7 +1571,7 @@ class gprpyCW(gprpyProfile):
         of observed lines
         '''
         # Store previous state for undo
-        self.storePrevious()
+        self.storePrevious('remHyp')
         del self.hyps[-1]
         # Put what you did in history
         histstr = "mygpr.remHyp()" 
@@ -1193,6 +1603,7 @@ class gprpyCW(gprpyProfile):
         xrng         xrng value used to prepare the figure 
         showlnhp     showlnhp value used to prepare the figure
         '''
+        self.singleChannel("prepCWFig")
         dx=self.profilePos[3]-self.profilePos[2]
         dt=self.twtt[3]-self.twtt[2]
         stdcont = np.nanmax(np.abs(self.data)[:])       
@@ -1250,7 +1661,7 @@ class gprpyCW(gprpyProfile):
         
         INPUT:
         whichstamp   is this for the linear ("lin") or hyperbolic ("hyp") 
-                     stacked amplitudes
+                     stacked amplitudes, or the semblance ("semb")
         saturation   Factor to increase contrast by reducing color range.
                      [default = 1.0]
         yrng         y-axis range to show [default: None, meaning "everything"]
@@ -1271,6 +1682,9 @@ class gprpyCW(gprpyProfile):
         elif whichstamp == "hyp":
             stamp = self.hypStAmp
             title = "hyperbolic stacked amplitude"
+        elif whichstamp == "semb":
+            stamp = self.semb
+            title = "semblance"
         else:
             stamp = None
             
@@ -1334,7 +1748,7 @@ class gprpyCW(gprpyProfile):
 
         INPUT:
         whichstamp   is this for the linear ("lin") or hyperbolic ("hyp") 
-                     stacked amplitudes
+                     stacked amplitudes, or the semblance ("semb")
         saturation   Factor to increase contrast by reducing color range.
                      [default = 1.0]
         yrng         y-axis range to show [default: None, meaning "everything"]
@@ -1381,7 +1795,7 @@ class gprpyCW(gprpyProfile):
         figname      file name for the pdf
         dpi          dots per inch resolution [default: 600 dpi]
         whichstamp   is this for the linear ("lin") or hyperbolic ("hyp") 
-                     stacked amplitudes
+                     stacked amplitudes, or the semblance ("semb")
         saturation   Factor to increase contrast by reducing color range.
                      [default = 1.0]
         yrng         y-axis range to show [default: None, meaning "everything"]
@@ -1394,3 +1808,170 @@ class gprpyCW(gprpyProfile):
         plt.close('all')
         histstr = "mygpr.printStAmpFigure('%s', whichstamp='%s', saturation=%g, yrng=[%g,%g], vrng=[%g,%g])" %(figname, whichstamp, saturation, yrng[0], yrng[1], vrng[0], vrng[1])
         self.history.append(histstr)
+
+
+
+def probe(filename):
+    '''
+    Reads only the header of a data file and returns the size and
+    layout of the data, without reading any traces. Useful to
+    catalog many data files quickly.
+
+    INPUT:
+    filename     name of the .gpr, .DT1, dt1, .DZT, .GPRhdr, dat, 
+                 rd3, .rad, .sgy, or .segy file, possibly in a zip
+                 archive as "archive.zip::path/FILE.DZT"
+
+    OUTPUT:
+    meta         dict with
+                 "format": file format,
+                 "datafile": name of the file containing the traces,
+                 "nsamples": samples per trace,
+                 "ntraces": number of traces,
+                 "nchannels": number of channels (only for DZT),
+                 "dtype": data type of the stored samples,
+                 "twtt": (first, last) two-way travel time, in ns,
+                 "spacing": nominal distance between traces,
+                 "header_bytes": (start, stop) byte range of the 
+                 header in the data file,
+                 "data_bytes": (start, stop) byte range of the data,
+                 "compression": compression codec (only for .gpr files
+                 saved with compression),
+                 "info": dict with the header information
+    '''
+    file_name, file_ext = os.path.splitext(filename)
+
+    if file_ext==".DT1" or file_ext==".HD" or file_ext==".dt1" or file_ext==".hd":
+        if file_ext==".DT1" or file_ext==".HD":
+            datafile = file_name + ".DT1"
+            info = gprIO_DT1.readdt1Header(file_name + ".HD")
+        else:
+            datafile = file_name + ".dt1"
+            info = gprIO_DT1.readdt1Header(file_name + ".hd")
+        nsamples = info["N_pts_per_trace"]
+        ntraces = info["N_traces"]
+        # Each trace has its own 128 byte header
+        meta = {"format": "DT1", "dtype": "int16",
+                "twtt": (info["TZ_at_pt"],info["Total_time_window"]),
+                "spacing": info["Step_size"],
+                "header_bytes": (0,0),
+                "data_bytes": (0,ntraces*(128+2*nsamples))}
+
+    elif file_ext==".DZT":
+        datafile = filename
+        info, offset, datatype = gprIO_DZT.readdztHeader(filename)
+        nsamples = info["rh_nsamp"]
+        nchan = max(info["rh_nchan"],1)
+        samplesize = np.dtype(datatype).itemsize
+        ntraces = int((archiveFiles.fileSize(filename)-offset)/(nsamples*samplesize*nchan))
+        if info["rhf_spm"] != 0:
+            spacing = 1.0/info["rhf_spm"]
+        else:
+            spacing = 1.0/info["rhf_sps"]
+        meta = {"format": "DZT", "dtype": datatype,
+                "twtt": (0,info["rhf_range"]),
+                "spacing": spacing,
+                "nchannels": nchan,
+                "header_bytes": (0,offset),
+                "data_bytes": (offset,offset+nchan*ntraces*nsamples*samplesize)}
+
+    elif file_ext==".GPRhdr" or file_ext==".dat":
+        datafile = file_name + ".dat"
+        info = gprIO_BSQ.readGPRhdr(file_name + ".GPRhdr")
+        nsamples = int(info["lines"])
+        ntraces = int(info["columns"])
+        meta = {"format": "BSQ", "dtype": info["data"],
+                "twtt": (0,float(info["time_window"])),
+                "spacing": float(info["dx"]),
+                "header_bytes": (0,0),
+                "data_bytes": (0,nsamples*ntraces*np.dtype(info["data"]).itemsize)}
+
+    elif file_ext==".rad" or file_ext==".rd3" or file_ext==".rd7":
+        datafile = file_name + ".rd3"
+        if not archiveFiles.exists(datafile):
+            datafile = file_name + ".rd7"
+        info = gprIO_MALA.readGPRhdr(file_name + ".rad")
+        nsamples = int(info["SAMPLES"])
+        ntraces = int(archiveFiles.fileSize(datafile)/(2*nsamples))
+        meta = {"format": "MALA", "dtype": "int16",
+                "twtt": (0,float(info["TIMEWINDOW"])),
+                "spacing": float(info["DISTANCE INTERVAL"]),
+                "header_bytes": (0,0),
+                "data_bytes": (0,2*nsamples*ntraces)}
+
+    elif file_ext.lower()==".sgy" or file_ext.lower()==".segy":
+        datafile = filename
+        info, offset = gprIO_SEGY.readSEGYHeader(filename)
+        nsamples = info["hns"]
+        ntraces = info["ntraces"]
+        tracerec = gprIO_SEGY.traceType(nsamples,info["format"],info["byteorder"])
+        # The first two trace headers give the delay and the spacing
+        head = archiveFiles.fromfile(filename,dtype=tracerec,count=min(ntraces,2),offset=offset)['header']
+        delay = 0.0
+        if ntraces > 0:
+            delay = float(head['delrt'][0]*gprIO_SEGY.segyScale(head['scalet'][0]))
+        if ntraces > 1:
+            scale = gprIO_SEGY.segyScale(head['scalco'])
+            x = head['gx']*scale
+            y = head['gy']*scale
+            spacing = np.hypot(x[1]-x[0],y[1]-y[0])
+        else:
+            spacing = 0
+        if info["format"] == 1:
+            dtype = "ibm32"
+        else:
+            dtype = np.dtype(gprIO_SEGY.sampleFormats[info["format"]]).name
+        meta = {"format": "SEGY", "dtype": dtype,
+                "twtt": (delay,delay+info["dt"]*(nsamples-1)),
+                "spacing": float(spacing),
+                "header_bytes": (0,offset),
+                "data_bytes": (offset,offset+ntraces*tracerec.itemsize)}
+
+    elif file_ext==".gpr" and gprIO_GPR.isContainer(filename):
+        datafile = filename
+        header = gprIO_GPR.readGPRHeader(filename)
+        gprmeta, arrays = gprIO_GPR.readGPR(filename,["profilePos","twtt"],header=header)
+        profilePos = arrays["profilePos"]
+        twtt = arrays["twtt"]
+        info = gprmeta["info"]
+        desc = header["arrays"]["data"]
+        nsamples, ntraces = desc["shape"][-2:]
+        if len(profilePos) > 1:
+            spacing = (profilePos[-1]-profilePos[0])/(len(profilePos)-1)
+        else:
+            spacing = 0
+        start = header["datastart"]+desc["offset"]
+        meta = {"format": "gpr", "dtype": np.dtype(desc["dtype"]).name,
+                "twtt": (float(twtt[0]),float(twtt[-1])),
+                "spacing": float(spacing),
+                "header_bytes": (0,header["datastart"]),
+                "data_bytes": (start,start+desc["nbytes"])}
+        if "codec" in desc:
+            meta["compression"] = desc["codec"]
+
+    elif file_ext==".gpr":
+        # Older .gpr files are a single pickle, which can only
+        # be read as a whole
+        datafile = filename
+        with archiveFiles.openFile(filename,'rb') as f:
+            data, info, profilePos, twtt = pickle.load(f)[0:4]
+        data = np.asarray(data)
+        nsamples, ntraces = data.shape
+        if len(profilePos) > 1:
+            spacing = (profilePos[-1]-profilePos[0])/(len(profilePos)-1)
+        else:
+            spacing = 0
+        meta = {"format": "gpr", "dtype": str(data.dtype),
+                "twtt": (float(twtt[0]),float(twtt[-1])),
+                "spacing": float(spacing),
+                "header_bytes": (0,0),
+                "data_bytes": (0,archiveFiles.fileSize(filename))}
+
+    else:
+        raise ValueError("Unknown file type '%s'. Use dt1, DT1, hd, HD, DZT, dat, GPRhdr, rad, rd3, rd7, sgy, segy, or gpr files" %(file_ext))
+
+    meta["datafile"] = datafile
+    meta["nsamples"] = nsamples
+    meta["ntraces"] = ntraces
+    meta["info"] = info
+    return meta
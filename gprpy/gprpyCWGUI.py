@@ -65,6 +65,9 @@ class GPRPyCWApp:
         self.cidict["cwdata"] = None
         self.cidict["linear stacked amplitude"] = None
         self.cidict["hyperbolic stacked amplitude"] = None
+        self.cidict["semblance"] = None
+        # Left panel shows hyperbolic stacked amplitude ("hyp") or semblance ("semb")
+        self.hyppanel = "hyp"
         
         self.vmin = 0.01
         self.vmax = 0.33
@@ -216,17 +219,27 @@ class GPRPyCWApp:
         HypStAmpButton = tk.Button(
             text="hyp st amp", fg="black",
             command = lambda : [self.hypStAmp(proj),
-                                self.plotStAmp(proj,a=ahyp,canvas=canvas,
-                                               stamp=proj.hypStAmp,
-                                               title='hyperbolic stacked amplitude',
-                                               ylabel='two-way travel time [ns]')])
-        HypStAmpButton.config(height = 1, width = 2*halfwid)
-        HypStAmpButton.grid(row=11, column=rightcol, sticky='nsew',columnspan=colsp)
+                                self.plotHypPanel(proj,a=ahyp,canvas=canvas)])
+        HypStAmpButton.config(height = 1, width = halfwid)
+        HypStAmpButton.grid(row=11, column=rightcol, sticky='nsew')
         self.balloon.bind(HypStAmpButton,
                           "Calculate the hyperbolic stacked amplitude for\n"
                           "the selected velocity ranges and two-way travel\n" 
                           "times.")
 
+        # Semblance
+        SembButton = tk.Button(
+            text="semblance", fg="black",
+            command = lambda : [self.semblance(proj),
+                                self.plotHypPanel(proj,a=ahyp,canvas=canvas)])
+        SembButton.config(height = 1, width = halfwid)
+        SembButton.grid(row=11, column=rightcol+1, sticky='nsew')
+        self.balloon.bind(SembButton,
+                          "Calculate the hyperbolic semblance (normalized\n"
+                          "coherence) for the selected velocity ranges\n"
+                          "over a chosen time window. Shown instead of\n"
+                          "the hyperbolic stacked amplitude.")
+
         # Add line on top of data
         AddLinButton = tk.Button(
             text="add ln", fg="black",
@@ -343,9 +356,7 @@ class GPRPyCWApp:
                               self.plotCWData(proj,a=adata,canvas=canvas),
                               self.plotStAmp(proj,a=alin,canvas=canvas,stamp=proj.linStAmp,
                                              title='linear stacked amplitude'),
-                              self.plotStAmp(proj,a=ahyp,canvas=canvas,stamp=proj.hypStAmp,
-                                            title='hyperbolic stacked amplitude',
-                                             ylabel='two-way travel time [ns]')])
+                              self.plotHypPanel(proj,a=ahyp,canvas=canvas)])
         FullButton.config(height = 1, width = 2*halfwid)         
         FullButton.grid(row=0, column=1, sticky='nsew',rowspan=2)
         self.balloon.bind(FullButton,"Resets x- and y-axis limits to full data.")
@@ -390,9 +401,7 @@ class GPRPyCWApp:
                               self.plotCWData(proj,a=adata,canvas=canvas),
                               self.plotStAmp(proj,a=alin,canvas=canvas,
                                              stamp=proj.linStAmp,title='linear stacked amplitude'),
-                              self.plotStAmp(proj,a=ahyp,canvas=canvas,stamp=proj.hypStAmp,
-                                            title='hyperbolic stacked amplitude',
-                                            ylabel='two-way travel time [ns]')])
+                              self.plotHypPanel(proj,a=ahyp,canvas=canvas)])
         YrngButton.config(height = 1, width = 2*halfwid)         
         YrngButton.grid(row=0, column=5, sticky='nsew',rowspan=2)
         self.balloon.bind(YrngButton,"Set the y-axis display limits.")
@@ -429,9 +438,7 @@ class GPRPyCWApp:
             command=lambda : [self.plotCWData(proj,a=adata,canvas=canvas),
                               self.plotStAmp(proj,a=alin,canvas=canvas,
                                              stamp=proj.linStAmp,title='linear stacked amplitude'),
-                              self.plotStAmp(proj,a=ahyp,canvas=canvas,stamp=proj.hypStAmp,
-                                            title='hyperbolic stacked amplitude',
-                                             ylabel='two-way travel time [ns]')])
+                              self.plotHypPanel(proj,a=ahyp,canvas=canvas)])
         plotButton.config(height = 1, width = 2*halfwid)
         plotButton.grid(row=0, column=8, sticky='nsew',rowspan=2)
         self.balloon.bind(plotButton,
@@ -585,6 +592,17 @@ class GPRPyCWApp:
 
 
         
+    def plotHypPanel(self,proj,a,canvas):
+        if self.hyppanel == "semb":
+            self.plotStAmp(proj,a=a,canvas=canvas,stamp=proj.semb,
+                           title='semblance',
+                           ylabel='two-way travel time [ns]')
+        else:
+            self.plotStAmp(proj,a=a,canvas=canvas,stamp=proj.hypStAmp,
+                           title='hyperbolic stacked amplitude',
+                           ylabel='two-way travel time [ns]')
+
+        
     def setYrng(self):
         ylow = sd.askfloat("Input","Min Y value")
         if ylow is not None:            
@@ -669,6 +687,13 @@ class GPRPyCWApp:
 
     def hypStAmp(self,proj):
         proj.hypStackedAmplitude(self.vmin,self.vmax,self.vint)
+        self.hyppanel = "hyp"
+
+    def semblance(self,proj):
+        window = sd.askinteger("Input","Semblance time window width (number of samples)")
+        if window is not None:
+            proj.semblance(self.vmin,self.vmax,self.vint,window=window)
+            self.hyppanel = "semb"
         
 
     def addLin(self,proj):
@@ -724,6 +749,13 @@ class GPRPyCWApp:
                                            yrng=self.yrng, vrng=[self.vmin,self.vmax],
                                            dpi=dpi)
                      print('Printed %s' %(fignamesplit[0]+"_hypStAmp"+fignamesplit[1]))
+
+                if proj.semb is not None:
+                     proj.printStAmpFigure(fignamesplit[0]+"_semblance"+fignamesplit[1], whichstamp="semb",
+                                           saturation=self.saturation.get(),
+                                           yrng=self.yrng, vrng=[self.vmin,self.vmax],
+                                           dpi=dpi)
+                     print('Printed %s' %(fignamesplit[0]+"_semblance"+fignamesplit[1]))
                 
     def writeHistory(self,proj):        
         filename = fd.asksaveasfilename(defaultextension=".py")
@@ -1,5 +1,6 @@
 import gprpy.gprpy as gp
 import gprpy.toolbox.gprpyTools as tools
+import gprpy.surveyCatalog as catalog
 import numpy as np
 import copy
 import scipy.interpolate as interp
@@ -78,7 +79,9 @@ def makeDataCube(datalist,outname,nx=50,ny=50,nz=50,smooth=None,nprofile=None,nd
     
     INPUT:
     datalist      Python list containing the filenames (strings) for
-                  the preprocessed .gpr (GPRPy) data
+                  the preprocessed .gpr (GPRPy) data, or a
+                  surveyCatalog.catalogQuery selecting them from a
+                  catalog database
     outname       file name for the VTK file containing the resulting
                   interpolated (and smoothed) data cube. Can be visualized 
                   using for example Paraview or MayaVi
@@ -105,6 +108,7 @@ def makeDataCube(datalist,outname,nx=50,ny=50,nz=50,smooth=None,nprofile=None,nd
                   [default: False]
     '''
 
+    datalist = catalog.fileList(datalist)
 
     # Read all profiles to find out total data size
     totlen = 0
@@ -1,5 +1,7 @@
 import gprpy.gprpy as gp
+import gprpy.surveyCatalog as catalog
 import numpy as np
+import os
 from scipy.ndimage import zoom
 
 def mergeProfiles(file1,file2,outfile,gapfill=0):
@@ -75,7 +77,7 @@ def mergeProfiles(file1,file2,outfile,gapfill=0):
     profile1.profilePos = np.append(profile1.profilePos,profile2.profilePos)
     
     # Now merge them into profile 1      
-    profile1.data = np.asmatrix(np.hstack((profile1.data,profile2.data)))
+    profile1.data = np.hstack((profile1.data,profile2.data))
     
     # Set history to shortest possible:
     profile1.history = ["mygpr = gp.gprpyProfile()", "mygpr.importdata('%s.gpr')" %(outfile)]
@@ -84,3 +86,29 @@ def mergeProfiles(file1,file2,outfile,gapfill=0):
 
     # Save the result in a .gpr file
     profile1.save(outfile)
+
+
+def mergeProfileList(datalist,outfile,gapfill=0):
+    '''
+    Merges several GPR profiles by placing each one at the end
+    of the previous one, in the order of the list. See mergeProfiles.
+
+    INPUT:
+    datalist   list of file names (including path) of the profiles,
+               or a surveyCatalog.catalogQuery selecting them from
+               a catalog database
+    outfile    File name (including path) for the merged file
+    gapfill    If there is a gap between the profiles, fill it with
+               zeros (0) or NaN ('NaN')? [default: 0]
+    '''
+    datalist = catalog.fileList(datalist)
+    if len(datalist) < 2:
+        raise ValueError("Need at least two profiles to merge, got %d" %(len(datalist)))
+    # mergeProfiles takes the output name without the .gpr
+    # extension, which save adds
+    file_name, file_ext = os.path.splitext(outfile)
+    if file_ext=='.gpr':
+        outfile = file_name
+    mergeProfiles(datalist[0],datalist[1],outfile,gapfill)
+    for filename in datalist[2:]:
+        mergeProfiles(outfile + '.gpr',filename,outfile,gapfill)
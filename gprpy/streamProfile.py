@@ -0,0 +1,119 @@
+import gprpy.gprpy as gp
+import gprpy.toolbox.gprpyTools as tools
+import numpy as np
+import contextlib
+import io
+from tqdm import tqdm
+
+# Processing steps that can be applied block by block. The steps
+# act on single traces, except for remMeanTrace which needs
+# a halo of neighboring traces.
+streamSteps = {
+    "dewow": lambda data,twtt,window: tools.dewow(data,window),
+    "smooth": lambda data,twtt,window: tools.smooth(data,window),
+    "tpowGain": lambda data,twtt,power=0.0: tools.tpowGain(data,twtt,power),
+    "agcGain": lambda data,twtt,window=10,norm='energy': tools.agcGain(data,window,norm),
+    "remMeanTrace": lambda data,twtt,ntraces: tools.remMeanTrace(data,ntraces)
+}
+
+
+def openProfile(filename,dtype='float64',channel=None):
+    '''
+    Helper function. Opens a data file as memory-mapped
+    gprpyProfile, such that no data is read yet.
+    '''
+    gpr = gp.gprpyProfile(dtype=dtype)
+    gpr.importdata(filename,mmap=True,channel=channel)
+    return gpr
+
+
+def iterTraces(filename,block=4096,dtype='float64',channel=None):
+    '''
+    Reads a data file block by block. Only the current block of
+    traces is held in memory.
+
+    INPUT:
+    filename    name of any data file gprpyProfile.importdata can read
+    block       number of traces per block [default: 4096]
+    dtype       floating point type of the data [default: 'float64']
+    channel     for multi-channel files, which channel to read
+                [default: None, meaning all channels]
+
+    OUTPUT:
+    generator of (data, profilePos) where data is the data matrix
+    of the block, whose columns contain the traces (channels x 
+    samples x traces for multi-channel files), and profilePos
+    are the along-profile positions of these traces
+    '''
+    gpr = openProfile(filename,dtype,channel)
+    ntraces = gpr.data.shape[-1]
+    for start in range(0,ntraces,block):
+        yield np.asarray(gpr.data[...,start:start+block]), gpr.profilePos[start:start+block]
+
+
+def streamProcess(filename,outfile,steps,block=4096,dtype='float64',channel=None):
+    '''
+    Applies a series of processing steps to a data file block by
+    block and writes the result to a .npy file, such that the
+    memory use only depends on the block size, not on the
+    size of the data file.
+
+    remMeanTrace steps are calculated using a halo of neighboring
+    traces around each block, so the result is the same as when
+    processing the whole profile at once.
+
+    INPUT:
+    filename    name of any data file gprpyProfile.importdata can read
+    outfile     name of the .npy file to write the processed
+                data matrix to
+    steps       list of processing steps, each given as a tuple of
+                the function name and its arguments, like
+                [("dewow",10), ("remMeanTrace",100), ("tpowGain",1.5)].
+                Possible steps are dewow, smooth, tpowGain, agcGain,
+                and remMeanTrace.
+    block       number of traces to process at a time [default: 4096]
+    dtype       floating point type of the data [default: 'float64']
+    channel     for multi-channel files, which channel to process
+                [default: None, meaning all channels, which are
+                written as channels x samples x traces]
+
+    OUTPUT:
+    profilePos  along-profile positions of the traces
+    twtt        two-way travel times of the samples
+    '''
+    gpr = openProfile(filename,dtype,channel)
+    ntraces = gpr.data.shape[-1]
+
+    # How many traces on each side of a block the steps need
+    halo = 0
+    for step in steps:
+        if step[0] not in streamSteps:
+            raise ValueError("Unknown streaming step '%s'. Use %s" %(step[0],", ".join(streamSteps)))
+        if step[0] == "remMeanTrace":
+            if step[1] >= ntraces:
+                # The average over all traces needs all traces
+                halo = ntraces
+            else:
+                halo += int(np.ceil(step[1]/2.0))
+    # Blocks must be wider than the moving-average windows
+    block = max(block,2*halo+1)
+    minwidth = min(2*halo+1,ntraces)
+
+    out = np.lib.format.open_memmap(outfile,mode='w+',dtype=gpr.precision,
+                                    shape=gpr.data.shape)
+    for start in tqdm(range(0,ntraces,block)):
+        stop = min(start+block,ntraces)
+        # The last block can be short, so start its halo further
+        # back, such that the moving averages don't span the whole
+        # block
+        lo = max(min(start-halo,ntraces-minwidth),0)
+        hi = min(stop+halo,ntraces)
+        data = np.asarray(gpr.data[...,lo:hi])
+        with contextlib.redirect_stdout(io.StringIO()):
+            for step in steps:
+                data = streamSteps[step[0]](data,gpr.twtt,*step[1:])
+        out[...,start:stop] = data[...,start-lo:stop-lo]
+    out.flush()
+    del out
+    print("processed data written to " + outfile)
+    return gpr.profilePos, gpr.twtt
@@ -0,0 +1,305 @@
+import gprpy.gprpy as gp
+import gprpy.toolbox.gprIO_GPR as gprIO_GPR
+import gprpy.convertProfiles as convert
+import gprpy.toolbox.archiveFiles as archiveFiles
+import numpy as np
+import argparse
+import os
+import pickle
+import sqlite3
+import sys
+from tqdm import tqdm
+
+# Columns of the catalog table, besides the file name
+columns = [("mtime","REAL"), ("size","INTEGER"), ("format","TEXT"),
+           ("nsamples","INTEGER"), ("ntraces","INTEGER"), ("nchannels","INTEGER"),
+           ("dtype","TEXT"), ("twtt_min","REAL"), ("twtt_max","REAL"),
+           ("spacing","REAL"), ("antsep","REAL"), ("velocity","REAL"),
+           ("xmin","REAL"), ("xmax","REAL"), ("ymin","REAL"), ("ymax","REAL"),
+           ("zmin","REAL"), ("zmax","REAL")]
+
+
+def openCatalog(dbfile):
+    '''
+    Opens a catalog database, and creates the tables if the
+    database is new. The 3D extents of the profiles are kept in an
+    R*Tree index if SQLite supports it, otherwise in ordinary indices.
+
+    INPUT:
+    dbfile     name of the SQLite database file
+
+    OUTPUT:
+    con        sqlite3 connection
+    '''
+    con = sqlite3.connect(dbfile)
+    con.execute("CREATE TABLE IF NOT EXISTS profiles (id INTEGER PRIMARY KEY, path TEXT UNIQUE, %s)"
+                %(", ".join("%s %s" %(name,sqltype) for name,sqltype in columns)))
+    con.execute("CREATE INDEX IF NOT EXISTS profiles_format ON profiles (format)")
+    try:
+        con.execute("CREATE VIRTUAL TABLE IF NOT EXISTS extents USING rtree(id, xmin, xmax, ymin, ymax)")
+    except sqlite3.OperationalError:
+        con.execute("CREATE INDEX IF NOT EXISTS profiles_x ON profiles (xmin, xmax)")
+        con.execute("CREATE INDEX IF NOT EXISTS profiles_y ON profiles (ymin, ymax)")
+    con.commit()
+    return con
+
+
+def hasRtree(con):
+    '''
+    Helper function. Checks if the catalog has an R*Tree index.
+    '''
+    return con.execute("SELECT name FROM sqlite_master WHERE name='extents'").fetchone() is not None
+
+
+def findCatalogFiles(paths):
+    '''
+    Helper function. Lists all raw data files and .gpr files in the
+    given files, zip archives and directories (including subdirectories).
+    '''
+    return [os.path.abspath(filename) for filename, basedir in archiveFiles.walkFiles(paths)
+            if isCatalogFile(filename)]
+
+
+def isCatalogFile(filename):
+    '''
+    Helper function. Checks if filename is a .gpr file or a raw
+    data file whose header files exist.
+    '''
+    if os.path.splitext(filename)[1] == ".gpr":
+        return archiveFiles.exists(filename)
+    return convert.isDataFile(filename)
+
+
+def fileStamp(filename):
+    '''
+    Helper function. Returns the latest modification time and the
+    total size of a data file and its header files.
+    '''
+    if os.path.splitext(filename)[1] == ".gpr":
+        sources = [filename]
+    else:
+        sources = convert.sourceFiles(filename)
+    return (max(archiveFiles.fileTime(src) for src in sources),
+            sum(archiveFiles.fileSize(src) for src in sources))
+
+
+def catalogEntry(filename):
+    '''
+    Collects the catalog information of a data file. Only the
+    headers are read, except for older, pickled .gpr files.
+
+    INPUT:
+    filename   data file name
+
+    OUTPUT:
+    entry      dict with the values of the catalog columns
+    '''
+    meta = gp.probe(filename)
+    info = meta["info"]
+    antsep = None
+    velocity = None
+    threeD = None
+    file_ext = os.path.splitext(filename)[1]
+    if file_ext == ".gpr" and gprIO_GPR.isContainer(filename):
+        gprmeta, arrays = gprIO_GPR.readGPR(filename,["threeD"])
+        antsep = gprmeta["antsep"]
+        velocity = gprmeta["velocity"]
+        threeD = arrays["threeD"]
+    elif file_ext == ".gpr":
+        with archiveFiles.openFile(filename,'rb') as f:
+            saved = pickle.load(f)
+        antsep, velocity, threeD = saved[5], saved[6], saved[10]
+    elif isinstance(info,dict):
+        antsep = info.get("Antenna_sep",info.get("ANTENNA SEPARATION"))
+
+    entry = {"format": meta["format"], "nsamples": int(meta["nsamples"]),
+             "ntraces": int(meta["ntraces"]), "nchannels": meta.get("nchannels",1),
+             "dtype": meta["dtype"], "twtt_min": meta["twtt"][0], "twtt_max": meta["twtt"][1],
+             "spacing": meta["spacing"],
+             "antsep": None if antsep is None else float(antsep),
+             "velocity": None if velocity is None else float(velocity)}
+    for axis, name in enumerate(["x","y","z"]):
+        if threeD is not None and np.size(threeD) > 0:
+            entry[name+"min"] = float(np.nanmin(np.asarray(threeD)[:,axis]))
+            entry[name+"max"] = float(np.nanmax(np.asarray(threeD)[:,axis]))
+        else:
+            entry[name+"min"] = None
+            entry[name+"max"] = None
+    return entry
+
+
+def storeEntry(con,filename,entry):
+    '''
+    Helper function. Inserts or replaces the catalog entry of a file.
+    '''
+    names = ["path"] + [name for name,sqltype in columns]
+    values = [filename] + [entry[name] for name,sqltype in columns]
+    row = con.execute("SELECT id FROM profiles WHERE path=?",(filename,)).fetchone()
+    if row is None:
+        cur = con.execute("INSERT INTO profiles (%s) VALUES (%s)"
+                          %(", ".join(names),", ".join("?"*len(names))),values)
+        rowid = cur.lastrowid
+    else:
+        rowid = row[0]
+        con.execute("UPDATE profiles SET %s WHERE id=?"
+                    %(", ".join("%s=?" %(name) for name in names)),values+[rowid])
+    if hasRtree(con):
+        con.execute("DELETE FROM extents WHERE id=?",(rowid,))
+        if entry["xmin"] is not None:
+            con.execute("INSERT INTO extents VALUES (?,?,?,?,?)",
+                        (rowid,entry["xmin"],entry["xmax"],entry["ymin"],entry["ymax"]))
+
+
+def removeEntry(con,rowid):
+    '''
+    Helper function. Removes a file from the catalog.
+    '''
+    con.execute("DELETE FROM profiles WHERE id=?",(rowid,))
+    if hasRtree(con):
+        con.execute("DELETE FROM extents WHERE id=?",(rowid,))
+
+
+def scanCatalog(dbfile,paths,force=False,prune=True):
+    '''
+    Adds data files to a catalog database, or updates their entries.
+    Files that did not change since the last scan are skipped, so
+    scanning a directory again is fast.
+
+    INPUT:
+    dbfile     name of the SQLite database file
+    paths      list of data file names, zip archives and directories.
+               Directories and archives are searched for .gpr and raw
+               data files (DZT, DT1, MALA, BSQ, SEG-Y), including
+               subdirectories. Files in archives can also be given as
+               "archive.zip::path/FILE.DZT".
+    force      read all files again, even if they did not change
+               [default: False]
+    prune      remove files within the scanned directories from the
+               catalog that no longer exist [default: True]
+
+    OUTPUT:
+    summary    dict with the lists of "added", "updated", "unchanged",
+               "removed", and "failed" files
+    '''
+    if isinstance(paths,str):
+        paths = [paths]
+    summary = {"added": [], "updated": [], "unchanged": [], "removed": [], "failed": []}
+    con = openCatalog(dbfile)
+    try:
+        known = {path: (rowid,mtime,size) for rowid,path,mtime,size in
+                 con.execute("SELECT id, path, mtime, size FROM profiles")}
+        found = findCatalogFiles(paths)
+        for filename in tqdm(found):
+            try:
+                mtime, size = fileStamp(filename)
+                if not force and filename in known and known[filename][1:] == (mtime,size):
+                    summary["unchanged"].append(filename)
+                    continue
+                entry = catalogEntry(filename)
+                entry["mtime"] = mtime
+                entry["size"] = size
+                storeEntry(con,filename,entry)
+                summary["updated" if filename in known else "added"].append(filename)
+            except Exception as e:
+                summary["failed"].append(filename)
+                print("Could not catalog %s: %s" %(filename,e))
+        if prune:
+            found = set(found)
+            dirs = [os.path.join(os.path.abspath(path),'') for path in paths if os.path.isdir(path)]
+            for path, (rowid,mtime,size) in known.items():
+                if path not in found and any(path.startswith(d) for d in dirs) and not archiveFiles.exists(path):
+                    removeEntry(con,rowid)
+                    summary["removed"].append(path)
+        con.commit()
+    finally:
+        con.close()
+    print("Cataloged %d new and %d changed files, %d unchanged, %d removed, %d failed."
+          %(len(summary["added"]),len(summary["updated"]),len(summary["unchanged"]),
+            len(summary["removed"]),len(summary["failed"])))
+    return summary
+
+
+def queryCatalog(dbfile,bbox=None,where=None,params=()):
+    '''
+    Selects files from a catalog database.
+
+    INPUT:
+    dbfile     name of the SQLite database file
+    bbox       (xmin, xmax, ymin, ymax) area the profiles need to
+               overlap. Only files with 3D coordinates (threeD)
+               are found. [default: None, meaning anywhere]
+    where      SQL condition on the catalog columns, like
+               "format='gpr' AND twtt_max >= ?" [default: None]
+    params     values for the ? in where [default: ()]
+
+    OUTPUT:
+    list of file names, sorted by name
+    '''
+    con = openCatalog(dbfile)
+    try:
+        conditions = []
+        values = []
+        if bbox is not None:
+            if hasRtree(con):
+                conditions.append("id IN (SELECT id FROM extents WHERE xmax>=? AND xmin<=? AND ymax>=? AND ymin<=?)")
+            else:
+                conditions.append("(xmax>=? AND xmin<=? AND ymax>=? AND ymin<=?)")
+            values += [bbox[0],bbox[1],bbox[2],bbox[3]]
+        if where is not None:
+            conditions.append("(%s)" %(where))
+            values += list(params)
+        sql = "SELECT path FROM profiles"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY path"
+        return [row[0] for row in con.execute(sql,values)]
+    finally:
+        con.close()
+
+
+class catalogQuery:
+    '''
+    A selection of files from a catalog database, which can be
+    given to makeDataCube or mergeProfileList instead of a list of
+    file names. The database is only queried when the files are used.
+
+    INPUT:
+    dbfile     name of the SQLite database file
+    bbox       (xmin, xmax, ymin, ymax) area the profiles need to
+               overlap [default: None, meaning anywhere]
+    where      SQL condition on the catalog columns [default: None]
+    params     values for the ? in where [default: ()]
+    '''
+    def __init__(self,dbfile,bbox=None,where=None,params=()):
+        self.dbfile = dbfile
+        self.bbox = bbox
+        self.where = where
+        self.params = params
+
+    def files(self):
+        return queryCatalog(self.dbfile,self.bbox,self.where,self.params)
+
+
+def fileList(datalist):
+    '''
+    Helper function. Turns a list of file names or a catalogQuery
+    into a list of file names.
+    '''
+    if isinstance(datalist,catalogQuery):
+        return datalist.files()
+    return list(datalist)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Catalog GPR data files (.gpr, DZT, DT1, MALA, BSQ, SEG-Y) in an SQLite database")
+    parser.add_argument('dbfile',help='catalog database file')
+    parser.add_argument('paths',nargs='+',help='data files, zip archives, and directories to add')
+    parser.add_argument('-f','--force',action='store_true',help='also read files that did not change')
+    parser.add_argument('--keep',action='store_true',help='keep entries of files that no longer exist')
+    args = parser.parse_args(args)
+    summary = scanCatalog(args.dbfile,args.paths,args.force,not args.keep)
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
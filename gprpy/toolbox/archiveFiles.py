@@ -0,0 +1,280 @@
+import functools
+import io
+import os
+import struct
+import zipfile
+import numpy as np
+
+# Members of zip archives are given as "archive.zip::path/FILE.DZT".
+# Stored (uncompressed) members are a contiguous byte range of the
+# archive and are read like ordinary files, including memory-mapping.
+# Compressed members are decompressed as a stream while reading,
+# without extracting them to disk.
+separator = "::"
+
+
+def splitArchive(filename):
+    '''
+    Splits "archive.zip::member" into the archive and the member name.
+
+    INPUT:
+    filename     file name, possibly of an archive member
+
+    OUTPUT:
+    archive      name of the archive, or filename if it is not
+                 an archive member
+    member       name of the member in the archive, or None
+    '''
+    if separator in filename:
+        archive, member = filename.split(separator,1)
+        return archive, member
+    return filename, None
+
+
+def isArchived(filename):
+    '''
+    Checks if filename refers to a member of a zip archive.
+    '''
+    return splitArchive(filename)[1] is not None
+
+
+@functools.lru_cache(maxsize=16)
+def archiveIndex(archive,mtime):
+    '''
+    Helper function. Reads the directory of a zip archive and the
+    position of the data of each stored member. The modification
+    time is part of the cache key, so changed archives are read again.
+    '''
+    index = {}
+    with zipfile.ZipFile(archive) as z, open(archive,'rb') as f:
+        for zinfo in z.infolist():
+            if zinfo.is_dir():
+                continue
+            start = None
+            if zinfo.compress_type == zipfile.ZIP_STORED and not zinfo.flag_bits & 0x1:
+                # The data follows the local header, whose name and
+                # extra field lengths can differ from the directory
+                f.seek(zinfo.header_offset)
+                local = f.read(30)
+                namelen, extralen = struct.unpack('<HH',local[26:30])
+                start = zinfo.header_offset + 30 + namelen + extralen
+            index[zinfo.filename] = (zinfo,start)
+    return index
+
+
+def memberInfo(filename):
+    '''
+    Helper function. Returns the ZipInfo of an archive member and
+    the position of its data in the archive (None if the member
+    is compressed).
+    '''
+    archive, member = splitArchive(filename)
+    index = archiveIndex(archive,os.path.getmtime(archive))
+    if member not in index:
+        raise FileNotFoundError("No member %s in %s" %(member,archive))
+    return index[member]
+
+
+def listArchive(archive):
+    '''
+    Lists all files in a zip archive.
+
+    INPUT:
+    archive      name of the zip archive
+
+    OUTPUT:
+    list of "archive::member" names
+    '''
+    index = archiveIndex(archive,os.path.getmtime(archive))
+    return [archive + separator + member for member in sorted(index)]
+
+
+def isArchive(filename):
+    '''
+    Checks if filename is a zip archive.
+    '''
+    return os.path.splitext(filename)[1].lower() == ".zip" and zipfile.is_zipfile(filename)
+
+
+def walkFiles(paths):
+    '''
+    Lists all files in the given files and directories, including
+    subdirectories and the files in zip archives.
+
+    INPUT:
+    paths        list of file names, archive member names, zip
+                 archives, and directories
+
+    OUTPUT:
+    generator of (file name, directory it was found in)
+    '''
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                for name in sorted(files):
+                    filename = os.path.join(root,name)
+                    if isArchive(filename):
+                        for member in listArchive(filename):
+                            yield member, path
+                    else:
+                        yield filename, path
+        elif isArchive(path):
+            for member in listArchive(path):
+                yield member, os.path.dirname(path)
+        else:
+            yield path, os.path.dirname(splitArchive(path)[0])
+
+
+def location(filename):
+    '''
+    Returns the file on disk and the position in it at which the
+    contents of filename start.
+
+    INPUT:
+    filename     file name, possibly of an archive member
+
+    OUTPUT:
+    (file on disk, start position), or None if filename is a
+    compressed archive member
+    '''
+    archive, member = splitArchive(filename)
+    if member is None:
+        return filename, 0
+    zinfo, start = memberInfo(filename)
+    if start is None:
+        return None
+    return archive, start
+
+
+def exists(filename):
+    '''
+    Checks if a file or archive member exists.
+    '''
+    archive, member = splitArchive(filename)
+    if member is None:
+        return os.path.exists(filename)
+    if not os.path.exists(archive):
+        return False
+    return member in archiveIndex(archive,os.path.getmtime(archive))
+
+
+def fileSize(filename):
+    '''
+    Size of a file or archive member in bytes (uncompressed).
+    '''
+    if not isArchived(filename):
+        return os.path.getsize(filename)
+    return memberInfo(filename)[0].file_size
+
+
+def fileTime(filename):
+    '''
+    Modification time of a file. Archive members have the
+    modification time of the archive.
+    '''
+    return os.path.getmtime(splitArchive(filename)[0])
+
+
+def openFile(filename,mode='rb',**kwargs):
+    '''
+    Opens a file or archive member for reading.
+
+    INPUT:
+    filename     file name, possibly of an archive member
+    mode         'rb' for binary or 'r' for text [default: 'rb']
+    kwargs       further arguments for opening text files, like
+                 newline
+
+    OUTPUT:
+    file object
+    '''
+    archive, member = splitArchive(filename)
+    if member is None:
+        return open(filename,mode,**kwargs)
+    with zipfile.ZipFile(archive) as z:
+        # The member stays readable after closing the archive
+        f = z.open(member)
+    if 'b' in mode:
+        return f
+    return io.TextIOWrapper(f,**kwargs)
+
+
+def readBytes(filename,offset,nbytes):
+    '''
+    Reads nbytes bytes starting at offset from a file or
+    archive member.
+    '''
+    loc = location(filename)
+    if loc is not None:
+        with open(loc[0],'rb') as f:
+            f.seek(loc[1]+offset)
+            return f.read(nbytes)
+    with openFile(filename) as f:
+        f.seek(offset)
+        return f.read(nbytes)
+
+
+def fromfile(filename,dtype,count=-1,offset=0):
+    '''
+    Reads an array from a file or archive member, like np.fromfile.
+    Compressed archive members are decompressed as a stream into
+    the array.
+
+    INPUT:
+    filename     file name, possibly of an archive member
+    dtype        data type of the array
+    count        number of items to read [default: -1, meaning
+                 until the end of the file]
+    offset       position of the first item in bytes [default: 0]
+
+    OUTPUT:
+    data         1D array
+    '''
+    dtype = np.dtype(dtype)
+    if not isArchived(filename):
+        return np.fromfile(filename,dtype=dtype,count=count,offset=offset)
+    available = (fileSize(filename)-offset)//dtype.itemsize
+    count = available if count < 0 else min(count,available)
+    loc = location(filename)
+    if loc is not None:
+        return np.fromfile(loc[0],dtype=dtype,count=count,offset=loc[1]+offset)
+    data = np.empty(count,dtype=dtype)
+    buf = memoryview(data.view(np.uint8))
+    with openFile(filename) as f:
+        # Skip to the offset, then decompress straight into the array
+        f.seek(offset)
+        pos = 0
+        while pos < len(buf):
+            n = f.readinto(buf[pos:])
+            if n == 0:
+                break
+            pos += n
+    return data
+
+
+def memmap(filename,dtype,offset=0,shape=None,order='C'):
+    '''
+    Memory-maps a file or stored archive member read-only, like
+    np.memmap. Compressed archive members can't be memory-mapped,
+    they are read into memory instead.
+
+    INPUT:
+    filename     file name, possibly of an archive member
+    dtype        data type of the array
+    offset       position of the first item in bytes [default: 0]
+    shape        shape of the array [default: None, meaning a 1D
+                 array until the end of the file]
+    order        'C' or 'F' [default: 'C']
+
+    OUTPUT:
+    data         np.memmap or array
+    '''
+    dtype = np.dtype(dtype)
+    if shape is None:
+        shape = ((fileSize(filename)-offset)//dtype.itemsize,)
+    loc = location(filename)
+    if loc is not None:
+        return np.memmap(loc[0],dtype=dtype,mode='r',offset=loc[1]+offset,
+                         shape=shape,order=order)
+    data = fromfile(filename,dtype,int(np.prod(shape)),offset)
+    return np.reshape(data,shape,order=order)
@@ -1,9 +1,11 @@
 import struct
 import numpy as np
 import re # Regular expressions
+from gprpy.toolbox.mappedTraces import mappedTraces
+import gprpy.toolbox.archiveFiles as archiveFiles
 
 
-def readBSQ(file_name):
+def readBSQ(file_name,dtype=np.float64,mmap=False,keepint=False):
     '''
     Reads the ENVI standard BSQ files. The file extension for the 
     data needs to be ".dat" and the extension for the header needs 
@@ -11,6 +13,15 @@ def readBSQ(file_name):
 
     INPUT: 
     file_name      data file name without the extension!
+    dtype          floating point type of the returned data
+                   [default: np.float64]
+    mmap           if True, the data is returned as a mappedTraces
+                   matrix that reads the samples from the file only
+                   when they are used [default: False]
+    keepint        if True, keep the samples in memory in their stored
+                   integer format and return them as a mappedTraces matrix
+                   that converts them to dtype only when used
+                   [default: False]
 
     OUTPUT:
     data          data matrix whose columns contain the traces
@@ -21,11 +32,19 @@ def readBSQ(file_name):
     filename = file_name + '.dat'
     # Set data type
     if info['data'] == 'float32':
-        data = np.fromfile(filename, dtype=np.float32)
+        filetype = np.float32
     elif info['data'] == 'int16':
-        data = np.fromfile(filename, dtype=np.int16)
+        filetype = np.int16
+    shape = (int(info['lines']), int(info['columns']))
 
-    data = np.asmatrix(data.reshape( (int(info['lines']), int(info['columns'])) ))
+    if mmap:
+        data = archiveFiles.memmap(filename, dtype=filetype, shape=shape)
+        return mappedTraces(data,0,dtype), info
+
+    data = archiveFiles.fromfile(filename, dtype=filetype).reshape(shape)
+    if keepint:
+        return mappedTraces(data,0,dtype), info
+    data = data.astype(dtype,copy=False)
         
     return data, info
     
@@ -43,7 +62,7 @@ def readGPRhdr(filename):
     '''
     # Read in text file
     info = {}
-    with open(filename) as f:
+    with archiveFiles.openFile(filename,'r') as f:
         for line in f:
             strsp = line.split()
             info[strsp[0]] = strsp[-1]
@@ -1,47 +1,61 @@
-import struct
 import numpy as np
 import re # Regular expressions
+from gprpy.toolbox.mappedTraces import mappedTraces
+import gprpy.toolbox.archiveFiles as archiveFiles
 
-def readdt1(filename):
+def readdt1(filename,dtype=np.float64,traceheaders=False,mmap=False,keepint=False):
     '''
-    Reads the Sensors and Software .DT1 data files. This function is
-    a Python translation of http://www.lucabaradello.it/files/dt1read.m
+    Reads the Sensors and Software .DT1 data files. Originally a
+    Python translation of http://www.lucabaradello.it/files/dt1read.m
 
     INPUT: 
     filename      data file name including the .DT1 extension
+    dtype         floating point type of the returned data
+                  [default: np.float64]
+    traceheaders  if True, also return the trace headers
+                  [default: False]
+    mmap          if True, the data is returned as a mappedTraces
+                  matrix that reads the samples from the file only
+                  when they are used [default: False]
+    keepint       if True, keep the samples in memory in their stored
+                  integer format and return them as a mappedTraces matrix
+                  that converts them to dtype only when used
+                  [default: False]
 
     OUTPUT:
     data          data matrix whose columns contain the traces
+    head          (only if traceheaders is True) 32 x ntraces matrix
+                  whose columns contain the 32 header floats of
+                  each trace
     '''
-    # This function is a python translation of dt1read.m from
-    # http://www.lucabaradello.it/files/dt1read.m
     headlen = 32
-    with open(filename,"rb") as datafile:
-        datafile.seek(8,0) # 0 is beginning of file
-        samples, = struct.unpack('f',datafile.read(4))
-        samples = int(samples)
-        dimtrace = samples*2+128
-        datafile.seek(-dimtrace,2) # 2 stands for end of file
-        #print(datafile.tell())
-        max_traces, = struct.unpack('f',datafile.read(4))
-        max_traces = int(max_traces)
-        # Initialize matrix
-        data = np.zeros((samples,max_traces))
-        head = np.zeros((headlen,max_traces))
-        # Set the reader to the beginning of the file
-        datafile.seek(0,0)
-        for j in range(0,max_traces):
-            # Read the header info
-            for k in range(0,headlen):
-                info, =  struct.unpack('f',datafile.read(4))
-                head[k,j] = info
-            # Now the actual data
-            for k in range(0,samples):
-                # 2 is the size of short, 'h' is the symbol
-                pnt, = struct.unpack('h',datafile.read(2))
-                data[k,j] = pnt
-            datafile.seek(dimtrace*(j+1),0) 
-    return np.asmatrix(data)
+    samples = int(archiveFiles.fromfile(filename,'<f4',count=1,offset=8)[0])
+    dimtrace = samples*2+128
+    size = archiveFiles.fileSize(filename)
+    if archiveFiles.location(filename) is not None:
+        # The first header float of the last trace is the trace number
+        max_traces = int(archiveFiles.fromfile(filename,'<f4',count=1,offset=size-dimtrace)[0])
+    else:
+        # Compressed archive members can't be read from the end
+        # without decompressing everything
+        max_traces = size//dimtrace
+    # Each trace is a record of 32 header floats followed by
+    # the samples as shorts, so we can read all traces at once
+    tracerec = np.dtype([('head','<f4',(headlen,)),
+                         ('samples','<i2',(samples,))])
+    if mmap:
+        traces = archiveFiles.memmap(filename,dtype=tracerec,shape=(max_traces,))
+        data = mappedTraces(traces['samples'].T,0,dtype)
+    else:
+        traces = archiveFiles.fromfile(filename,dtype=tracerec,count=max_traces)
+        if keepint:
+            data = mappedTraces(traces['samples'].T,0,dtype)
+        else:
+            data = traces['samples'].T.astype(dtype)
+    if traceheaders:
+        head = traces['head'].T.astype(np.float64)
+        return data, head
+    return data
 
         
        
@@ -57,7 +71,7 @@ def readdt1Header(filename):
     '''
     
     info = {}
-    with open(filename,"r",newline='\n') as datafile:
+    with archiveFiles.openFile(filename,"r",newline='\n') as datafile:
         datafile.readline().strip()
         info["system"] = datafile.readline().strip()
         info["date"] = datafile.readline().strip()
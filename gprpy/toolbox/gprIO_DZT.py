@@ -1,27 +1,27 @@
 import struct
 import numpy as np
+from gprpy.toolbox.mappedTraces import mappedTraces
+import gprpy.toolbox.archiveFiles as archiveFiles
 #import re # Regular expressions
 
-def readdzt(filename):
+def readdztHeader(filename):
     '''
-    Reads a GSSI .DZT data file. 
+    Reads the header of a GSSI .DZT data file.
 
     INPUT: 
     filename     data file name including .DZT extension
 
     OUTPUT:
-    data          data matrix whose columns contain the traces
     info          dict with information from the header
-
-    Thanks to Ian Nesbitt for pointing out extended headers and
-    providing the documentation file.
+    offset        size of the header in bytes; the data starts here
+    datatype      data type of the stored samples
     '''
 
     # Documentation file is DZT.File.Format.6-14-16.pdf
     
     info = {}
     
-    fid = open(filename,'rb');
+    fid = archiveFiles.openFile(filename,'rb');
 
 
     # H is unsigned int 16 (ushort = uint16)
@@ -47,6 +47,7 @@ def readdzt(filename):
 
     # Bits per word
     rh_bits = struct.unpack('h', fid.read(2))[0] # Pos 06
+    info["rh_bits"] = rh_bits
     
     # Binary offset
     rh_zero = struct.unpack('h', fid.read(2))[0] # Pos 08
@@ -101,6 +102,7 @@ def readdzt(filename):
 
     # number of channels
     rh_nchan = struct.unpack('h',fid.read(2))[0] # Pos 52
+    info["rh_nchan"] = rh_nchan
 
     # ... and more stuff we don't really need
 
@@ -124,23 +126,85 @@ def readdzt(filename):
     elif rh_bits == 32:
         datatype = 'int32'
 
-        
-    # Read the entire file
-    vec = np.fromfile(filename,dtype=datatype)
-        
-    headlength = offset/(rh_bits/8)
+    return info, offset, datatype
+
+
+
+def readdzt(filename,dtype=np.float64,mmap=False,keepint=False):
+    '''
+    Reads a GSSI .DZT data file. 
+
+    INPUT: 
+    filename     data file name including .DZT extension
+    dtype        floating point type of the returned data
+                 [default: np.float64]
+    mmap         if True, the data is returned as a mappedTraces
+                 matrix that reads the samples from the file only
+                 when they are used [default: False]
+    keepint      if True, keep the samples in memory in their stored
+                 integer format and return them as a mappedTraces matrix
+                 that converts them to dtype only when used
+                 [default: False]
+
+    OUTPUT:
+    data          data matrix whose columns contain the traces, or
+                  for multi-channel files a channels x samples x traces
+                  array
+    info          dict with information from the header
+
+    Thanks to Ian Nesbitt for pointing out extended headers and
+    providing the documentation file.
+    '''
+
+    info, offset, datatype = readdztHeader(filename)
+    rh_nsamp = info["rh_nsamp"]
+    rh_bits = info["rh_bits"]
+
+    # Multi-channel systems store the traces of all channels
+    # interleaved, one trace per channel after the other
+    nchan = max(info["rh_nchan"],1)
+
+    # Read everything after the header. Each trace is stored as
+    # one row of rh_nsamp samples
+    samplesize = np.dtype(datatype).itemsize
+    ntraces = int((archiveFiles.fileSize(filename)-offset)/(rh_nsamp*samplesize*nchan))
+    nvals = ntraces*nchan*rh_nsamp
 
-    # Only use the data, discard the header
-    datvec = vec[int(headlength):]
-    
     # Turn unsigned integers into signed integers
     # Only necessary where unsigned
     if rh_bits == 8 or rh_bits == 16:
-        datvec = datvec - (2**rh_bits)/2.0
+        binoffset = (2**rh_bits)/2.0
+    else:
+        binoffset = 0
 
-    # reshape into matrix
-    data = np.reshape(datvec,[int(len(datvec)/rh_nsamp),rh_nsamp])
+    if mmap:
+        raw = archiveFiles.memmap(filename,dtype=datatype,offset=offset,shape=(nvals,))
+        return mappedTraces(channelView(raw,ntraces,nchan,rh_nsamp),binoffset,dtype), info
+
+    datvec = archiveFiles.fromfile(filename,dtype=datatype,count=nvals,offset=offset)
 
-    data = np.asmatrix(data)
+    if keepint:
+        return mappedTraces(channelView(datvec,ntraces,nchan,rh_nsamp),binoffset,dtype), info
     
-    return data.transpose(), info
+    # Convert to floating point 
+    datvec = datvec.astype(dtype)
+    if binoffset != 0:
+        datvec -= binoffset
+
+    # reshape into matrix
+    data = channelView(datvec,ntraces,nchan,rh_nsamp)
+    
+    return data, info
+
+
+
+def channelView(datvec,ntraces,nchan,nsamp):
+    '''
+    Helper function. Turns the samples as stored in the file into 
+    a samples x traces matrix, or for multi-channel files into a 
+    channels x samples x traces array. This is a strided view of
+    datvec, no samples are copied.
+    '''
+    if nchan == 1:
+        return np.reshape(datvec,[ntraces,nsamp]).transpose()
+    return np.reshape(datvec,[ntraces,nchan,nsamp]).transpose(1,2,0)
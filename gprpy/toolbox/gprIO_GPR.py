@@ -0,0 +1,566 @@
+import base64
+import datetime
+import json
+import os
+import tempfile
+import zlib
+import bz2
+import lzma
+import concurrent.futures as futures
+import numpy as np
+from numpy.lib.mixins import NDArrayOperatorsMixin
+import gprpy.toolbox.archiveFiles as archiveFiles
+
+# A .gpr file starts either with this string, or, for files
+# saved by older GPRPy versions, with a pickle.
+#
+# Layout of the file:
+#  8 bytes    magic string
+#  8 bytes    length of the header, little-endian unsigned int
+#  header     JSON: {"version", "meta", "arrays"}
+#  arrays     raw arrays, each starting at a multiple of 64 bytes
+#             after the first 64-byte boundary following the header
+#
+# "meta" holds the small profile attributes (info, history, ...),
+# "arrays" holds for each array its dtype, shape, and byte offset
+# relative to the start of the arrays. Arrays are stored in Fortran
+# order, such that each trace, and each range of traces, is
+# contiguous in the file.
+#
+# Arrays with two or more dimensions can be stored compressed. They
+# are then split into chunks of "chunk" traces that are compressed
+# independently, and "chunks" lists the offset and size of each
+# compressed chunk.
+#
+# Floating point arrays can be stored quantized as int16 or int8.
+# "quantized" then gives the original dtype and the names of the
+# arrays with the scale and offset of each trace, such that the
+# data is int*scale+offset. The smallest value of the integer type
+# marks NaN samples, like those above the surface after topography
+# correction.
+magic = b"GPRPYv2\n"
+alignment = 64
+
+# Compression codecs from the standard library
+codecs = {"zlib": (zlib.compress, zlib.decompress),
+          "bz2": (bz2.compress, bz2.decompress),
+          "lzma": (lzma.compress, lzma.decompress)}
+
+# Integer types for quantized storage and their largest value
+quantizeTypes = {"int16": 32767, "int8": 127}
+
+
+def isContainer(filename):
+    '''
+    Checks if a .gpr file uses the chunked container format
+    (as opposed to an older pickled .gpr file).
+
+    INPUT:
+    filename     .gpr file name
+
+    OUTPUT:
+    True if the file is a container
+    '''
+    with archiveFiles.openFile(filename,'rb') as f:
+        return f.read(len(magic)) == magic
+
+
+def align(pos):
+    '''
+    Helper function. Rounds pos up to the next multiple of alignment.
+    '''
+    return -(-pos//alignment)*alignment
+
+
+def jsonValue(obj):
+    '''
+    Helper function. Turns values in the metadata that JSON has no
+    type for into JSON values for the header. Numpy scalars become 
+    Python numbers. Arrays, bytes, and dates are stored as dicts 
+    with a "__type__", which headerValue turns back into them.
+    '''
+    if isinstance(obj,np.ndarray):
+        return {"__type__": "ndarray", "dtype": obj.dtype.str, "value": obj.tolist()}
+    if isinstance(obj,np.generic):
+        return obj.item()
+    if isinstance(obj,(bytes,bytearray)):
+        return {"__type__": "bytes", "value": base64.b64encode(obj).decode('ascii')}
+    if isinstance(obj,datetime.datetime):
+        return {"__type__": "datetime", "value": obj.isoformat()}
+    if isinstance(obj,datetime.date):
+        return {"__type__": "date", "value": obj.isoformat()}
+    raise TypeError("Can't store metadata of type %s in a .gpr file" %(type(obj).__name__))
+
+
+def headerValue(obj):
+    '''
+    Helper function. Turns the dicts written by jsonValue back into
+    arrays, bytes, and dates when reading the header.
+    '''
+    kind = obj.get("__type__")
+    if kind == "ndarray":
+        return np.array(obj["value"],dtype=obj["dtype"])
+    if kind == "bytes":
+        return base64.b64decode(obj["value"])
+    if kind == "datetime":
+        return datetime.datetime.fromisoformat(obj["value"])
+    if kind == "date":
+        return datetime.date.fromisoformat(obj["value"])
+    return obj
+
+
+def writeColumns(f,arr,chunk,convert=None):
+    '''
+    Helper function. Writes an array in Fortran order, chunk
+    traces (last-axis entries) at a time, such that memory-mapped
+    or lazily converted data is never fully held in memory.
+    convert(block,start) is applied to each block of traces
+    before writing.
+    '''
+    if arr.ndim < 2:
+        np.asarray(arr).tofile(f)
+        return
+    ntraces = arr.shape[-1]
+    for start in range(0,ntraces,chunk):
+        block = np.asarray(arr[...,start:start+chunk])
+        if convert is not None:
+            block = convert(block,start)
+        # The C-order bytes of the transpose are the
+        # Fortran-order bytes of the block
+        block.T.tofile(f)
+
+
+def compressColumns(spool,arr,chunk,codec,convert=None):
+    '''
+    Helper function. Compresses an array chunk traces at a time
+    and appends the compressed chunks to the spool file.
+    convert(block,start) is applied to each block of traces
+    before compressing.
+
+    OUTPUT:
+    list of [offset, size] of the compressed chunks in the spool file
+    '''
+    compress = codecs[codec][0]
+    chunks = []
+    for start in range(0,arr.shape[-1],chunk):
+        block = np.asarray(arr[...,start:start+chunk])
+        if convert is not None:
+            block = convert(block,start)
+        packed = compress(block.T.tobytes())
+        chunks.append([spool.tell(),len(packed)])
+        spool.write(packed)
+    return chunks
+
+
+def quantizeScale(arr,qtype,chunk):
+    '''
+    Helper function. Calculates the scale and offset of each trace
+    for quantized storage, such that the smallest and largest sample
+    of the trace map to -qmax and qmax of the integer type. NaN
+    samples are ignored.
+    '''
+    qmax = quantizeTypes[qtype]
+    shape = arr.shape[:-2]+(1,arr.shape[-1])
+    scale = np.empty(shape)
+    offset = np.empty(shape)
+    for start in range(0,arr.shape[-1],chunk):
+        block = np.asarray(arr[...,start:start+chunk])
+        # fmin and fmax skip NaN, and give NaN for all-NaN traces
+        lo = np.fmin.reduce(block,axis=-2,keepdims=True)
+        hi = np.fmax.reduce(block,axis=-2,keepdims=True)
+        offset[...,start:start+chunk] = (hi+lo)/2.0
+        scale[...,start:start+chunk] = (hi-lo)/(2.0*qmax)
+    # All-NaN traces
+    offset[np.isnan(offset)] = 0.0
+    scale[np.isnan(scale)] = 1.0
+    # Constant traces
+    scale[scale==0] = 1.0
+    return scale, offset
+
+
+def quantizeBlock(block,scale,offset,qtype):
+    '''
+    Helper function. Rounds a block of traces to the quantized
+    integer type. NaN samples get the smallest integer, -qmax-1.
+    '''
+    qmax = quantizeTypes[qtype]
+    q = np.clip(np.rint((block-offset)/scale),-qmax,qmax)
+    q[np.isnan(q)] = -qmax-1
+    return q.astype(qtype)
+
+
+def writeGPR(filename,meta,arrays,chunk=1024,compress=None,quantize=None):
+    '''
+    Writes a profile into a .gpr container file.
+
+    INPUT:
+    filename     .gpr file name
+    meta         dict of metadata (numbers, strings, lists, dicts)
+    arrays       dict of arrays to store; None values are allowed
+    chunk        number of traces to write or compress at a time
+                 [default: 1024]
+    compress     compress arrays with two or more dimensions using
+                 "zlib", "bz2", or "lzma" [default: None, meaning
+                 no compression]
+    quantize     dict of array names and the integer type ("int16" or
+                 "int8") to store them as, with a scale and offset
+                 for each trace. The error of each sample is at most
+                 (max-min)/(4*qmax), where max and min are the largest
+                 and smallest sample of its trace and qmax is 32767
+                 for int16 and 127 for int8. [default: None, meaning
+                 store all arrays as they are]
+    '''
+    if compress is not None and compress not in codecs:
+        raise ValueError("Unknown compression '%s'. Use %s" %(compress,", ".join(codecs)))
+    arrays = dict(arrays)
+    converters = {}
+    quantized = {}
+    for name, qtype in (quantize or {}).items():
+        if qtype not in quantizeTypes:
+            raise ValueError("Unknown quantization '%s'. Use %s" %(qtype,", ".join(quantizeTypes)))
+        arr = arrays[name]
+        if arr is None or np.prod(arr.shape) == 0:
+            continue
+        scale, offset = quantizeScale(arr,qtype,chunk)
+        arrays[name+"_scale"] = scale
+        arrays[name+"_offset"] = offset
+        quantized[name] = {"dtype": np.dtype(arr.dtype).str,
+                           "scale": name+"_scale", "offset": name+"_offset"}
+        converters[name] = (lambda block,start,scale=scale,offset=offset,qtype=qtype:
+                            quantizeBlock(block,scale[...,start:start+block.shape[-1]],
+                                          offset[...,start:start+block.shape[-1]],qtype))
+    layout = {}
+    pos = 0
+    packed = []
+    spool = tempfile.TemporaryFile()
+    for name, arr in arrays.items():
+        if arr is None:
+            layout[name] = None
+            continue
+        if name in quantized:
+            dtype = np.dtype(quantize[name])
+        else:
+            dtype = np.dtype(arr.dtype)
+        nbytes = int(np.prod(arr.shape))*dtype.itemsize
+        layout[name] = {"dtype": dtype.str, "shape": list(arr.shape),
+                        "offset": pos, "nbytes": nbytes}
+        if name in quantized:
+            layout[name]["quantized"] = quantized[name]
+        if compress is not None and arr.ndim >= 2:
+            # Compressed sizes are only known after compressing, so
+            # the chunks go into a spool file first
+            spoolstart = spool.tell()
+            chunks = compressColumns(spool,arr,chunk,compress,converters.get(name))
+            nbytes = spool.tell()-spoolstart
+            layout[name].update({"codec": compress, "chunk": chunk, "nbytes": nbytes,
+                                 "chunks": [[pos+o-spoolstart,n] for o,n in chunks]})
+            packed.append((pos,spoolstart,nbytes))
+        pos = align(pos+nbytes)
+    header = json.dumps({"version": 2, "meta": meta, "arrays": layout},
+                        default=jsonValue).encode('utf-8')
+    datastart = align(len(magic)+8+len(header))
+    # Write to a temporary file first, in case the data is
+    # memory-mapped from the file we are replacing
+    tmpfile = filename + ".tmp"
+    with open(tmpfile,'wb') as f:
+        f.write(magic)
+        f.write(np.array(len(header),dtype='<u8').tobytes())
+        f.write(header)
+        for name, arr in arrays.items():
+            if arr is None or "codec" in layout[name]:
+                continue
+            f.seek(datastart+layout[name]["offset"])
+            writeColumns(f,arr,chunk,converters.get(name))
+        # The compressed arrays follow each other in the spool file
+        for offset, spoolstart, nbytes in packed:
+            f.seek(datastart+offset)
+            spool.seek(spoolstart)
+            while nbytes > 0:
+                buf = spool.read(min(nbytes,2**24))
+                f.write(buf)
+                nbytes -= len(buf)
+        # Make sure the file is as long as the layout says
+        f.truncate(datastart+pos)
+    spool.close()
+    os.replace(tmpfile,filename)
+
+
+def readGPRHeader(filename):
+    '''
+    Reads only the header of a .gpr container file.
+
+    INPUT:
+    filename     .gpr file name
+
+    OUTPUT:
+    header       dict with "version", "meta" (the profile attributes),
+                 "arrays" (dtype, shape, and offset of each array),
+                 and "datastart" (file position of the first array)
+    '''
+    with archiveFiles.openFile(filename,'rb') as f:
+        if f.read(len(magic)) != magic:
+            raise ValueError("%s is not a GPRPy container file" %(filename))
+        headlen = int(np.frombuffer(f.read(8),dtype='<u8')[0])
+        header = json.loads(f.read(headlen).decode('utf-8'),object_hook=headerValue)
+    header["datastart"] = align(len(magic)+8+headlen)
+    return header
+
+
+class lazyTraces(NDArrayOperatorsMixin):
+    '''
+    Base class for read-only arrays in a .gpr container file that
+    are only read when used. Subclasses set shape and dtype and
+    provide readTraces(start,stop), which returns the traces start
+    to stop-1 (along the last axis) as numpy array. Indexing only
+    reads the traces that are needed.
+    '''
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def nbytes(self):
+        return self.size*self.dtype.itemsize
+
+    @property
+    def T(self):
+        return self.transpose()
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self,key):
+        keys = key if isinstance(key,tuple) else (key,)
+        if any(k is None for k in keys):
+            return np.asarray(self)[key]
+        # Find the index along the traces (last axis)
+        ell = [i for i,k in enumerate(keys) if k is Ellipsis]
+        if ell:
+            i = ell[0]
+            keys = keys[:i] + (slice(None),)*(self.ndim-len(keys)+1) + keys[i+1:]
+        else:
+            keys = keys + (slice(None),)*(self.ndim-len(keys))
+        ntraces = self.shape[-1]
+        last = keys[-1]
+        if isinstance(last,slice):
+            start, stop, step = last.indices(ntraces)
+            cols = range(start,stop,step)
+            if len(cols) == 0:
+                return np.empty(self.shape[:-1]+(0,),dtype=self.dtype)[keys[:-1]]
+            lo, hi = min(cols), max(cols)+1
+            # The same slice, relative to the traces that were read
+            stop = cols[-1]-lo+step
+            last = slice(cols[0]-lo,stop if stop >= 0 else None,step)
+        elif isinstance(last,(int,np.integer)):
+            if not -ntraces <= last < ntraces:
+                raise IndexError("index %d is out of bounds for axis %d with size %d"
+                                 %(last,self.ndim-1,ntraces))
+            lo = int(last) % ntraces
+            hi = lo+1
+            last = 0
+        else:
+            return np.asarray(self)[key]
+        return self.readTraces(lo,hi)[keys[:-1]+(last,)]
+
+    def __array__(self,dtype=None,copy=None):
+        if copy is False:
+            raise ValueError("%s data can't be turned into an array without a copy" %(type(self).__name__))
+        data = self.readTraces(0,self.shape[-1])
+        if dtype is not None:
+            data = data.astype(dtype,copy=False)
+        return data
+
+    def __array_ufunc__(self,ufunc,method,*inputs,**kwargs):
+        inputs = [np.asarray(x) if isinstance(x,lazyTraces) else x for x in inputs]
+        if 'out' in kwargs:
+            kwargs['out'] = tuple(np.asarray(x) if isinstance(x,lazyTraces) else x
+                                  for x in kwargs['out'])
+        return getattr(ufunc,method)(*inputs,**kwargs)
+
+    def __reduce__(self):
+        return (np.asarray,(np.asarray(self),))
+
+    def transpose(self):
+        return np.asarray(self).T
+
+    def astype(self,dtype,copy=True):
+        return np.asarray(self,dtype=dtype)
+
+    def copy(self):
+        return np.asarray(self)
+
+
+class compressedTraces(lazyTraces):
+    '''
+    Read-only array stored as compressed chunks of traces in a .gpr
+    container file. Nothing is decompressed until the data is used.
+    Indexing only decompresses the chunks containing the requested
+    traces, and turning the whole array into a numpy array
+    decompresses the chunks in parallel threads.
+
+    INPUT:
+    filename    .gpr file name
+    desc        description of the array in the file header
+    datastart   file position of the first array
+    dtype       data type of the decompressed data [default: None,
+                meaning the stored data type]
+    workers     number of threads decompressing chunks [default: None,
+                meaning the number of CPUs]
+    '''
+    def __init__(self,filename,desc,datastart,dtype=None,workers=None):
+        self.filename = filename
+        self.stored = np.dtype(desc["dtype"])
+        self.dtype = self.stored if dtype is None else np.dtype(dtype)
+        self.shape = tuple(desc["shape"])
+        self.chunk = desc["chunk"]
+        self.chunks = [(datastart+offset,nbytes) for offset,nbytes in desc["chunks"]]
+        self.decompress = codecs[desc["codec"]][1]
+        self.workers = workers if workers is not None else os.cpu_count()
+        # Where the file starts on disk, None for compressed archive members
+        self.location = archiveFiles.location(filename)
+
+    def __repr__(self):
+        return "compressedTraces(shape=%s, dtype=%s, %d chunks)" %(self.shape,self.dtype,len(self.chunks))
+
+    def readChunk(self,fd,i):
+        '''
+        Helper function. Reads and decompresses chunk i.
+        '''
+        offset, nbytes = self.chunks[i]
+        if fd is None:
+            packed = archiveFiles.readBytes(self.filename,offset,nbytes)
+        else:
+            packed = os.pread(fd,nbytes,self.location[1]+offset)
+        raw = self.decompress(packed)
+        ncols = min(self.chunk,self.shape[-1]-i*self.chunk)
+        return np.frombuffer(raw,dtype=self.stored).reshape(self.shape[:-1]+(ncols,),order='F')
+
+    def readTraces(self,start,stop):
+        '''
+        Helper function. Decompresses the traces start to stop-1,
+        reading only the chunks containing them.
+        '''
+        first = start//self.chunk
+        last = -(-stop//self.chunk)
+        data = np.empty(self.shape[:-1]+(stop-start,),dtype=self.dtype)
+        fd = os.open(self.location[0],os.O_RDONLY) if self.location is not None else None
+        try:
+            def fill(i):
+                block = self.readChunk(fd,i)
+                lo = max(start,i*self.chunk)
+                hi = min(stop,(i+1)*self.chunk)
+                data[...,lo-start:hi-start] = block[...,lo-i*self.chunk:hi-i*self.chunk]
+            # zlib, bz2 and lzma release the GIL while decompressing
+            if self.workers > 1 and last-first > 1:
+                with futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+                    list(executor.map(fill,range(first,last)))
+            else:
+                for i in range(first,last):
+                    fill(i)
+        finally:
+            if fd is not None:
+                os.close(fd)
+        return data
+
+
+class quantizedTraces(lazyTraces):
+    '''
+    Read-only array stored quantized as integers with a scale and
+    offset for each trace. The samples are only turned into floating
+    point numbers when they are used.
+
+    INPUT:
+    raw         np.memmap, array, or compressedTraces with the
+                integer samples
+    scale       scale of each trace
+    offset      offset of each trace
+    dtype       floating point type of the data
+    '''
+    def __init__(self,raw,scale,offset,dtype):
+        self.raw = raw
+        self.scale = scale
+        self.offset = offset
+        self.dtype = np.dtype(dtype)
+        self.shape = tuple(raw.shape)
+
+    def __repr__(self):
+        return "quantizedTraces(shape=%s, dtype=%s, stored as %s)" %(self.shape,self.dtype,self.raw.dtype)
+
+    def readTraces(self,start,stop):
+        '''
+        Helper function. Reads and dequantizes the traces start
+        to stop-1.
+        '''
+        raw = np.asarray(self.raw[...,start:stop])
+        data = raw.astype(self.dtype)
+        data *= self.scale[...,start:stop]
+        data += self.offset[...,start:stop]
+        # The smallest integer marks NaN samples
+        data[raw == np.iinfo(raw.dtype).min] = np.nan
+        return data
+
+
+def readArray(filename,desc,datastart,mmap=False):
+    '''
+    Helper function. Reads one array as it is stored in the file.
+    Compressed arrays are returned as compressedTraces.
+    '''
+    offset = datastart+desc["offset"]
+    shape = tuple(desc["shape"])
+    if np.prod(shape) == 0:
+        return np.empty(shape,dtype=desc["dtype"])
+    if "codec" in desc:
+        return compressedTraces(filename,desc,datastart)
+    if mmap:
+        return archiveFiles.memmap(filename,dtype=desc["dtype"],offset=offset,
+                                   shape=shape,order='F')
+    count = int(np.prod(shape))
+    arr = archiveFiles.fromfile(filename,dtype=desc["dtype"],count=count,offset=offset)
+    return np.reshape(arr,shape,order='F')
+
+
+def readGPR(filename,names=None,mmap=False,header=None):
+    '''
+    Reads arrays from a .gpr container file. Only the requested
+    arrays are read.
+
+    INPUT:
+    filename     .gpr file name
+    names        list of the names of the arrays to read
+                 [default: None, meaning all]
+    mmap         if True, return read-only np.memmap arrays instead
+                 of reading them into memory, compressedTraces
+                 for compressed arrays, and quantizedTraces for
+                 quantized arrays [default: False]
+    header       header as returned by readGPRHeader, if it has already
+                 been read [default: None]
+
+    OUTPUT:
+    meta         dict with the profile attributes
+    arrays       dict with the arrays (None for arrays that were
+                 stored as None)
+    '''
+    if header is None:
+        header = readGPRHeader(filename)
+    if names is None:
+        names = list(header["arrays"].keys())
+    arrays = {}
+    for name in names:
+        desc = header["arrays"][name]
+        if desc is None:
+            arrays[name] = None
+            continue
+        arr = readArray(filename,desc,header["datastart"],mmap)
+        if "quantized" in desc:
+            quant = desc["quantized"]
+            scale = readArray(filename,header["arrays"][quant["scale"]],header["datastart"])
+            offset = readArray(filename,header["arrays"][quant["offset"]],header["datastart"])
+            arr = quantizedTraces(arr,np.asarray(scale),np.asarray(offset),quant["dtype"])
+        if not mmap and isinstance(arr,lazyTraces):
+            arr = np.asarray(arr)
+        arrays[name] = arr
+    return header["meta"], arrays
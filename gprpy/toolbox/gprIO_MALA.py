@@ -1,9 +1,11 @@
 import struct
 import numpy as np
 import re # Regular expressions
+from gprpy.toolbox.mappedTraces import mappedTraces
+import gprpy.toolbox.archiveFiles as archiveFiles
 
 
-def readMALA(file_name):
+def readMALA(file_name,dtype=np.float64,mmap=False,keepint=False):
     '''
     Reads the MALA .rd3 data file and the .rad header. Can also be used
     to read .rd7 files but I'm not sure if they are really organized
@@ -11,6 +13,15 @@ def readMALA(file_name):
 
     INPUT: 
     file_name     data file name without the extension!
+    dtype         floating point type of the returned data
+                  [default: np.float64]
+    mmap          if True, the data is returned as a mappedTraces
+                  matrix that reads the samples from the file only
+                  when they are used [default: False]
+    keepint       if True, keep the samples in memory in their stored
+                  integer format and return them as a mappedTraces matrix
+                  that converts them to dtype only when used
+                  [default: False]
 
     OUTPUT:
     data          data matrix whose columns contain the traces
@@ -18,17 +29,25 @@ def readMALA(file_name):
     '''
     # First read header
     info = readGPRhdr(file_name+'.rad')
+    if mmap:
+        read = lambda filename: archiveFiles.memmap(filename, dtype=np.int16)
+    else:
+        read = lambda filename: archiveFiles.fromfile(filename, dtype=np.int16)
     try:
         filename = file_name + '.rd3'
-        data = np.fromfile(filename, dtype=np.int16)        
+        data = read(filename)
     except:
         # I'm not sure what the format of rd7 is. Just assuming it's the same
         filename = file_name + '.rd7'
-        data = np.fromfile(filename, dtype=np.int16)
+        data = read(filename)
     
     nrows=int(len(data)/int(info['SAMPLES']))
+
+    if mmap or keepint:
+        data = data[0:nrows*int(info['SAMPLES'])].reshape(nrows,int(info['SAMPLES']))
+        return mappedTraces(data.transpose(),0,dtype), info
     
-    data = (np.asmatrix(data.reshape(nrows,int(info['SAMPLES'])))).transpose()
+    data = (data.reshape(nrows,int(info['SAMPLES'])).astype(dtype)).transpose()
         
     return data, info
     
@@ -46,7 +65,7 @@ def readGPRhdr(filename):
     '''
     # Read in text file
     info = {}
-    with open(filename) as f:
+    with archiveFiles.openFile(filename,'r') as f:
         for line in f:
             strsp = line.split(':')
             info[strsp[0]] = strsp[1].rstrip()
@@ -0,0 +1,311 @@
+import numpy as np
+from gprpy.toolbox.mappedTraces import mappedTraces
+import gprpy.toolbox.archiveFiles as archiveFiles
+
+# SEG-Y rev 1 files start with a 3200 byte textual header and a
+# 400 byte binary header, possibly followed by extended textual
+# headers. Each trace is a 240 byte trace header followed by the
+# samples. Only files in which all traces have the same number of
+# samples are supported.
+#
+# As usual for GPR data, times are stored scaled by 1000: the
+# sample interval (nominally in microseconds) holds picoseconds
+# and the delay (nominally in milliseconds) holds nanoseconds.
+# Since whole picoseconds are often not exact, the sample interval
+# is also written to the SEG-Y rev 2 extended sample interval, a
+# double. The delay is multiplied with the time scalar "scalet",
+# and coordinates and elevations with "scalco" and "scalel", as
+# SEG-Y defines. SEG-Y has no scalar for the offset, so the
+# antenna separation is stored in millimeters, which the textual
+# header states with the line offsetUnit. Files without that line
+# are read with the offset in meters.
+textlen = 3200
+binlen = 400
+tracelen = 240
+
+# Binary header fields (byte offset within the binary header, type)
+binaryFields = {"jobid": (0,'i4'), "lino": (4,'i4'), "reno": (8,'i4'),
+                "ntrpr": (12,'i2'), "nart": (14,'i2'), "hdt": (16,'u2'),
+                "dto": (18,'u2'), "hns": (20,'u2'), "nso": (22,'u2'),
+                "format": (24,'i2'), "fold": (26,'i2'), "tsort": (28,'i2'),
+                "mfeet": (54,'i2'), "exthdt": (72,'f8'), "rev": (300,'u2'), "flen": (302,'i2'),
+                "next": (304,'i2')}
+
+# Trace header fields, named like in Seismic Unix
+traceFields = {"tracl": (0,'i4'), "tracr": (4,'i4'), "fldr": (8,'i4'),
+               "tracf": (12,'i4'), "ep": (16,'i4'), "cdp": (20,'i4'),
+               "cdpt": (24,'i4'), "trid": (28,'i2'), "offset": (36,'i4'),
+               "gelev": (40,'i4'), "selev": (44,'i4'), "scalel": (68,'i2'),
+               "scalco": (70,'i2'), "sx": (72,'i4'), "sy": (76,'i4'),
+               "gx": (80,'i4'), "gy": (84,'i4'), "counit": (88,'i2'),
+               "delrt": (108,'i2'), "ns": (114,'u2'), "dt": (116,'u2'),
+               "cdpx": (180,'i4'), "cdpy": (184,'i4'), "scalet": (214,'i2')}
+
+# Sample formats: format code and numpy type. Code 1 is IBM
+# floating point, which is read as unsigned int and converted.
+sampleFormats = {1: 'u4', 2: 'i4', 3: 'i2', 5: 'f4', 6: 'f8', 8: 'i1'}
+
+# Textual header line that marks offsets stored in millimeters
+offsetUnit = "COORDINATES IN METERS, OFFSET IN MILLIMETERS"
+
+
+def headerType(fields,itemsize,byteorder='>'):
+    '''
+    Helper function. Builds the structured numpy type of a binary
+    or trace header.
+    '''
+    names = list(fields.keys())
+    return np.dtype({"names": names,
+                     "formats": [byteorder + fields[name][1] for name in names],
+                     "offsets": [fields[name][0] for name in names],
+                     "itemsize": itemsize})
+
+
+def traceType(nsamples,fmt=5,byteorder='>'):
+    '''
+    Helper function. Structured numpy type of one trace record,
+    the trace header followed by the samples.
+    '''
+    return np.dtype([("header",headerType(traceFields,tracelen,byteorder)),
+                     ("samples",byteorder + sampleFormats[fmt],(nsamples,))])
+
+
+def ibm2ieee(ibm):
+    '''
+    Converts IBM System/360 floating point numbers, given as
+    unsigned 32 bit integers, to floating point numbers.
+    '''
+    ibm = np.asarray(ibm).astype(np.uint32)
+    sign = 1.0-2.0*(ibm >> 31)
+    exponent = ((ibm >> 24) & 0x7f).astype(np.int32)-64
+    mantissa = (ibm & 0x00ffffff)/float(2**24)
+    return sign*mantissa*np.power(16.0,exponent)
+
+
+def readSEGYHeader(filename):
+    '''
+    Reads the textual and binary header of a SEG-Y file.
+
+    INPUT:
+    filename      SEG-Y file name
+
+    OUTPUT:
+    info          dict with the binary header fields, the
+                  textual header ("textual"), the sample interval
+                  in ns ("dt"), the factor that turns trace header
+                  offsets into m ("offsetscale"), the number of 
+                  traces ("ntraces"), and the byte order 
+                  ("byteorder", '>' or '<')
+    offset        file position of the first trace
+    '''
+    with archiveFiles.openFile(filename,'rb') as f:
+        text = f.read(textlen)
+        binary = f.read(binlen)
+    # Standard files are big-endian, but some are not
+    byteorder = '>'
+    head = np.frombuffer(binary,dtype=headerType(binaryFields,binlen,'>'))[0]
+    if head["format"] not in sampleFormats:
+        byteorder = '<'
+        head = np.frombuffer(binary,dtype=headerType(binaryFields,binlen,'<'))[0]
+    if head["format"] not in sampleFormats:
+        raise ValueError("Unknown SEG-Y sample format %d in %s" %(head["format"],filename))
+    info = {name: head[name].item() for name in binaryFields}
+    # The extended sample interval only exists from revision 2 on
+    if info["rev"] >> 8 >= 2 and info["exthdt"] > 0:
+        info["dt"] = info["exthdt"]/1000.0
+    else:
+        info["dt"] = info["hdt"]/1000.0
+    # Textual headers are EBCDIC, starting with "C", or ASCII
+    if text[0:1] == b'\xc3':
+        info["textual"] = text.decode('cp037',errors='replace')
+    else:
+        info["textual"] = text.decode('ascii',errors='replace')
+    # Factor that turns the trace header offset into meters
+    info["offsetscale"] = 0.001 if offsetUnit in info["textual"] else 1.0
+    nextended = info["next"] if info["rev"] > 0 and info["next"] > 0 else 0
+    offset = textlen + binlen + nextended*textlen
+    reclen = traceType(info["hns"],info["format"],byteorder).itemsize
+    info["ntraces"] = int((archiveFiles.fileSize(filename)-offset)//reclen)
+    info["byteorder"] = byteorder
+    return info, offset
+
+
+def readSEGY(filename,dtype=np.float64,traceheaders=False,mmap=False,keepint=False):
+    '''
+    Reads a SEG-Y file in which all traces have the same number of
+    samples. The trace records are read all at once as a structured
+    array.
+
+    INPUT:
+    filename      SEG-Y file name
+    dtype         floating point type of the returned data
+                  [default: np.float64]
+    traceheaders  if True, also return the trace headers
+                  [default: False]
+    mmap          if True, the data is returned as a mappedTraces
+                  matrix that reads the samples from the file only
+                  when they are used. IBM floating point samples are
+                  always converted right away. [default: False]
+    keepint       if True, keep the samples in memory in their stored
+                  format and return them as a mappedTraces matrix
+                  that converts them to dtype only when used
+                  [default: False]
+
+    OUTPUT:
+    data          data matrix whose columns contain the traces
+    info          dict with information from the file header
+    head          (only if traceheaders is True) structured array
+                  with the trace header of each trace
+    '''
+    info, offset = readSEGYHeader(filename)
+    tracerec = traceType(info["hns"],info["format"],info["byteorder"])
+    if mmap:
+        traces = archiveFiles.memmap(filename,dtype=tracerec,offset=offset,
+                                     shape=(info["ntraces"],))
+    else:
+        traces = archiveFiles.fromfile(filename,dtype=tracerec,count=info["ntraces"],offset=offset)
+    if info["format"] == 1:
+        data = ibm2ieee(traces['samples'].T).astype(dtype)
+    elif mmap or keepint:
+        data = mappedTraces(traces['samples'].T,0,dtype)
+    else:
+        data = traces['samples'].T.astype(dtype)
+    if traceheaders:
+        return data, info, traces['header']
+    return data, info
+
+
+def segyScale(scalar):
+    '''
+    Helper function. Factor that SEG-Y coordinates or elevations
+    have to be multiplied with, given their scalar.
+    '''
+    scalar = np.asarray(scalar,dtype=np.float64)
+    # Negative scalars are divisors, zero means no scaling
+    return np.where(scalar < 0,-1.0/np.minimum(scalar,-1),np.where(scalar > 0,scalar,1.0))
+
+
+def segyScalar(maxabs,maxint):
+    '''
+    Helper function. Picks the SEG-Y scalar that keeps the most
+    decimals of values up to maxabs, such that the stored integers
+    stay below maxint.
+    '''
+    for scalar in [-10000,-1000,-100,-10,1,10,100,1000,10000]:
+        if np.round(maxabs/segyScale(scalar)) <= maxint:
+            return scalar
+    raise ValueError("Values up to %g are too large for SEG-Y" %(maxabs))
+
+
+def writeSEGY(filename,data,twtt,profilePos,threeD=None,antsep=0,textual=None,chunk=4096):
+    '''
+    Writes a profile as SEG-Y rev 2 file with big-endian IEEE
+    floating point samples. The trace records are assembled and
+    written chunk traces at a time.
+
+    If 3D coordinates are given, they are stored as receiver (group)
+    coordinates and elevation of each trace. Otherwise, the
+    along-profile positions are stored as receiver x coordinate.
+    Coordinates, elevations and the delay are stored with the scalar
+    that keeps the most decimals (up to 4). The antenna separation
+    is stored as offset in millimeters, as SEG-Y has no scalar for
+    the offset. A message is printed if the delay or the antenna 
+    separation can't be stored exactly.
+
+    The textual header line offsetUnit tells readSEGYHeader that
+    the offset is in millimeters. If a custom textual header 
+    doesn't contain it, it replaces the last line.
+
+    INPUT:
+    filename      SEG-Y file name
+    data          data matrix whose columns contain the traces
+    twtt          two-way travel times of the samples, in ns
+    profilePos    along-profile positions of the traces, in m
+    threeD        ntraces x 3 matrix of x, y, z coordinates of the
+                  traces [default: None]
+    antsep        antenna separation, in m [default: 0]
+    textual       text for the textual header [default: None, meaning
+                  a short description of the file]
+    chunk         number of traces to write at a time [default: 4096]
+    '''
+    nsamples, ntraces = data.shape
+    if len(twtt) > 1:
+        dt = (twtt[-1]-twtt[0])/(len(twtt)-1)
+    else:
+        dt = 0
+    # Scalars for the delay, coordinates, and elevations
+    delay = float(twtt[0]) if len(twtt) > 0 else 0.0
+    scalet = segyScalar(abs(delay),32767)
+    delrt = int(np.round(delay/segyScale(scalet)))
+    if abs(delrt*segyScale(scalet)-delay) > 1e-9:
+        print("SEG-Y delay %g ns is stored as %g ns" %(delay,delrt*segyScale(scalet)))
+    if threeD is None:
+        xyz = np.zeros((1,3))
+        xyz[0,0] = np.max(np.abs(profilePos)) if len(profilePos) > 0 else 0
+    else:
+        xyz = np.asarray(threeD)
+    scalco = segyScalar(np.max(np.abs(xyz[:,0:2]),initial=0),2**31-1)
+    scalel = segyScalar(np.max(np.abs(xyz[:,2]),initial=0),2**31-1)
+    offset = int(np.round(antsep*1000))
+    if abs(offset/1000.0-antsep) > 1e-9:
+        print("SEG-Y offset is in millimeters, antenna separation %g m is stored as %g m" %(antsep,offset/1000.0))
+    if textual is None:
+        textual = ["GPRPY SEG-Y EXPORT",
+                   "SAMPLE INTERVAL IN PICOSECONDS, DELAY IN NANOSECONDS",
+                   offsetUnit]
+        if threeD is None:
+            textual.append("GX IS THE ALONG-PROFILE POSITION")
+        else:
+            textual.append("GX, GY, GELEV ARE THE TRACE COORDINATES")
+    if not isinstance(textual,str):
+        textual = "".join(("C%2d %s" %(i+1,line))[0:80].ljust(80) for i,line in enumerate(textual))
+    if offsetUnit not in textual:
+        # The reader needs the offset unit, use the last line for it
+        textual = textual[0:textlen-80].ljust(textlen-80) + ("C40 " + offsetUnit).ljust(80)
+    text = textual.encode('ascii',errors='replace')[0:textlen].ljust(textlen)
+
+    binary = np.zeros(1,dtype=headerType(binaryFields,binlen))
+    binary["ntrpr"] = 1
+    # Sample intervals above 65535 ps only fit the extended one
+    binary["hdt"] = min(int(round(dt*1000)),65535)
+    binary["hns"] = nsamples
+    binary["format"] = 5
+    binary["mfeet"] = 1
+    binary["exthdt"] = dt*1000
+    binary["rev"] = 0x0200
+    binary["flen"] = 1
+
+    tracerec = traceType(nsamples)
+    with open(filename,'wb') as f:
+        f.write(text)
+        binary.tofile(f)
+        for start in range(0,ntraces,chunk):
+            stop = min(start+chunk,ntraces)
+            recs = np.zeros(stop-start,dtype=tracerec)
+            head = recs['header']
+            head['tracl'] = np.arange(start+1,stop+1)
+            head['tracr'] = head['tracl']
+            head['fldr'] = 1
+            head['tracf'] = head['tracl']
+            head['cdp'] = head['tracl']
+            head['trid'] = 1
+            head['offset'] = offset
+            head['scalel'] = scalel
+            head['scalco'] = scalco
+            head['counit'] = 1
+            head['delrt'] = delrt
+            head['scalet'] = scalet
+            head['ns'] = nsamples
+            head['dt'] = binary["hdt"][0]
+            if threeD is None:
+                head['gx'] = np.round(np.asarray(profilePos[start:stop])/segyScale(scalco))
+            else:
+                xyz = np.asarray(threeD[start:stop])
+                head['gx'] = np.round(xyz[:,0]/segyScale(scalco))
+                head['gy'] = np.round(xyz[:,1]/segyScale(scalco))
+                head['gelev'] = np.round(xyz[:,2]/segyScale(scalel))
+            head['sx'] = head['gx']
+            head['sy'] = head['gy']
+            head['selev'] = head['gelev']
+            recs['samples'] = np.asarray(data[:,start:stop]).T
+            recs.tofile(f)
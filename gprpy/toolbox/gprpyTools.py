@@ -1,50 +1,195 @@
 import numpy as np
 import scipy as sp
-import numpy.matlib as matlib
 import scipy.interpolate as interp
 import scipy.signal as signal
+import scipy.ndimage as ndimage
+import concurrent.futures as futures
 # For progress bar
 import time
 from tqdm import tqdm
 
 
-def alignTraces(data):
+def alignTraces(data,subsample=False):
     '''
     Aligns the traces in the profile such that their maximum 
     amplitudes align at the average two-way travel time of the 
     maximum amplitudes 
 
+    With subsample=True, the aligned traces are then shifted by 
+    fractions of a sample such that each trace best matches the 
+    average trace, using FFT cross-correlation of all traces at once.
+
     INPUT:
     data       data matrix whose columns contain the traces
+    subsample  also apply sub-sample alignment [default: False]
 
     OUTPUT:
     newdata    data matrix with aligned traces
     '''
-    
+    data = np.asarray(data,dtype=floatType(data))
     maxlen = data.shape[0]
-    newdata = np.asmatrix(np.zeros(data.shape))    
-    # Go through all traces to find maximum spike
-    maxind = np.zeros(data.shape[1], dtype=int)
-    for tr in range(0,data.shape[1]):
-        maxind[tr] = int(np.argmax(np.abs(data[:,tr])))
+    # Find the maximum spike of each trace
+    maxind = np.argmax(np.abs(data),axis=0)
     # Find the mean spike point
     meanind = int(np.round(np.mean(maxind)))
     # Shift all traces. If max index is smaller than
-    # mean index, then prepend zeros, otherwise append
-    for tr in range(0,data.shape[1]):
-        if meanind > maxind[tr]:
-            differ = int(meanind - maxind[tr])
-            newdata[:,tr] = np.vstack([np.zeros((differ,1)), data[0:(maxlen-differ),tr]])
-        elif meanind < maxind[tr]:
-            differ = maxind[tr] - meanind
-            newdata[:,tr] = np.vstack([data[differ:maxlen,tr], np.zeros((differ,1))])
-        else:
-            newdata[:,tr] = data[:,tr]
+    # mean index, then prepend zeros, otherwise append.
+    # Do this for all traces at once by gathering, for each
+    # new sample, the sample it comes from in the old trace
+    shift = meanind - maxind
+    rows = np.arange(0,maxlen).reshape((maxlen,1)) - shift
+    valid = (rows >= 0) & (rows < maxlen)
+    newdata = np.take_along_axis(data,np.clip(rows,0,maxlen-1),axis=0)
+    newdata[~valid] = 0
+    if subsample:
+        newdata = subsampleAlign(newdata).astype(data.dtype)
+    return newdata
+
+
+
+def subsampleAlign(data,maxlag=2):
+    '''
+    Helper function for alignTraces. Shifts each trace by a fraction
+    of a sample such that it best matches the average trace. The 
+    cross-correlations of all traces with the average trace are 
+    calculated in one batched FFT, the lag of the best match is 
+    refined by fitting a parabola through the correlation peak,
+    and the shifts are applied as phase shifts.
+
+    INPUT:
+    data       data matrix whose columns contain the traces,
+               already aligned to the nearest sample
+    maxlag     largest shift [in "number of samples"] to look for
+               [default: 2]
+
+    OUTPUT:
+    newdata    data matrix with sub-sample aligned traces
+    '''
+    data = np.asarray(data)
+    nsamp = data.shape[0]
+    # Zero pad to avoid wrap-around of the circular correlation
+    nfft = 2*nsamp
+    ref = np.mean(data,axis=1)
+    spec = np.fft.rfft(data,n=nfft,axis=0)
+    refspec = np.conj(np.fft.rfft(ref,n=nfft)).reshape((-1,1))
+    xcorr = np.fft.irfft(spec*refspec,n=nfft,axis=0)
+    # Only look at lags -maxlag-1 ... maxlag+1
+    # (negative lags sit at the end of xcorr)
+    lags = np.arange(-maxlag-1,maxlag+2)
+    xc = xcorr[lags % nfft,:]
+    # Best integer lag, not considering the outermost ones
+    # so there is always a neighbor on each side
+    best = np.argmax(xc[1:-1,:],axis=0) + 1
+    cols = np.arange(0,data.shape[1])
+    left = xc[best-1,cols]
+    center = xc[best,cols]
+    right = xc[best+1,cols]
+    # Vertex of the parabola through the three points
+    denom = left - 2*center + right
+    frac = np.zeros(data.shape[1])
+    curved = np.abs(denom) > 0
+    frac[curved] = 0.5*(left[curved]-right[curved])/denom[curved]
+    lag = lags[best] + np.clip(frac,-0.5,0.5)
+    # A trace delayed by lag needs to be moved up by lag
+    freqs = np.arange(0,spec.shape[0]).reshape((-1,1))
+    spec *= np.exp(2j*np.pi*freqs*lag/nfft)
+    newdata = np.fft.irfft(spec,n=nfft,axis=0)[0:nsamp,:]
     return newdata
 
 
 
-def dewow(data,window):
+def floatType(data):
+    '''
+    Helper function. Returns the floating point type processed data
+    should have: the type of data if it already is floating point
+    (for example float32 or float64), otherwise float64.
+
+    INPUT:
+    data       data matrix whose columns contain the traces
+
+    OUTPUT:
+    dtype      numpy floating point type
+    '''
+    dtype = np.asarray(data).dtype
+    if np.issubdtype(dtype,np.floating):
+        return dtype
+    else:
+        return np.dtype(np.float64)
+
+
+
+def windowBounds(n,halfwid):
+    '''
+    Helper function. Returns, for each of the n samples along an axis,
+    the start and end index (exclusive) of the moving average window
+    as used by dewow, smooth, remMeanTrace, profileSmooth, and agcGain:
+    The first halfwid samples share the window [0,halfwid+1), the last
+    halfwid samples share the window [n-halfwid,n), and every sample i
+    in between uses the centered window [i-halfwid,i+halfwid+1).
+
+    INPUT:
+    n          number of samples along the axis
+    halfwid    half width of the moving average window
+
+    OUTPUT:
+    lo         start indices of the windows
+    hi         end indices (exclusive) of the windows
+    '''
+    idx = np.arange(0,n)
+    lo = np.zeros(n,dtype=int)
+    hi = np.full(n,min(halfwid+1,n),dtype=int)
+    # Centered windows, cut off at the end of the axis
+    mid = idx >= halfwid
+    lo[mid] = idx[mid]-halfwid
+    hi[mid] = np.minimum(idx[mid]+halfwid+1,n)
+    # The last few samples all share the same window
+    last = idx >= n-halfwid
+    lo[last] = n-halfwid
+    hi[last] = n
+    return lo, hi
+
+
+
+def windowSum(data,halfwid,axis=0):
+    '''
+    Helper function. Calculates the moving window sums of data along
+    the given axis from one cumulative sum, so the cost does not 
+    depend on the window width. The windows are the ones returned
+    by windowBounds. The sums are accumulated in double precision.
+
+    INPUT:
+    data       data matrix whose columns contain the traces
+    halfwid    half width of the moving average window
+    axis       along which axis to sum: 0 (or -2) for along-time,
+               1 (or -1) for along-profile [default: 0]
+
+    OUTPUT:
+    winsum     array of the same shape as data containing the 
+               window sums
+    count      number of samples in each window, 
+               shaped to broadcast against winsum
+    '''
+    data = np.asarray(data)
+    axis = axis % data.ndim
+    n = data.shape[axis]
+    lo,hi = windowBounds(n,halfwid)
+    # Cumulative sum with a leading zero: csum[i] = sum(data[0:i])
+    shape = list(data.shape)
+    shape[axis] = n+1
+    csum = np.zeros(shape)
+    sl = [slice(None)]*data.ndim
+    sl[axis] = slice(1,None)
+    np.cumsum(data,axis=axis,dtype=np.float64,out=csum[tuple(sl)])
+    winsum = np.take(csum,hi,axis=axis)
+    winsum -= np.take(csum,lo,axis=axis)
+    cshape = [1]*data.ndim
+    cshape[axis] = n
+    count = np.reshape(hi-lo,cshape)
+    return winsum, count
+
+
+
+def dewow(data,window,method='auto'):
     '''
     Subtracts from each sample along each trace an 
     along-time moving average.
@@ -52,19 +197,33 @@ def dewow(data,window):
     Can be used as a low-cut filter.
 
     INPUT:
-    data       data matrix whose columns contain the traces 
+    data       data matrix whose columns contain the traces,
+               or channels x samples x traces array
     window     length of moving average window 
                [in "number of samples"]
+    method     "cumsum" calculates all window averages from one
+               running sum, independent of the window length,
+               "loop" goes through the samples one by one 
+               (slow, kept for validation), "auto" picks "cumsum"
+               [default: "auto"]
 
     OUTPUT:
     newdata    data matrix after dewow
     '''
-    totsamps = data.shape[0]
+    data = np.asarray(data)
+    dtype = floatType(data)
+    totsamps = data.shape[-2]
     # If the window is larger or equal to the number of samples,
     # then we can do a much faster dewow
     if (window >= totsamps):
-        newdata = data-np.matrix.mean(data,0)            
-    else:
+        newdata = (data-np.mean(data,-2,dtype=np.float64,keepdims=True)).astype(dtype)
+    elif method == 'auto' or method == 'cumsum':
+        halfwid = int(np.ceil(window/2.0))
+        winsum, count = windowSum(data,halfwid,axis=-2)
+        winsum /= count
+        newdata = np.subtract(data,winsum,dtype=dtype)
+    elif method == 'loop':
+        data = np.asmatrix(data)
         newdata = np.asmatrix(np.zeros(data.shape))
         halfwid = int(np.ceil(window/2.0))
         
@@ -82,13 +241,16 @@ def dewow(data,window):
         # For the last few samples, it will always be the same
         avgsmp = np.matrix.mean(data[totsamps-halfwid:totsamps+1,:],0)
         newdata[totsamps-halfwid:totsamps+1,:] = data[totsamps-halfwid:totsamps+1,:]-avgsmp
+        newdata = np.asarray(newdata,dtype=dtype)
+    else:
+        raise ValueError("Unknown dewow method '%s'. Use 'auto', 'cumsum', or 'loop'" %(method))
         
     print('done with dewow')
     return newdata
 
 
 
-def smooth(data,window):
+def smooth(data,window,method='auto'):
     '''
     Replaces each sample along each trace with an 
     along-time moving average.
@@ -96,23 +258,36 @@ def smooth(data,window):
     Can be used as high-cut filter.
 
     INPUT:
-    data      data matrix whose columns contain the traces 
+    data      data matrix whose columns contain the traces,
+              or channels x samples x traces array
     window    length of moving average window
               [in "number of samples"]
+    method    "cumsum" calculates all window averages from one
+              running sum, independent of the window length,
+              "loop" goes through the samples one by one 
+              (slow, kept for validation), "auto" picks "cumsum"
+              [default: "auto"]
 
     OUTPUT:
     newdata   data matrix after applying smoothing
     '''
-    totsamps = data.shape[0]
+    data = np.asarray(data)
+    dtype = floatType(data)
+    totsamps = data.shape[-2]
     # If the window is larger or equal to the number of samples,
     # then we can do a much faster dewow
     if (window >= totsamps):
-        newdata = np.matrix.mean(data,0)
+        newdata = np.mean(data,-2,dtype=np.float64,keepdims=True).astype(dtype)
     elif window == 1:
-        newdata = data
+        newdata = np.asarray(data,dtype=dtype)
     elif window == 0:
-        newdata = data
-    else:
+        newdata = np.asarray(data,dtype=dtype)
+    elif method == 'auto' or method == 'cumsum':
+        halfwid = int(np.ceil(window/2.0))
+        winsum, count = windowSum(data,halfwid,axis=-2)
+        newdata = np.divide(winsum,count,dtype=dtype)
+    elif method == 'loop':
+        data = np.asmatrix(data)
         newdata = np.asmatrix(np.zeros(data.shape))
         halfwid = int(np.ceil(window/2.0))
         
@@ -127,13 +302,16 @@ def smooth(data,window):
 
         # For the last few samples, it will always be the same
         newdata[totsamps-halfwid:totsamps+1,:] = np.matrix.mean(data[totsamps-halfwid:totsamps+1,:],0)
+        newdata = np.asarray(newdata,dtype=dtype)
+    else:
+        raise ValueError("Unknown smooth method '%s'. Use 'auto', 'cumsum', or 'loop'" %(method))
         
     print('done with smoothing')
     return newdata
 
 
 
-def remMeanTrace(data,ntraces):
+def remMeanTrace(data,ntraces,method='auto'):
     '''
     Subtracts from each trace the average trace over
     a moving average window.
@@ -142,20 +320,33 @@ def remMeanTrace(data,ntraces):
     such as the airwave.
 
     INPUT:
-    data       data matrix whose columns contain the traces 
+    data       data matrix whose columns contain the traces,
+               or channels x samples x traces array
     ntraces    window width; over how many traces 
                to take the moving average.
+    method     "cumsum" calculates all average traces from one
+               running sum along the profile, independent of the 
+               window width, "loop" goes through the traces one 
+               by one (slow, kept for validation), "auto" picks 
+               "cumsum" [default: "auto"]
 
     OUTPUT:
     newdata    data matrix after subtracting average traces
     '''
 
-    data=np.asmatrix(data)
-    tottraces = data.shape[1]
+    data = np.asarray(data)
+    dtype = floatType(data)
+    tottraces = data.shape[-1]
     # For ridiculous ntraces values, just remove the entire average
     if ntraces >= tottraces:
-        newdata=data-np.matrix.mean(data,1) 
-    else: 
+        newdata = (data-np.mean(data,-1,dtype=np.float64,keepdims=True)).astype(dtype)
+    elif method == 'auto' or method == 'cumsum':
+        halfwid = int(np.ceil(ntraces/2.0))
+        winsum, count = windowSum(data,halfwid,axis=-1)
+        winsum /= count
+        newdata = np.subtract(data,winsum,dtype=dtype)
+    elif method == 'loop':
+        data = np.asmatrix(data)
         newdata = np.asmatrix(np.zeros(data.shape))    
         halfwid = int(np.ceil(ntraces/2.0))
         
@@ -173,6 +364,9 @@ def remMeanTrace(data,ntraces):
         # Last few traces again have the same average    
         avgtr=np.matrix.mean(data[:,tottraces-halfwid:tottraces+1],1)
         newdata[:,tottraces-halfwid:tottraces+1] = data[:,tottraces-halfwid:tottraces+1]-avgtr
+        newdata = np.asarray(newdata,dtype=dtype)
+    else:
+        raise ValueError("Unknown remMeanTrace method '%s'. Use 'auto', 'cumsum', or 'loop'" %(method))
 
     print('done with removing mean trace')
     return newdata
@@ -204,30 +398,41 @@ def profileSmooth(data,profilePos,ntraces=1,noversample=1):
     newProfilePos = np.linspace(profilePos[0],
                                 profilePos[-1],
                                 noversample*len(profilePos))
-    # First oversample the data
-    data = np.asmatrix(np.repeat(data,noversample,1))
-    tottraces = data.shape[1]
+    dtype = floatType(data)
+    data = np.asarray(data)
+    nsamp = data.shape[0]
+    norig = data.shape[1]
+    tottraces = noversample*norig
     if ntraces == 1:
-        newdata = data
+        newdata = np.repeat(data,noversample,1).astype(dtype,copy=False)
     elif ntraces == 0:
-        newdata = data
+        newdata = np.repeat(data,noversample,1).astype(dtype,copy=False)
     elif ntraces >= tottraces:
-        newdata=np.matrix.mean(data,1) 
+        # Every trace is copied the same number of times, so
+        # the average over the oversampled data is the plain average
+        newdata = np.mean(data,1,dtype=np.float64,keepdims=True).astype(dtype)
     else:
-        newdata = np.asmatrix(np.zeros(data.shape))    
+        # Instead of creating the oversampled data, we calculate the
+        # moving window sums directly from the original traces: 
+        # The sum over the first m oversampled traces is 
+        # noversample*(sum over the first m//noversample traces)
+        # + (m%noversample)*(trace m//noversample).
         halfwid = int(np.ceil(ntraces/2.0))
-        
-        # First few traces, that all have the same average
-        newdata[:,0:halfwid+1] = np.matrix.mean(data[:,0:halfwid+1],1)
-        
-        # For each trace in the middle
-        for tr in tqdm(range(halfwid,tottraces-halfwid+1)):   
-            winstart = int(tr - halfwid)
-            winend = int(tr + halfwid)
-            newdata[:,tr] = np.matrix.mean(data[:,winstart:winend+1],1) 
-
-        # Last few traces again have the same average    
-        newdata[:,tottraces-halfwid:tottraces+1] = np.matrix.mean(data[:,tottraces-halfwid:tottraces+1],1)
+        lo,hi = windowBounds(tottraces,halfwid)
+        csum = np.zeros((nsamp,norig+1))
+        np.cumsum(data,axis=1,out=csum[:,1:])
+        newdata = np.zeros((nsamp,tottraces),dtype=dtype)
+        # Go through the output in blocks of traces to keep 
+        # temporary arrays small
+        blocklen = 4096
+        for blockstart in range(0,tottraces,blocklen):
+            blk = slice(blockstart,min(blockstart+blocklen,tottraces))
+            hq, hr = np.divmod(hi[blk],noversample)
+            lq, lr = np.divmod(lo[blk],noversample)
+            winsum = (noversample*(csum[:,hq] - csum[:,lq])
+                      + hr*data[:,np.minimum(hq,norig-1)]
+                      - lr*data[:,np.minimum(lq,norig-1)])
+            newdata[:,blk] = winsum/(hi[blk]-lo[blk])
 
     print('done with profile smoothing')
     return newdata, newProfilePos
@@ -239,58 +444,79 @@ def tpowGain(data,twtt,power):
     Apply a t-power gain to each trace with the given exponent.
 
     INPUT:
-    data      data matrix whose columns contain the traces
+    data      data matrix whose columns contain the traces,
+              or channels x samples x traces array
     twtt      two-way travel time values for the rows in data
     power     exponent
 
     OUTPUT:
     newdata   data matrix after t-power gain
     '''
-    factor = np.reshape(twtt**(float(power)),(len(twtt),1))
-    factmat = matlib.repmat(factor,1,data.shape[1])  
-    return np.multiply(data,factmat)
+    data = np.asarray(data)
+    dtype = floatType(data)
+    factor = np.reshape(twtt**(float(power)),(len(twtt),1)).astype(dtype)
+    # Broadcasting multiplies each column of data by factor
+    return np.multiply(data,factor,dtype=dtype)
 
 
 
-def agcGain(data,window):
+def agcGain(data,window,norm='energy'):
     '''
     Apply automated gain controll (AGC) by normalizing the energy
     of the signal over a given window width in each trace
 
+    The window measures for all samples are calculated at once from
+    running sums along each trace.
+
     INPUT:
-    data       data matrix whose columns contain the traces
+    data       data matrix whose columns contain the traces,
+               or channels x samples x traces array
     window     window width [in "number of samples"]
+    norm       how to measure the signal strength in the window:
+               "energy" for the energy (2-norm), "rms" for the 
+               root-mean-square amplitude, "meanabs" for the mean 
+               absolute amplitude, or "peak" for the maximum 
+               absolute amplitude [default: "energy"]
     
     OUTPUT:
     newdata    data matrix after AGC gain
     '''
     
     eps=1e-8
-    totsamps = data.shape[0]
-    # If window is a ridiculous value
+    data = np.asarray(data)
+    totsamps = data.shape[-2]
+    if norm not in ['energy','rms','meanabs','peak']:
+        raise ValueError("Unknown AGC norm '%s'. Use 'energy', 'rms', 'meanabs', or 'peak'" %(norm))
+    absdata = np.abs(data)
+    # If window is a ridiculous value, use the entire trace
     if (window>totsamps):
-        # np.maximum is exactly the right thing (not np.amax or np.max)
-        energy = np.maximum(np.linalg.norm(data,axis=0),eps)
-        # np.divide automatically divides each row of "data"
-        # by the elements in "energy"
-        newdata = np.divide(data,energy)
+        halfwid = totsamps
     else:
-        # Need to go through the samples
-        newdata = np.asmatrix(np.zeros(data.shape))
         halfwid = int(np.ceil(window/2.0))
-        # For the first few samples, it will always be the same
-        energy = np.maximum(np.linalg.norm(data[0:halfwid+1,:],axis=0),eps)
-        newdata[0:halfwid+1,:] = np.divide(data[0:halfwid+1,:],energy)
-        
-        for smp in tqdm(range(halfwid,totsamps-halfwid+1)):
-            winstart = int(smp - halfwid)
-            winend = int(smp + halfwid)
-            energy = np.maximum(np.linalg.norm(data[winstart:winend+1,:],axis=0),eps)
-            newdata[smp,:] = np.divide(data[smp,:],energy)
 
-        # For the first few samples, it will always be the same
-        energy = np.maximum(np.linalg.norm(data[totsamps-halfwid:totsamps+1,:],axis=0),eps)
-        newdata[totsamps-halfwid:totsamps+1,:] = np.divide(data[totsamps-halfwid:totsamps+1,:],energy)          
+    if norm == 'peak':
+        if halfwid >= totsamps:
+            amp = np.max(absdata,axis=-2,keepdims=True)
+        else:
+            amp = ndimage.maximum_filter1d(absdata,size=2*halfwid+1,
+                                           axis=-2,mode='nearest')
+            # The first and last few samples share the same window
+            amp[...,0:halfwid,:] = np.max(absdata[...,0:halfwid+1,:],axis=-2,keepdims=True)
+            amp[...,totsamps-halfwid:totsamps,:] = np.max(absdata[...,totsamps-halfwid:totsamps,:],axis=-2,keepdims=True)
+    elif norm == 'meanabs':
+        winsum, count = windowSum(absdata,halfwid,axis=-2)
+        amp = winsum/count
+    else:
+        winsum, count = windowSum(np.square(absdata),halfwid,axis=-2)
+        # Rounding in the running sum can lead to tiny negative values
+        winsum = np.maximum(winsum,0)
+        if norm == 'rms':
+            amp = np.sqrt(winsum/count)
+        else:
+            amp = np.sqrt(winsum)
+
+    # np.maximum is exactly the right thing (not np.amax or np.max)
+    newdata = np.divide(data,np.maximum(amp,eps),dtype=floatType(data))
     return newdata
         
 
@@ -392,7 +618,7 @@ def correctTopo(data, velocity, profilePos, topoPos, topoVal, twtt):
         # Need to shift by the greatest amount, where  we are the lowest
         tshift = np.max(tshift) - tshift
         # Make new datamatrix
-        newdata = np.empty((data.shape[0]+maxup,data.shape[1]))
+        newdata = np.empty((data.shape[0]+maxup,data.shape[1]),dtype=floatType(data))
         newdata[:] = np.nan
         # Set new twtt
         newtwtt = np.arange(0, twtt[-1] + maxup*timeStep, timeStep)
@@ -486,13 +712,146 @@ def prepVTK(profilePos,gpsmat=None,smooth=True,win_length=51,porder=3):
     return x,y,z
 
 
-def linStackedAmplitude(data,profilePos,twtt,vVals,tVals,typefact):
+def stackChunk(ntvals,ntraces,maxelem=2**22):
+    '''
+    Helper function for the stacked amplitude calculations.
+    Returns how many velocities can be treated at once such that 
+    the temporary arrays have at most maxelem elements.
+
+    INPUT:
+    ntvals        number of two-way travel time zero-offsets
+    ntraces       number of traces
+    maxelem       maximum number of elements of the temporary arrays
+                  [default: 2**22]
+
+    OUTPUT:
+    vchunk        number of velocities per chunk
+    '''
+    return max(1,int(maxelem/max(1,ntvals*ntraces)))
+
+
+
+def stackAlong(data,t,twtt):
+    '''
+    Helper function for the stacked amplitude calculations.
+    Averages the data along many curves at once. Each curve gives 
+    one two-way travel time per trace. A curve is only followed
+    until it first leaves the recorded time window.
+
+    INPUT:
+    data          data matrix whose columns contain the traces
+    t             array whose last axis has one entry per trace,
+                  containing the two-way travel times of the curves
+    twtt          two-way travel time values for the samples, in ns
+
+    OUTPUT:
+    stamp         absolute values of the averages along the curves,
+                  with the shape of t without its last axis
+    '''
+    nsamp = len(twtt)
+    ntraces = data.shape[1]
+    # Sample index of each point on the curves, calculated in place
+    tindices = t - twtt[0]
+    tindices /= (twtt[3]-twtt[2])
+    np.rint(tindices,out=tindices)
+    np.minimum(tindices,nsamp,out=tindices)
+    tindices = tindices.astype(int)
+    # Negative indices count from the end, as in plain indexing
+    np.add(tindices,nsamp,out=tindices,where=tindices<0)
+    # The curves don't turn around, so once a curve has left the
+    # time window it doesn't come back
+    valid = np.logical_and.accumulate(tindices < nsamp,axis=-1)
+    # Points outside of the time window pick from an extra row of zeros
+    tindices[~valid] = nsamp
+    tindices *= ntraces
+    tindices += np.arange(0,ntraces)
+    padded = np.vstack((data,np.zeros((1,ntraces),dtype=data.dtype)))
+    pixels = np.take(padded.ravel(),tindices)
+    # Curves that start outside the time window have no pixels
+    # and result in NaN
+    with np.errstate(divide='ignore',invalid='ignore'):
+        stamp = np.abs(np.sum(pixels,axis=-1,dtype=np.float64)/np.sum(valid,axis=-1))
+    return stamp
+
+
+
+def shiftStack(data,twtt,tVals,kt,b):
+    '''
+    Helper function for the linear stacked amplitude calculation.
+    Averages the data along straight lines, for zero-offsets on the
+    sample grid and moveouts that don't decrease from trace to trace.
+    Each line is then the zero-offset sample index plus a fixed 
+    sample shift per trace, so the traces are summed as shifted 
+    windows instead of picking each pixel. Only lines whose moveout
+    is within 1e-6 samples of a rounding tie are picked pixel by 
+    pixel, such that the result is the same as from stackAlong.
+
+    INPUT:
+    data          data matrix whose columns contain the traces
+    twtt          two-way travel time values for the samples, in ns
+    tVals         two-way travel time zero-offsets, in ns
+    kt            sample indices of tVals (non-negative integers)
+    b             moveout of each trace relative to the zero-offset,
+                  one row per velocity, in ns
+
+    OUTPUT:
+    stamp         absolute values of the averages along the lines,
+                  one row per velocity and one column per zero-offset
+    '''
+    nsamp,ntraces = data.shape
+    nv = b.shape[0]
+    q = b/(twtt[3]-twtt[2])
+    shift = np.minimum(np.rint(q),nsamp).astype(int)
+    # Lines at a rounding tie are picked pixel by pixel below.
+    # Here they are shifted past the data and add nothing
+    tie = np.abs(q - np.floor(q) - 0.5) < 1e-6
+    shift[tie] = nsamp
+    # Each trace followed by zeros, so that shifted windows past the
+    # end of the time window add nothing
+    padded = np.zeros((ntraces,2*nsamp+1))
+    padded[:,0:nsamp] = data.T
+    windows = np.lib.stride_tricks.sliding_window_view(padded,nsamp+1,axis=1)
+    total = np.zeros((nv,nsamp+1))
+    for j in range(0,ntraces):
+        total += windows[j,shift[:,j]]
+    # Number of traces with shift at most m, for each velocity
+    count = np.bincount((np.arange(0,nv)[:,None]*(nsamp+1) + shift).ravel(),
+                        minlength=nv*(nsamp+1)).reshape((nv,nsamp+1))
+    count = np.cumsum(count,axis=1)
+    # A line starting at sample k stays in the time window for
+    # the traces whose shift is below nsamp-k
+    count = np.hstack((count[:,nsamp-1::-1],np.zeros((nv,1),dtype=count.dtype)))
+    cols = np.minimum(kt,nsamp)
+    total = total[:,cols]
+    count = count[:,cols]
+    # Lines at a rounding tie, with the sample indices of stackAlong
+    vi,ji = np.nonzero(tie)
+    if len(vi) > 0:
+        tindices = tVals.reshape((1,-1)) + b[vi,ji].reshape((-1,1))
+        tindices -= twtt[0]
+        tindices /= (twtt[3]-twtt[2])
+        np.rint(tindices,out=tindices)
+        tindices = np.minimum(tindices,nsamp).astype(int)
+        np.add.at(total,vi,padded[ji.reshape((-1,1)),tindices])
+        np.add.at(count,vi,tindices < nsamp)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        stamp = np.abs(total/count)
+    return stamp
+
+
+
+def linStackedAmplitude(data,profilePos,twtt,vVals,tVals,typefact,vchunk=None):
     '''
     Calculates the linear stacked amplitudes for each two-way 
     travel time sample and the provided velocity range 
     by summing the pixels of the data that follow a line given 
     by the two-way travel time zero offset and the velocity.
 
+    All zero-offsets are treated at once, for chunks of velocities.
+    If the zero-offsets are on the sample grid and the antenna 
+    separations increase along the profile, the traces are summed
+    as shifted windows, which is much faster than picking each pixel.
+
     INPUT:
     data          data matrix whose columns contain the traces
     profilePos    along-profile coordinates of the traces
@@ -503,31 +862,51 @@ def linStackedAmplitude(data,profilePos,twtt,vVals,tVals,typefact):
                   the linear stacked amplitudes, in ns
     typefact      factor for antenna separation depending if this is
                   for CMP (typefact=2) or WARR (typefact=1) data
+    vchunk        how many velocities to treat at once. Limits the 
+                  memory use [default: None, meaning chosen such that
+                  temporary arrays have at most 2**22 elements]
 
     OUTPUT:
     linStAmp      matrix containing the linear stacked amplitudes
                   for the given data, tVals, and vVals
     '''
-    linStAmp=np.zeros((len(tVals),len(vVals)))
-    for vi in tqdm(range(0,len(vVals))):       
-        for ti in range(0,len(tVals)):
-            t = tVals[ti] + typefact*profilePos/vVals[vi]
-            tindices = (np.round((t-twtt[0])/(twtt[3]-twtt[2]))).astype(int)
-            # The tindices will be sorted, can use searchsorted because
-            # the wave doesn't turn around
-            maxi = np.searchsorted(tindices,len(twtt))
-            pixels = data[(tindices[0:maxi],np.arange(0,maxi))]
-            linStAmp[ti,vi]=np.abs(np.sum(pixels)/pixels.shape[1])
+    data = np.asarray(data)
+    profilePos = np.asarray(profilePos).reshape((1,1,-1))
+    tVals = np.asarray(tVals).reshape((-1,1,1))
+    vVals = np.asarray(vVals)
+    linStAmp=np.zeros((tVals.shape[0],len(vVals)))
+    if vchunk is None:
+        vchunk = stackChunk(tVals.shape[0],data.shape[1])
+    # Sample indices of the zero-offsets, if they are on the grid
+    kt = (tVals.ravel()-twtt[0])/(twtt[3]-twtt[2])
+    ongrid = np.all(np.abs(kt-np.rint(kt)) < 1e-9) and np.all(kt > -0.5)
+    kt = np.rint(kt).astype(int) if ongrid else None
+    for vstart in tqdm(range(0,len(vVals),vchunk)):
+        vend = min(vstart+vchunk,len(vVals))
+        v = vVals[vstart:vend].reshape((1,-1,1))
+        b = typefact*profilePos/v
+        if ongrid and np.all(np.isfinite(b)) and np.all(b >= 0) and np.all(np.diff(b,axis=-1) >= 0):
+            linStAmp[:,vstart:vend] = shiftStack(data,twtt,tVals.ravel(),kt,b[0]).T
+        else:
+            linStAmp[:,vstart:vend] = stackAlong(data,tVals + b,twtt)
     return linStAmp
 
 
-def hypStackedAmplitude(data,profilePos,twtt,vVals,tVals,typefact):
+def hypStackedAmplitude(data,profilePos,twtt,vVals,tVals,typefact,vchunk=None,workers=1,pool='process'):
     '''
     Calculates the hyperbolic stacked amplitudes for each two-way 
     travel time sample and the provided velocity range 
     by summing the pixels of the data that follow a hyperbola given 
     by the two-way travel time apex and the velocity.
 
+    The moveout times for all apex times are calculated at once for
+    chunks of velocities. The chunks can be spread over several 
+    processes or threads. Each chunk in progress needs temporary 
+    memory limited by vchunk. Most of the work per chunk is numpy
+    fancy indexing, which holds the GIL, so threads barely run in
+    parallel; processes do, but each one first receives a copy of
+    the data.
+
     INPUT:
     data          data matrix whose columns contain the traces
     profilePos    along-profile coordinates of the traces
@@ -538,118 +917,205 @@ def hypStackedAmplitude(data,profilePos,twtt,vVals,tVals,typefact):
                   the hyperbolic stacked amplitudes, in ns
     typefact      factor for antenna separation depending if this is
                   for CMP (typefact=2) or WARR (typefact=1) data
+    vchunk        how many velocities to treat at once. Limits the 
+                  memory use [default: None, meaning chosen such that
+                  temporary arrays have at most 2**22 elements]
+    workers       how many velocity chunks to calculate in parallel
+                  [default: 1, None means one per CPU]
+    pool          "process" or "thread": run the chunks in a process
+                  pool or a thread pool [default: "process"]
 
     OUTPUT:
     hypStAmp      matrix containing the hyperbolic stacked amplitudes
                   for the given data, tVals, and vVals
     '''
-    hypStAmp=np.zeros((len(tVals),len(vVals)))
-    x2 = np.power(typefact*profilePos,2.0)
-    for vi in tqdm(range(0,len(vVals))):       
-        for ti in range(0,len(tVals)):
-            t = np.sqrt(x2 + 4*np.power(tVals[ti]/2.0 * vVals[vi],2.0))/vVals[vi]
-            tindices = (np.round((t-twtt[0])/(twtt[3]-twtt[2]))).astype(int)
-            # The tindices will be sorted, can use searchsorted because
-            # the wave doesn't turn around
-            maxi = np.searchsorted(tindices,len(twtt))
-            pixels = data[(tindices[0:maxi],np.arange(0,maxi))]
-            hypStAmp[ti,vi]=np.abs(np.sum(pixels)/pixels.shape[1])
+    data = np.asarray(data)
+    x2 = np.power(typefact*np.asarray(profilePos),2.0).reshape((1,1,-1))
+    tVals = np.asarray(tVals).reshape((-1,1,1))
+    vVals = np.asarray(vVals)
+    if vchunk is None:
+        vchunk = stackChunk(tVals.shape[0],data.shape[1])
+    vchunks = [vVals[vstart:vstart+vchunk] for vstart in range(0,len(vVals),vchunk)]
+    if workers == 1:
+        results = [hypStackChunk(data,x2,twtt,tVals,v) for v in tqdm(vchunks)]
+    else:
+        if pool == 'process':
+            # The data is sent to each process once, not with every chunk
+            executor = futures.ProcessPoolExecutor(max_workers=workers,initializer=hypStackInit,
+                                                   initargs=(data,x2,twtt,tVals))
+            chunkfun = hypStackWorker
+        elif pool == 'thread':
+            executor = futures.ThreadPoolExecutor(max_workers=workers)
+            chunkfun = lambda v: hypStackChunk(data,x2,twtt,tVals,v)
+        else:
+            raise ValueError("Unknown pool '%s'. Use 'process' or 'thread'" %(pool))
+        with executor:
+            results = list(tqdm(executor.map(chunkfun,vchunks),total=len(vchunks)))
+    hypStAmp=np.zeros((tVals.shape[0],len(vVals)))
+    if results:
+        hypStAmp[:,:] = np.concatenate(results,axis=1)
     return hypStAmp
 
 
 
+def hypStackChunk(data,x2,twtt,tVals,v):
+    '''
+    Helper function for hypStackedAmplitude. Calculates the hyperbolic 
+    stacked amplitudes for one chunk of velocities.
 
+    INPUT:
+    data          data matrix whose columns contain the traces
+    x2            squared (typefact times) along-profile coordinates
+                  of the traces, shaped (1,1,ntraces)
+    twtt          two-way travel time values for the samples, in ns
+    tVals         twtt apex times, shaped (ntvals,1,1)
+    v             velocities in this chunk, in m/ns
 
-# ##### Some helper functions
-# def nextpow2(i):
-#     n = 1
-#     while n < i: n *= 2
-#     return n
+    OUTPUT:
+    hypStAmp      hyperbolic stacked amplitudes for the velocities
+                  in this chunk, shaped (ntvals,len(v))
+    '''
+    v = np.reshape(v,(1,-1,1))
+    t = np.sqrt(x2 + 4*np.power(tVals/2.0 * v,2.0))/v
+    return stackAlong(data,t,twtt)
 
 
-# def padMat(mat,nrow,ncol):
-#     padheight=nrow-mat.shape[0]
-#     padwidth=ncol-mat.shape[1]
-#     if padheight>0: 
-#         mat = np.concatenate((mat,np.zeros((padheight,mat.shape[1]))))
-#     if padwidth>0:    
-#         pad = np.zeros((nrow,padwidth))
-#         mat = np.concatenate((mat,pad),axis=1)
-#     return mat
 
+# Arguments of hypStackChunk in the processes of a process pool
+hypStackArgs = None
 
-# def padVec(vec,totlen):
-#     padwidth=totlen-len(vec)
-#     if padwidth>0:
-#         vec = np.append(vec,np.zeros(padwidth))
-#     return vec
+def hypStackInit(data,x2,twtt,tVals):
+    '''
+    Helper function for hypStackedAmplitude. Keeps the arguments 
+    that are the same for all chunks in a pool process.
+    '''
+    global hypStackArgs
+    hypStackArgs = (data,x2,twtt,tVals)
 
 
-##### Testing / trying to improve performance:
-def linStackedAmplitude_alt1(data,profilePos,twtt,vVals,tVals,typefact):
+def hypStackWorker(v):
     '''
-    Calculates the linear stacked amplitudes for each two-way 
-    travel time sample and the provided velocity range 
-    by summing the pixels of the data that follow a line given 
-    by the two-way travel time zero offset and the velocity.
+    Helper function for hypStackedAmplitude. Calculates one chunk
+    of velocities in a pool process.
+    '''
+    return hypStackChunk(*hypStackArgs,v)
+
+
+
+def semblance(data,profilePos,twtt,vVals,tVals,typefact,window=5,moveout='hyp',vchunk=None):
+    '''
+    Calculates the semblance (normalized coherence) for each two-way
+    travel time and the provided velocity range. The data are 
+    interpolated linearly between the samples along the hyperbola 
+    (or line) given by the two-way travel time apex (or zero offset) 
+    and the velocity. The semblance is the energy of the stacked 
+    trace divided by the number of traces times the summed energy 
+    of the individual traces, both summed over a time window. 
+    Values are between 0 and 1.
+
+    The window sums are calculated from running sums, so the cost 
+    does not depend on the window width.
 
     INPUT:
     data          data matrix whose columns contain the traces
     profilePos    along-profile coordinates of the traces
     twtt          two-way travel time values for the samples, in ns
     vVals         list of velocity values for which to calculate the
-                  linear stacked amplitudes, in m/ns
-    tVals         list of twtt zero-offsets for which to calculate
-                  the linear stacked amplitudes, in ns
+                  semblance, in m/ns
+    tVals         list of equally spaced twtt apex times (or zero 
+                  offsets) for which to calculate the semblance, in ns
     typefact      factor for antenna separation depending if this is
                   for CMP (typefact=2) or WARR (typefact=1) data
+    window        time window width [in "number of tVals"] 
+                  [default: 5]
+    moveout       "hyp" for hyperbolic or "lin" for linear moveout
+                  [default: "hyp"]
+    vchunk        how many velocities to treat at once. Limits the 
+                  memory use [default: None, meaning chosen such that
+                  temporary arrays have at most 2**22 elements]
 
     OUTPUT:
-    linStAmp      matrix containing the linear stacked amplitudes
-                  for the given data, tVals, and vVals
+    semb          matrix containing the semblance for the given 
+                  data, tVals, and vVals
     '''
-    linStAmp=np.zeros((len(tVals),len(vVals)))
-    f = interp.interp2d(profilePos, twtt, data)        
-    for vi in  tqdm(range(0,len(vVals))):
-        for ti in range(0,len(tVals)):
-            t = tVals[ti] + typefact*profilePos/vVals[vi]            
-            vals = np.diagonal(np.asmatrix(f(profilePos, t)))
-            linStAmp[ti,vi] = np.abs(sum(vals)/len(vals))
-    return linStAmp
+    if moveout not in ['hyp','lin']:
+        raise ValueError("Unknown moveout '%s'. Use 'hyp' or 'lin'" %(moveout))
+    # Integer data is interpolated in place, which needs floating point
+    data = np.ascontiguousarray(data,dtype=floatType(data))
+    profilePos = np.asarray(profilePos).reshape((1,1,-1))
+    tVals = np.asarray(tVals).reshape((-1,1,1))
+    vVals = np.asarray(vVals)
+    stackpow = np.zeros((tVals.shape[0],len(vVals)))
+    tracepow = np.zeros((tVals.shape[0],len(vVals)))
+    if vchunk is None:
+        vchunk = stackChunk(tVals.shape[0],data.shape[1])
+    for vstart in tqdm(range(0,len(vVals),vchunk)):
+        vend = min(vstart+vchunk,len(vVals))
+        stackpow[:,vstart:vend], tracepow[:,vstart:vend] = semblanceChunk(data,profilePos,twtt,tVals,
+                                                                          vVals[vstart:vend],
+                                                                          typefact,moveout)
+    # Sum over the time window
+    if window > 1:
+        halfwid = int(np.ceil(window/2.0))
+        stackpow,count = windowSum(stackpow,halfwid,axis=0)
+        tracepow,count = windowSum(tracepow,halfwid,axis=0)
+    # Window sums of (almost) no energy are only rounding 
+    # errors of the running sums, set their semblance to zero
+    semb = np.zeros(stackpow.shape)
+    np.divide(stackpow,tracepow,out=semb,
+              where=tracepow>1e-12*np.max(tracepow,initial=0))
+    return np.clip(semb,0,1)
 
 
-def linStackedAmplitude_alt2(data,profilePos,twtt,vVals,tVals,typefact):
+
+def semblanceChunk(data,profilePos,twtt,tVals,v,typefact,moveout):
     '''
-    Calculates the linear stacked amplitudes for each two-way 
-    travel time sample and the provided velocity range 
-    by summing the pixels of the data that follow a line given 
-    by the two-way travel time zero offset and the velocity.
+    Helper function for semblance. Calculates for one chunk of 
+    velocities the energy of the stacked trace and the number of 
+    traces times the summed energy of the individual traces, 
+    for each two-way travel time.
 
     INPUT:
-    data          data matrix whose columns contain the traces
-    profilePos    along-profile coordinates of the traces
+    data          C-contiguous data matrix whose columns contain 
+                  the traces
+    profilePos    along-profile coordinates of the traces,
+                  shaped (1,1,ntraces)
     twtt          two-way travel time values for the samples, in ns
-    vVals         list of velocity values for which to calculate the
-                  linear stacked amplitudes, in m/ns
-    tVals         list of twtt zero-offsets for which to calculate
-                  the linear stacked amplitudes, in ns
+    tVals         twtt apex times (or zero offsets), shaped (ntvals,1,1)
+    v             velocities in this chunk, in m/ns
     typefact      factor for antenna separation depending if this is
                   for CMP (typefact=2) or WARR (typefact=1) data
+    moveout       "hyp" for hyperbolic or "lin" for linear moveout
 
     OUTPUT:
-    linStAmp      matrix containing the linear stacked amplitudes
-                  for the given data, tVals, and vVals
-    '''    
-    linStAmp=np.zeros((len(tVals),len(vVals)))
-    
-    tVals = np.asmatrix(tVals).transpose()   
-    for vi in tqdm(range(0,len(vVals))):
-        t = tVals + typefact*profilePos/vVals[vi]
-        tindices = (np.round((t-twtt[0])/(twtt[3]-twtt[2]))).astype(int)
-        for ti in range(0,len(tVals)):
-            # The tindices will be sorted, can use searchsorted because
-            # the wave doesn't turn around           
-            maxi = np.searchsorted(np.ravel(tindices[ti,:]),len(twtt))
-            pixels = data[(tindices[ti,0:maxi],np.arange(0,maxi))]
-            linStAmp[ti,vi]=np.abs(np.sum(pixels)/pixels.shape[1])
-    return linStAmp
+    stackpow      squared sum over the traces, shaped (ntvals,len(v))
+    tracepow      number of traces times the sum over the squared 
+                  traces, shaped (ntvals,len(v))
+    '''
+    nsamp = len(twtt)
+    ntraces = data.shape[1]
+    v = np.reshape(v,(1,-1,1))
+    if moveout == 'hyp':
+        t = np.sqrt(np.power(typefact*profilePos,2.0) + 4*np.power(tVals/2.0 * v,2.0))/v
+    else:
+        t = tVals + typefact*profilePos/v
+    # Fractional sample index, calculated in place
+    t -= twtt[0]
+    t /= (twtt[3]-twtt[2])
+    valid = (t >= 0) & (t <= nsamp-1)
+    t[~valid] = 0
+    # Index of the sample before, and weight of the sample after
+    ind = np.minimum(np.floor(t).astype(int),nsamp-2)
+    t -= ind
+    ind *= ntraces
+    ind += np.arange(0,ntraces)
+    flat = data.ravel()
+    # Linear interpolation between the samples
+    vals = np.take(flat,ind+ntraces)
+    vals -= np.take(flat,ind)
+    vals *= t
+    vals += np.take(flat,ind)
+    vals[~valid] = 0
+    stackpow = np.square(np.sum(vals,axis=-1,dtype=np.float64))
+    tracepow = np.sum(valid,axis=-1)*np.sum(np.square(vals),axis=-1,dtype=np.float64)
+    return stackpow, tracepow
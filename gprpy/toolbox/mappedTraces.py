@@ -0,0 +1,120 @@
+import numpy as np
+from numpy.lib.mixins import NDArrayOperatorsMixin
+
+
+class mappedTraces(NDArrayOperatorsMixin):
+    '''
+    Read-only data matrix that keeps the raw samples in their stored
+    integer or float format, either memory-mapped from the data file
+    or in memory. The samples are only converted to floating point,
+    shifted by the binary offset and scaled when they are actually
+    used, for example when a processing step or plotting turns the
+    data into a numpy array. Slicing with plain slices stays lazy.
+
+    INPUT:
+    raw         (possibly transposed or sliced) np.memmap or array
+                whose columns contain the traces
+    offset      binary offset that is subtracted from the raw samples,
+                for example to turn unsigned integers into signed
+                values [default: 0]
+    dtype       floating point type of the converted data
+                [default: np.float64]
+    blocksize   number of rows or columns converted at a time when
+                the whole matrix is read [default: 4096]
+    scale       factor the samples are multiplied with after
+                subtracting the offset [default: 1]
+    '''
+    def __init__(self,raw,offset=0,dtype=np.float64,blocksize=4096,scale=1):
+        self.raw = raw
+        self.offset = offset
+        self.scale = scale
+        self.dtype = np.dtype(dtype)
+        self.blocksize = blocksize
+
+    @property
+    def shape(self):
+        return self.raw.shape
+
+    @property
+    def ndim(self):
+        return self.raw.ndim
+
+    @property
+    def size(self):
+        return self.raw.size
+
+    @property
+    def nbytes(self):
+        return self.raw.size*self.dtype.itemsize
+
+    @property
+    def T(self):
+        return self.transpose()
+
+    def __len__(self):
+        return len(self.raw)
+
+    def __repr__(self):
+        return "mappedTraces(shape=%s, dtype=%s, stored as %s)" %(self.shape,self.dtype,self.raw.dtype)
+
+    def view(self,raw):
+        '''
+        Helper function. Wraps other raw samples with the same
+        offset, scale and data type.
+        '''
+        return mappedTraces(raw,self.offset,self.dtype,self.blocksize,self.scale)
+
+    def convert(self,raw):
+        '''
+        Helper function. Converts raw samples to the processing
+        data type, removes the binary offset and applies the scale.
+        '''
+        data = np.asarray(raw).astype(self.dtype)
+        if self.offset != 0:
+            data -= self.offset
+        if self.scale != 1:
+            data *= self.scale
+        return data
+
+    def __getitem__(self,key):
+        keys = key if isinstance(key,tuple) else (key,)
+        if all(isinstance(k,slice) or k is Ellipsis for k in keys):
+            # Basic slicing gives another view into the file
+            return self.view(self.raw[key])
+        return self.convert(self.raw[key])
+
+    def __array__(self,dtype=None,copy=None):
+        if copy is False:
+            raise ValueError("mappedTraces data can't be turned into an array without a copy")
+        # Convert block-wise along the axis that is contiguous on disk
+        # to avoid a temporary copy of the raw data in memory
+        axis = int(np.argmax(np.abs(self.raw.strides))) if self.ndim > 1 else 0
+        data = np.empty(self.shape,dtype=self.dtype)
+        n = self.shape[axis]
+        for start in range(0,n,self.blocksize):
+            sl = [slice(None)]*self.ndim
+            sl[axis] = slice(start,min(start+self.blocksize,n))
+            data[tuple(sl)] = self.convert(self.raw[tuple(sl)])
+        if dtype is not None:
+            data = data.astype(dtype,copy=False)
+        return data
+
+    def __array_ufunc__(self,ufunc,method,*inputs,**kwargs):
+        inputs = [np.asarray(x) if isinstance(x,mappedTraces) else x for x in inputs]
+        if 'out' in kwargs:
+            kwargs['out'] = tuple(np.asarray(x) if isinstance(x,mappedTraces) else x
+                                  for x in kwargs['out'])
+        return getattr(ufunc,method)(*inputs,**kwargs)
+
+    def __reduce__(self):
+        # Pickling (saving as .gpr) stores the converted data
+        return (np.asarray,(np.asarray(self),))
+
+    def transpose(self):
+        return self.view(self.raw.T)
+
+    def astype(self,dtype,copy=True):
+        return np.asarray(self,dtype=dtype)
+
+    def copy(self):
+        return np.asarray(self)